@@ -2,63 +2,187 @@
 聊天API - 处理聊天消息和居民对话
 """
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, Request, Response
+from sqlalchemy import event, func
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import asyncio
 import random
 import json
+import os
+import threading
+import uuid
 
 from modules.shared.database import get_db, ChatMessage, Invitation, ExternalUser, CommunityMembership, Agents
 from modules.simulation import community_simulation
-from modules.llm import response_generator
-from modules.ai import enhanced_local_chat, smart_chat_handler
+from modules.llm import response_generator, Deadline
+from modules.ai import enhanced_local_chat, smart_chat_handler, generation_scheduler, GenerationJob, conversation_summarizer, near_duplicate_detector
+from modules.shared.realtime import realtime_hub
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 # 添加全局状态跟踪
 active_generations = {}  # 跟踪正在生成回复的AI居民
 
+WS_HEARTBEAT_SECONDS = 25  # WebSocket空闲时的心跳间隔
+WS_SNAPSHOT_LIMIT = 50     # 无法续传时下发的最近消息数
+DEFAULT_ROOM = "main"      # 目前只有一个公共聊天室
+
+# SSE流式传输参数
+SSE_FLUSH_INTERVAL_MS = 50       # 默认刷新间隔
+SSE_FLUSH_BYTES = 256            # 默认字节阈值
+SSE_MAX_FRAME_BYTES = 4096
+SSE_MAX_FRAME_CHARS = 1024       # 单帧最多字符数（中文UTF-8约3字节）
+SSE_MAX_POLL_SECONDS = 0.5       # 空闲时最慢的检查间隔
+SSE_HEARTBEAT_SECONDS = 15       # 空闲心跳间隔
+SSE_IDLE_TIMEOUT_SECONDS = 15    # 长时间没有新内容视为超时
+SSE_HEARTBEAT_FRAME = b": heartbeat\n\n"
+
+# 从收到用户消息起，居民回复的LLM调用必须在该时间内完成，否则改用备用回复（需小于SSE空闲超时）
+CHAT_REPLY_DEADLINE_SECONDS = float(os.getenv("CHAT_REPLY_DEADLINE_SECONDS", "10"))
+
+class ChatRoomSequence:
+    """聊天室最新消息ID（内存），用于增量同步和ETag，未变化的轮询无需查询数据库"""
+    
+    def __init__(self):
+        self._last_ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.epoch = uuid.uuid4().hex[:8]  # 进程标识，服务重启后旧ETag自动失效
+    
+    def get(self, room: str, db: Session) -> int:
+        """获取聊天室最新消息ID，首次访问时从数据库初始化"""
+        last_id = self._last_ids.get(room)
+        if last_id is None:
+            db_last_id = db.query(func.max(ChatMessage.id)).scalar() or 0
+            with self._lock:
+                last_id = max(self._last_ids.get(room, 0), db_last_id)
+                self._last_ids[room] = last_id
+        return last_id
+    
+    def bump(self, room: str, message_id: int):
+        """有新消息写入时推进序号（只在已初始化后生效）"""
+        with self._lock:
+            if room in self._last_ids and message_id > self._last_ids[room]:
+                self._last_ids[room] = message_id
+    
+    def etag(self, room: str, last_id: int, view: str = "") -> str:
+        """ETag：进程标识 + 聊天室 + 本次返回内容对应的最新ID + 查询窗口（不同分页/增量起点的响应互不相同）"""
+        return f'"{self.epoch}-{room}-{last_id}-{view}"' if view else f'"{self.epoch}-{room}-{last_id}"'
+
+chat_room_sequence = ChatRoomSequence()
+
+def serialize_chat_message(msg: ChatMessage) -> Dict[str, Any]:
+    """聊天消息转换为响应格式"""
+    return {
+        "id": msg.id,
+        "content": msg.content,
+        "timestamp": msg.timestamp.isoformat(),
+        "sender": msg.sender_name or "系统",
+        "isUser": msg.sender_type == "user",
+        "isAI": msg.sender_type == "ai",
+        "isAgent": msg.sender_type == "agent",
+        "isSystem": msg.sender_type == "system"
+    }
+
+# 所有会话提交的新聊天消息都推进聊天室序号并推送到实时通道（包括邀请等其他模块写入的消息）
+@event.listens_for(Session, "after_flush")
+def _collect_new_chat_messages(session, flush_context):
+    # flush之后已分配ID，在此序列化可避免提交后过期属性的重新加载
+    new_messages = [serialize_chat_message(obj) for obj in session.new if isinstance(obj, ChatMessage)]
+    if new_messages:
+        session.info.setdefault("new_chat_messages", []).extend(new_messages)
+
+@event.listens_for(Session, "after_commit")
+def _publish_new_chat_messages(session):
+    for message_data in session.info.pop("new_chat_messages", []):
+        chat_room_sequence.bump(DEFAULT_ROOM, message_data["id"])
+        try:
+            realtime_hub.publish("message", message_data)
+        except Exception as e:
+            print(f"❌ 推送聊天消息失败: {str(e)}")
+
+@event.listens_for(Session, "after_rollback")
+def _discard_new_chat_messages(session):
+    session.info.pop("new_chat_messages", None)
+
+def update_generation_status(agent_name: str, **fields):
+    """更新居民生成状态并推送状态变化（不含已生成的内容）"""
+    generation = active_generations.setdefault(agent_name, {})
+    generation.update(fields)
+    realtime_hub.publish("status", {
+        "agent_name": agent_name,
+        **{key: value for key, value in generation.items() if key != "content"}
+    })
+
 @router.get("/messages")
 async def get_chat_messages(
+    request: Request,
+    response: Response,
     limit: int = 20,
     offset: int = 0,
+    since_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
     """
     获取聊天消息列表
     包括用户消息、AI助手消息和居民消息
+    
+    增量模式：传入since_id时只返回ID更大的新消息，最多limit条；last_id为本次返回的最后一条消息ID，
+    新消息超过limit条时has_more为True，客户端从last_id继续获取，不会跳过消息；
+    没有新消息或If-None-Match与当前ETag一致时直接返回304，不查询数据库
     """
     try:
-        # 从数据库获取聊天消息
-        messages = db.query(ChatMessage)\
-                    .order_by(ChatMessage.timestamp.desc())\
-                    .offset(offset)\
-                    .limit(limit)\
-                    .all()
+        room_last_id = chat_room_sequence.get(DEFAULT_ROOM, db)
         
-        # 转换为响应格式
-        message_list = []
-        for msg in reversed(messages):  # 反转以获得正确的时间顺序
-            message_data = {
-                "id": msg.id,
-                "content": msg.content,
-                "timestamp": msg.timestamp.isoformat(),
-                "sender": msg.sender_name or "系统",
-                "isUser": msg.sender_type == "user",
-                "isAI": msg.sender_type == "ai",
-                "isAgent": msg.sender_type == "agent",
-                "isSystem": msg.sender_type == "system"
-            }
-            message_list.append(message_data)
+        if since_id is not None:
+            view = f"since{since_id}-limit{limit}"
+            if since_id >= room_last_id:
+                return Response(status_code=304, headers={"ETag": chat_room_sequence.etag(DEFAULT_ROOM, since_id, view)})
+            
+            # 增量：按ID正序取新消息
+            messages = db.query(ChatMessage)\
+                        .filter(ChatMessage.id > since_id)\
+                        .order_by(ChatMessage.id.asc())\
+                        .limit(limit)\
+                        .all()
+            message_list = [serialize_chat_message(msg) for msg in messages]
+            last_id = messages[-1].id if messages else since_id
+            has_more = len(messages) == limit and last_id < room_last_id
+            if not has_more:
+                last_id = max(last_id, room_last_id)
+            
+            # 按实际返回的内容生成ETag；同一起点在批次不完整时内容会随新消息变化，因此不据此返回304
+            response.headers["ETag"] = chat_room_sequence.etag(DEFAULT_ROOM, last_id, view)
+        else:
+            # 同一窗口（offset/limit）在没有新消息时内容不变，可以直接返回304
+            etag = chat_room_sequence.etag(DEFAULT_ROOM, room_last_id, f"offset{offset}-limit{limit}")
+            if request.headers.get("if-none-match") == etag:
+                return Response(status_code=304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
+            
+            # 从数据库获取聊天消息
+            messages = db.query(ChatMessage)\
+                        .order_by(ChatMessage.timestamp.desc())\
+                        .offset(offset)\
+                        .limit(limit)\
+                        .all()
+            
+            # 转换为响应格式
+            message_list = []
+            for msg in reversed(messages):  # 反转以获得正确的时间顺序
+                message_list.append(serialize_chat_message(msg))
+            has_more = len(messages) == limit
+            # 最新一页已包含最新消息；更早的分页只同步到本页最大的ID
+            last_id = room_last_id if offset == 0 else max((msg.id for msg in messages), default=0)
         
         return {
             "success": True,
             "data": {
                 "messages": message_list,
                 "total": len(message_list),
-                "has_more": len(messages) == limit
+                "has_more": has_more,
+                "last_id": last_id
             }
         }
         
@@ -108,8 +232,8 @@ async def send_message(
             db.commit()
             print(f"🤖 AI助手快速回复: {ai_response}")
         
-        # 立即启动异步AI居民处理（不等待）
-        asyncio.create_task(process_ai_residents_async(message, db))
+        # 选出参与的居民后交给生成调度器（不等待生成完成）
+        scheduled = schedule_ai_residents(await prepare_ai_residents(message, db), message)
         
         # 立即返回响应，不等待AI居民处理完成
         return {
@@ -119,6 +243,7 @@ async def send_message(
                 "user_message": message,
                 "ai_response": ai_response,
                 "agents_processing": "异步处理中...",
+                "scheduled": scheduled,
                 "timestamp": datetime.now().isoformat()
             }
         }
@@ -165,8 +290,8 @@ def generate_quick_ai_response(message: str) -> str:
         ]
         return random.choice(responses)
 
-async def process_ai_residents_async(message: str, db: Session):
-    """异步处理AI居民回复 - 重新设计：并行生成+实时流式传输"""
+async def prepare_ai_residents(message: str, db: Session) -> List[Dict[str, Any]]:
+    """选出参与对话的居民（在请求内完成，只使用请求的数据库会话）"""
     try:
         # 初始化AI成员档案（如果需要）
         if not smart_chat_handler.agent_profiles:
@@ -196,36 +321,43 @@ async def process_ai_residents_async(message: str, db: Session):
         # 获取参与对话的居民（不生成LLM，只是准备参数）
         participating_agents = await smart_chat_handler.get_participating_agents_info(message, db)
         print(f"🎭 选择了 {len(participating_agents)} 个AI居民参与对话")
-        
-        # 立即为每个居民启动独立的生成和流式传输任务
-        tasks = []
-        for agent_info in participating_agents:
-            # 为每个居民创建完全独立的异步任务
-            task = asyncio.create_task(
-                process_single_agent_realtime(agent_info, message, db)
-            )
-            tasks.append(task)
-            
-        # 不等待任务完成，让它们完全并行运行
-        # 每个居民将独立生成LLM并实时流式传输
-        asyncio.gather(*tasks, return_exceptions=True)
+        return participating_agents
         
     except Exception as e:
-        print(f"❌ 异步处理AI居民回复失败: {str(e)}")
+        print(f"❌ 选择AI居民失败: {str(e)}")
+        return []
 
-async def process_single_agent_realtime(agent_info: dict, user_message: str, db: Session):
-    """单个AI居民的实时生成和流式传输"""
+def schedule_ai_residents(participating_agents: List[Dict[str, Any]], message: str) -> Dict[str, Any]:
+    """为每个参与的居民提交生成任务，新消息会取消旧消息尚未完成的生成"""
+    jobs = []
+    deadline = Deadline.after(CHAT_REPLY_DEADLINE_SECONDS)
+    for agent_info in participating_agents:
+        agent_info["deadline"] = deadline
+        agent_info["room"] = DEFAULT_ROOM
+        async def run(db: Session, job: GenerationJob, agent_info: dict = agent_info):
+            await process_single_agent_realtime(agent_info, message, db, job)
+        jobs.append(GenerationJob(DEFAULT_ROOM, agent_info["agent_name"], run))
+    
+    result = generation_scheduler.submit(DEFAULT_ROOM, jobs)
+    if result["shed"] or result["superseded"]:
+        print(f"🚦 生成调度: 丢弃 {result['shed']} 个，取消旧消息任务 {result['superseded']} 个")
+    return result
+
+async def process_single_agent_realtime(agent_info: dict, user_message: str, db: Session, job: Optional[GenerationJob] = None):
+    """单个AI居民的实时生成和流式传输（db为调度任务独占的会话）"""
     agent_name = agent_info["agent_name"]
     
     try:
         # 立即标记该居民开始生成
-        active_generations[agent_name] = {
-            "status": "generating",
-            "start_time": datetime.now().isoformat(),
-            "content": "",
-            "progress": 0.0,
-            "is_streaming": False
-        }
+        active_generations.pop(agent_name, None)
+        update_generation_status(
+            agent_name,
+            status="generating",
+            start_time=datetime.now().isoformat(),
+            content="",
+            progress=0.0,
+            is_streaming=False
+        )
         print(f"🎭 {agent_name} 开始实时生成回复...")
         
         # 短暂的个性化延迟
@@ -233,20 +365,25 @@ async def process_single_agent_realtime(agent_info: dict, user_message: str, db:
         await asyncio.sleep(min(delay, 2.0))
         
         # 立即切换到流式传输状态
-        active_generations[agent_name]["status"] = "streaming"
-        active_generations[agent_name]["is_streaming"] = True
+        update_generation_status(agent_name, status="streaming", is_streaming=True)
         print(f"📡 {agent_name} 开始实时LLM生成和流式传输")
         
         # 实时调用LLM生成，边生成边流式传输
-        await generate_and_stream_llm_response(agent_name, agent_info, user_message, db)
+        await generate_and_stream_llm_response(agent_name, agent_info, user_message, db, job)
         
+    except asyncio.CancelledError:
+        # 被更新的用户消息取代
+        print(f"⏹️ {agent_name} 的回复已被新消息取代")
+        if agent_name in active_generations:
+            update_generation_status(agent_name, status="cancelled")
+            asyncio.create_task(cleanup_generation_status(agent_name, 0))
+        raise
     except Exception as e:
         print(f"❌ {agent_name} 实时处理失败: {str(e)}")
         if agent_name in active_generations:
-            active_generations[agent_name]["status"] = "error"
-            active_generations[agent_name]["error"] = str(e)
+            update_generation_status(agent_name, status="error", error=str(e))
 
-async def generate_and_stream_llm_response(agent_name: str, agent_info: dict, user_message: str, db: Session):
+async def generate_and_stream_llm_response(agent_name: str, agent_info: dict, user_message: str, db: Session, job: Optional[GenerationJob] = None):
     """实时生成LLM回复并流式传输"""
     try:
         # 使用smart_chat_handler实时生成LLM回复
@@ -256,8 +393,12 @@ async def generate_and_stream_llm_response(agent_name: str, agent_info: dict, us
         
         if not llm_response:
             print(f"❌ {agent_name} LLM生成失败")
-            active_generations[agent_name]["status"] = "error"
+            update_generation_status(agent_name, status="error")
             return
+        
+        # 回复已生成，之后的新消息不再取消该任务
+        if job:
+            job.shield()
             
         print(f"✅ {agent_name} LLM生成成功，开始逐字符流式传输")
         
@@ -274,6 +415,13 @@ async def generate_and_stream_llm_response(agent_name: str, agent_info: dict, us
             active_generations[agent_name]["current_pos"] = i + 1
             active_generations[agent_name]["progress"] = (i + 1) / len(full_response)
             
+            # 逐字增量只推送给在线订阅者，不进入补发缓冲区
+            realtime_hub.publish("token", {
+                "agent_name": agent_name,
+                "text": char,
+                "progress": active_generations[agent_name]["progress"]
+            }, durable=False)
+            
             # 模拟打字速度
             char_delay = 0.02 + (0.01 * (1 if char in '，。！？' else 0.5))
             await asyncio.sleep(char_delay)
@@ -286,43 +434,42 @@ async def generate_and_stream_llm_response(agent_name: str, agent_info: dict, us
             timestamp=datetime.now()
         )
         
-        # 创建新的数据库会话
-        from modules.shared.database import SessionLocal
-        local_db = SessionLocal()
         try:
-            local_db.add(agent_message)
-            local_db.commit()
+            db.add(agent_message)
+            db.commit()
             print(f"💾 {agent_name} 回复已保存到数据库")
             
             # 标记完成
             active_generations[agent_name] = {
-                "status": "completed",
-                "start_time": active_generations[agent_name]["start_time"],
-                "content": full_response,
-                "progress": 1.0,
-                "completed_time": datetime.now().isoformat()
+                "start_time": active_generations[agent_name]["start_time"]
             }
+            update_generation_status(
+                agent_name,
+                status="completed",
+                content=full_response,
+                progress=1.0,
+                completed_time=datetime.now().isoformat()
+            )
             
             # 3秒后清理状态
             asyncio.create_task(cleanup_generation_status(agent_name, 3.0))
             
         except Exception as e:
             print(f"❌ 保存 {agent_name} 回复失败: {str(e)}")
-            local_db.rollback()
-            active_generations[agent_name]["status"] = "error"
-        finally:
-            local_db.close()
+            db.rollback()
+            update_generation_status(agent_name, status="error")
             
     except Exception as e:
         print(f"❌ {agent_name} LLM生成和流式传输失败: {str(e)}")
         if agent_name in active_generations:
-            active_generations[agent_name]["status"] = "error"
+            update_generation_status(agent_name, status="error")
 
 async def cleanup_generation_status(agent_name: str, delay: float):
     """清理生成状态"""
     await asyncio.sleep(delay)
-    if agent_name in active_generations:
+    if agent_name in active_generations and active_generations[agent_name].get("status") in ("completed", "error", "cancelled"):
         del active_generations[agent_name]
+        realtime_hub.publish("status", {"agent_name": agent_name, "status": "idle"})
         print(f"🧹 清理了 {agent_name} 的生成状态")
 
 @router.get("/status")
@@ -353,7 +500,13 @@ async def get_chat_status(db: Session = Depends(get_db)):
                 "agent_messages": agent_messages,
                 "active_agents": active_agents,
                 "active_agent_count": len(active_agents),
-                "chat_system_status": "smart_chat" if smart_chat_handler.agent_profiles else "not_initialized"
+                "chat_system_status": "smart_chat" if smart_chat_handler.agent_profiles else "not_initialized",
+                "generation_queue": {
+                    "queued": generation_scheduler.queued_count,
+                    "running": generation_scheduler.running_count
+                },
+                "conversation_summary": conversation_summarizer.get_status(),
+                "duplicate_filter": near_duplicate_detector.get_status()
             }
         }
         
@@ -372,81 +525,107 @@ async def get_agent_status():
         "success": True,
         "data": {
             "active_generations": active_generations,
+            "scheduler": generation_scheduler.get_status(),
             "timestamp": datetime.now().isoformat()
         }
     }
 
 @router.get("/stream/{agent_name}")
-async def stream_agent_response(agent_name: str, db: Session = Depends(get_db)):
-    """真正的实时流式传输AI居民回复"""
+async def stream_agent_response(
+    agent_name: str,
+    flush_ms: int = SSE_FLUSH_INTERVAL_MS,
+    flush_bytes: int = SSE_FLUSH_BYTES
+):
+    """
+    实时流式传输AI居民回复
+    
+    新增内容先合并，到达刷新间隔(flush_ms)或字节阈值(flush_bytes)时作为一帧发出；
+    没有新内容时逐步放慢检查频率，空闲期间只发送SSE注释心跳
+    """
     from fastapi.responses import StreamingResponse
-    import json
-    import asyncio
     
-    print(f"🎬 收到 {agent_name} 的流式传输请求")
+    flush_interval = max(10, min(flush_ms, 1000)) / 1000.0
+    flush_threshold = max(1, min(flush_bytes, SSE_MAX_FRAME_BYTES))
+    
+    # 每个连接只编码一次的帧模板
+    agent_json = json.dumps(agent_name, ensure_ascii=False)
+    content_template = 'data: {"type":"content","agent_name":' + agent_json.replace("%", "%%") + ',"text":%s,"progress":%.3f,"total_length":%d}\n\n'
+    waiting_frame = ('data: {"type":"waiting","agent_name":' + agent_json + '}\n\n').encode("utf-8")
+    complete_frame = ('data: {"type":"complete","agent_name":' + agent_json + '}\n\n').encode("utf-8")
+    error_frame = ('data: {"type":"error","agent_name":' + agent_json + '}\n\n').encode("utf-8")
+    timeout_frame = ('data: {"type":"timeout","agent_name":' + agent_json + '}\n\n').encode("utf-8")
+    
+    def encode_content(text: str, progress: float, total_length: int) -> bytes:
+        return (content_template % (json.dumps(text, ensure_ascii=False), progress, total_length)).encode("utf-8")
     
     async def generate_stream():
-        last_pos = 0
-        wait_count = 0
-        max_wait = 150  # 增加等待时间到15秒
+        loop = asyncio.get_running_loop()
+        sent_pos = 0
         sent_waiting = False
+        last_status = None
+        poll_interval = flush_interval
+        rate = 0.0  # 估计的生成速度（字节/秒）
+        last_poll_time = last_progress_time = last_write_time = loop.time()
         
         try:
-            while wait_count < max_wait:
-                # 检查该居民是否有正在生成的回复
-                if agent_name in active_generations:
-                    generation_info = active_generations[agent_name]
+            while True:
+                now = loop.time()
+                generation_info = active_generations.get(agent_name)
+                has_new_content = False
+                
+                if generation_info is not None:
                     current_content = generation_info.get("content", "")
                     status = generation_info.get("status", "")
+                    if status != last_status:
+                        last_status = status
+                        last_progress_time = now
                     
-                    print(f"📊 {agent_name} 状态: {status}, 内容长度: {len(current_content)}")
-                    
-                    # 如果有新内容需要传输
-                    if len(current_content) > last_pos:
-                        new_chars = current_content[last_pos:]
-                        
-                        # 逐字符发送新内容
-                        for i, char in enumerate(new_chars):
-                            chunk_data = {
-                                "type": "content",
-                                "char": char,
-                                "progress": generation_info.get("progress", 0),
-                                "agent_name": agent_name,
-                                "total_length": len(current_content)
-                            }
-                            yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
-                            await asyncio.sleep(0.01)  # 很短的延迟，保证顺序
-                        
-                        last_pos = len(current_content)
+                    if len(current_content) > sent_pos:
+                        # 有新内容：合并为一帧（超过单帧上限时切分）发出
+                        pending = current_content[sent_pos:]
+                        progress = generation_info.get("progress", 0)
+                        observed = len(pending.encode("utf-8")) / max(now - last_poll_time, 0.001)
+                        rate = observed if rate == 0 else 0.7 * rate + 0.3 * observed
+                        while pending:
+                            chunk = pending[:SSE_MAX_FRAME_CHARS]
+                            pending = pending[SSE_MAX_FRAME_CHARS:]
+                            yield encode_content(chunk, progress, len(current_content))
+                        sent_pos = len(current_content)
+                        has_new_content = True
+                        last_progress_time = last_write_time = now
                     
-                    # 检查是否完成
                     if status == "completed":
-                        print(f"✅ {agent_name} 流式传输完成")
-                        yield f"data: {json.dumps({'type': 'complete', 'agent_name': agent_name}, ensure_ascii=False)}\n\n"
+                        yield complete_frame
                         break
                     elif status == "error":
-                        print(f"❌ {agent_name} 生成出错")
-                        yield f"data: {json.dumps({'type': 'error', 'agent_name': agent_name}, ensure_ascii=False)}\n\n"
+                        yield error_frame
                         break
-                        
-                else:
-                    # 如果还没有开始生成，发送等待信号（只发送一次）
-                    if not sent_waiting:
-                        print(f"⏳ {agent_name} 等待开始生成...")
-                        yield f"data: {json.dumps({'type': 'waiting', 'agent_name': agent_name}, ensure_ascii=False)}\n\n"
-                        sent_waiting = True
                 
-                wait_count += 1
-                await asyncio.sleep(0.1)  # 100ms检查一次新内容
-            
-            # 超时处理
-            if wait_count >= max_wait:
-                print(f"⏰ {agent_name} 流式传输超时")
-                yield f"data: {json.dumps({'type': 'timeout', 'agent_name': agent_name}, ensure_ascii=False)}\n\n"
+                elif not sent_waiting:
+                    # 还没有开始生成，发送一次等待信号
+                    yield waiting_frame
+                    sent_waiting = True
+                    last_write_time = now
+                
+                if now - last_progress_time >= SSE_IDLE_TIMEOUT_SECONDS:
+                    yield timeout_frame
+                    break
+                
+                if now - last_write_time >= SSE_HEARTBEAT_SECONDS:
+                    yield SSE_HEARTBEAT_FRAME
+                    last_write_time = now
+                
+                # 生成越快越早醒来，使每帧大致不超过字节阈值；没有新内容时逐步退避
+                if has_new_content:
+                    poll_interval = max(0.01, min(flush_interval, flush_threshold / rate)) if rate > 0 else flush_interval
+                else:
+                    poll_interval = min(poll_interval * 2, SSE_MAX_POLL_SECONDS)
+                last_poll_time = now
+                await asyncio.sleep(poll_interval)
                 
         except Exception as e:
             print(f"❌ {agent_name} 流式传输异常: {str(e)}")
-            yield f"data: {json.dumps({'type': 'error', 'agent_name': agent_name, 'error': str(e)}, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({'type': 'error', 'agent_name': agent_name, 'error': str(e)}, ensure_ascii=False)}\n\n".encode("utf-8")
     
     return StreamingResponse(
         generate_stream(),
@@ -459,4 +638,91 @@ async def stream_agent_response(agent_name: str, db: Session = Depends(get_db)):
             "Access-Control-Allow-Methods": "*",
             "X-Accel-Buffering": "no"  # 禁用nginx缓冲，提高实时性
         }
-    )
\ No newline at end of file
+    )
+
+def _load_recent_messages(limit: int) -> List[Dict[str, Any]]:
+    """读取最近的聊天消息（按时间正序）"""
+    from modules.shared.database import SessionLocal
+    db = SessionLocal()
+    try:
+        messages = db.query(ChatMessage)\
+                    .order_by(ChatMessage.timestamp.desc())\
+                    .limit(limit)\
+                    .all()
+        return [serialize_chat_message(msg) for msg in reversed(messages)]
+    finally:
+        db.close()
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, since: Optional[int] = None):
+    """
+    聊天室多路复用WebSocket通道
+    
+    推送新消息(message)、逐字增量(token)、居民状态(status)和社群统计(stats)；
+    每帧为一个事件数组。带since参数重连时补发该序号之后的持久事件，
+    无法补发（缓冲区已覆盖或服务已重启）时下发最近消息的全量快照
+    """
+    await websocket.accept()
+    
+    # 先订阅再补发，避免两者之间的事件丢失
+    subscription = realtime_hub.subscribe()
+    
+    async def receive_loop():
+        """处理客户端消息（心跳），并及时发现断线"""
+        while True:
+            data = await websocket.receive_json()
+            if isinstance(data, dict) and data.get("type") == "ping":
+                await websocket.send_json([{"type": "pong", "ts": datetime.now().isoformat()}])
+    
+    receiver = asyncio.create_task(receive_loop())
+    try:
+        backlog, complete = realtime_hub.replay(since) if since is not None else ([], False)
+        hello: Dict[str, Any] = {
+            "type": "hello",
+            "seq": realtime_hub.last_seq,
+            "data": {
+                "resumed": complete,
+                "active_generations": {
+                    name: {key: value for key, value in info.items() if key != "content"}
+                    for name, info in active_generations.items()
+                }
+            }
+        }
+        if not complete:
+            hello["data"]["messages"] = await asyncio.to_thread(_load_recent_messages, WS_SNAPSHOT_LIMIT)
+            backlog = []
+        await websocket.send_json([hello] + backlog)
+        
+        # 订阅之后、补发之前产生的事件会同时出现在两处，按序号去重
+        last_sent = backlog[-1]["seq"] if backlog else hello["seq"]
+        while True:
+            getter = asyncio.create_task(subscription.get_batch(timeout=WS_HEARTBEAT_SECONDS))
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                break
+            events = getter.result()
+            if subscription.closed and not events:
+                # 消费过慢被断开，客户端会带序号重连
+                await websocket.close(code=1013, reason="subscriber overflow")
+                break
+            if not events:
+                await websocket.send_json([{"type": "heartbeat", "seq": realtime_hub.last_seq}])
+                continue
+            events = [e for e in events if "seq" not in e or e["seq"] > last_sent]
+            for e in events:
+                if "seq" in e:
+                    last_sent = e["seq"]
+            if events:
+                await websocket.send_json(events)
+    
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    except Exception as e:
+        print(f"❌ WebSocket通道异常: {str(e)}")
+    finally:
+        subscription.close()
+        if receiver.done() and not receiver.cancelled():
+            receiver.exception()  # 取走断线异常，避免未处理警告
+        else:
+            receiver.cancel()
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 from datetime import datetime
 
@@ -62,6 +62,13 @@ async def get_agent_detail(agent_id: str):
     try:
         agent = community_simulation.get_agent_by_id(agent_id)
         if not agent:
+            # 分片模式下的居民只有属性，没有记忆和关系
+            sharded_agent = await community_simulation.get_sharded_agent(agent_id)
+            if sharded_agent:
+                return {
+                    "success": True,
+                    "data": sharded_agent
+                }
             raise HTTPException(status_code=404, detail="居民未找到")
         
         agent_data = agent.to_dict()
@@ -84,6 +91,52 @@ async def get_agent_detail(agent_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取居民详情失败: {str(e)}")
 
+@router.get("/community/agents/{agent_id}/potential-friends")
+async def get_agent_potential_friends(agent_id: str, limit: int = 5):
+    """获取居民当前最兼容的潜在朋友（实时批量评分）"""
+    if not community_simulation.get_agent_by_id(agent_id):
+        raise HTTPException(status_code=404, detail="居民未找到")
+    try:
+        return {
+            "success": True,
+            "data": {
+                "agent_id": agent_id,
+                "potential_friends": community_simulation.get_potential_friends(agent_id, limit)
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取潜在朋友失败: {str(e)}")
+
+@router.get("/community/friendship/recommendations")
+async def get_friendship_recommendations(agent_id: Optional[str] = None):
+    """获取最近一次全量交友推荐（模拟运行时每天计算一次）"""
+    recommendations = community_simulation.friend_recommendations
+    if agent_id is not None:
+        recommendations = {agent_id: recommendations.get(agent_id, [])}
+    updated = community_simulation.friend_recommendations_updated
+    return {
+        "success": True,
+        "data": {
+            "recommendations": recommendations,
+            "updated_at": updated.isoformat() if updated else None
+        }
+    }
+
+@router.post("/community/friendship/recommendations/refresh")
+async def refresh_friendship_recommendations():
+    """立即重新计算全量交友推荐"""
+    try:
+        recommendations = await community_simulation.compute_friendship_recommendations()
+        return {
+            "success": True,
+            "data": {
+                "agent_count": len(recommendations),
+                "updated_at": community_simulation.friend_recommendations_updated.isoformat()
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"计算交友推荐失败: {str(e)}")
+
 @router.get("/community/events")
 async def get_events_history(limit: int = 10):
     """获取事件历史"""
@@ -195,6 +248,7 @@ async def get_stats_summary():
         stats = await community_simulation.get_community_stats()
         simulation_status = community_simulation.get_simulation_status()
         recent_events = await community_simulation.get_recent_events(5)
+        history = community_simulation.stats_history.query(max_points=48)
         
         return {
             "success": True,
@@ -202,8 +256,136 @@ async def get_stats_summary():
                 "community_stats": stats,
                 "simulation_status": simulation_status,
                 "recent_events": recent_events,
+                "history": history,
                 "last_updated": datetime.now().isoformat()
             }
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取统计摘要失败: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"获取统计摘要失败: {str(e)}") 
+
+@router.get("/community/stats/history")
+async def get_stats_history(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    hours: float = 24,
+    resolution: Optional[str] = None,
+    max_points: int = 500
+):
+    """
+    获取社群统计历史（列式数据，适合直接画图）
+    
+    start/end为ISO时间，未指定start时取end之前hours小时；
+    resolution可选raw/minute/hour/day，不指定时按max_points自动选择
+    """
+    try:
+        end_ts = datetime.fromisoformat(end).timestamp() if end else datetime.now().timestamp()
+        start_ts = datetime.fromisoformat(start).timestamp() if start else end_ts - hours * 3600
+        if start_ts > end_ts:
+            raise HTTPException(status_code=400, detail="起始时间晚于结束时间")
+        
+        history = community_simulation.stats_history.query(
+            start=start_ts,
+            end=end_ts,
+            resolution=resolution,
+            max_points=max(1, min(max_points, 5000))
+        )
+        
+        return {
+            "success": True,
+            "data": history
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取统计历史失败: {str(e)}")
+
+@router.get("/community/journal")
+async def get_journal_status(limit: int = 20):
+    """获取事件日志状态和最近记录"""
+    try:
+        journal = community_simulation.journal
+        if journal is None:
+            raise HTTPException(status_code=503, detail="事件日志未启用")
+        
+        return {
+            "success": True,
+            "data": {
+                "status": journal.get_status(),
+                "recent_records": journal.get_recent_records(limit)
+            }
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取事件日志失败: {str(e)}")
+
+@router.get("/community/journal/replay")
+async def replay_journal(seq: Optional[int] = None):
+    """重放事件日志到指定序号，返回当时的社群状态（只读）"""
+    try:
+        state = community_simulation.replay_journal(seq)
+        agents = list(state["agents"].values())
+        population = len(agents)
+        
+        def average(stat: str) -> int:
+            return int(sum(agent["stats"][stat] for agent in agents) / population) if population else 50
+        
+        return {
+            "success": True,
+            "data": {
+                "seq": state["seq"],
+                "community_stats": {
+                    "population": population,
+                    "happiness": average("happiness"),
+                    "health": average("health"),
+                    "education": average("education"),
+                    "economy": average("wealth")
+                },
+                "agents": agents,
+                "recent_events": state["events"][-10:]
+            }
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"重放事件日志失败: {str(e)}")
+
+@router.post("/community/journal/snapshot")
+async def create_journal_snapshot():
+    """立即写入快照并压缩旧日志"""
+    try:
+        if community_simulation.journal is None:
+            raise HTTPException(status_code=503, detail="事件日志未启用")
+        seq = community_simulation.write_journal_snapshot()
+        
+        return {
+            "success": True,
+            "message": "快照已写入",
+            "data": {**community_simulation.journal.get_status(), "snapshot_seq": seq}
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"写入快照失败: {str(e)}")
+
+@router.post("/community/journal/rollback")
+async def rollback_journal(seq: int):
+    """把社群状态回滚到指定序号"""
+    try:
+        result = community_simulation.rollback_to(seq)
+        
+        return {
+            "success": True,
+            "message": f"已回滚到序号 {seq}",
+            "data": result
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"回滚失败: {str(e)}")
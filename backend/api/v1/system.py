@@ -4,18 +4,23 @@
 
 from fastapi import APIRouter, HTTPException
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, Any
 import asyncio
 import logging
 
-from modules.llm import get_llm_config, validate_llm_config, response_generator, command_parser
+from modules.llm import get_llm_config, validate_llm_config, reload_llm_config, llm_config_manager, response_generator, command_parser
+from modules.shared.env_file import apply_env_file
 from modules.simulation import community_simulation
+from modules.shared.aggregation import AggregatePart, gather_parts
 
 router = APIRouter(prefix="/system", tags=["system"])
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+ENV_FILE = Path(__file__).resolve().parents[2] / ".env"
+
 @router.get("/llm/status")
 async def get_llm_status():
     """获取LLM连接状态"""
@@ -33,6 +38,7 @@ async def get_llm_status():
                 "client_initialized": client_status["client_initialized"],
                 "provider": client_status["provider"],
                 "model": client_status["model"],
+                "config_version": config.version,
                 "max_tokens": config.max_tokens,
                 "temperature": config.temperature,
                 "timeout": config.timeout,
@@ -51,6 +57,37 @@ async def get_llm_status():
             "timestamp": datetime.now().isoformat()
         }
 
+@router.post("/llm/reload")
+async def reload_llm_configuration(reread_env_file: bool = True, force: bool = False):
+    """重新加载LLM配置，有变化时重建客户端和限流器；重新读取.env时文件中删除的变量会从环境中移除"""
+    try:
+        if reread_env_file:
+            apply_env_file(ENV_FILE)
+        config, changed = reload_llm_config(force)
+        is_valid, message = validate_llm_config()
+        
+        return {
+            "success": True,
+            "data": {
+                "changed": changed,
+                "config_version": config.version,
+                "config_valid": is_valid,
+                "config_message": message,
+                "client_initialized": response_generator.client is not None,
+                "provider": config.provider.value,
+                "model": config.model,
+                "config_status": llm_config_manager.get_status(),
+                "timestamp": datetime.now().isoformat()
+            }
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"重新加载LLM配置失败: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }
+
 @router.post("/llm/test")
 async def test_llm_connection():
     """测试LLM连接和功能"""
@@ -110,6 +147,15 @@ async def test_llm_connection():
                 if hasattr(response, 'usage') and response.usage:
                     test_results["logs"].append(f"📊 Token使用: {response.usage.total_tokens}")
                 
+                # 记录连接池情况
+                pool_status = response_generator.get_client_status()["http_pool"]
+                if pool_status:
+                    metrics = pool_status["metrics"]
+                    test_results["logs"].append(
+                        f"🔌 连接池: {pool_status['connections']}条连接, HTTP/2={pool_status['http2']}, "
+                        f"复用{metrics['reused_connections']}次, 等待连接p95={metrics['acquire_wait_ms']['p95']}ms"
+                    )
+                
             except Exception as api_error:
                 test_results["errors"].append(f"❌ API调用失败: {str(api_error)}")
         
@@ -176,48 +222,52 @@ async def test_llm_connection():
             "error": str(e)
         }
 
-@router.get("/status/full")
-async def get_full_system_status():
-    """获取完整系统状态"""
+async def get_llm_data():
+    """LLM状态数据，获取失败时为None"""
+    llm_status_response = await get_llm_status()
+    return llm_status_response["data"] if llm_status_response["success"] else None
+
+def check_database_status() -> str:
+    """执行一次轻量查询检查数据库连接（同步阻塞）"""
+    from modules.shared.database import SessionLocal, CommunityStats
     try:
-        # LLM状态
-        llm_status_response = await get_llm_status()
-        llm_status = llm_status_response["data"] if llm_status_response["success"] else None
-        
-        # 模拟系统状态
-        simulation_status = community_simulation.get_simulation_status()
-        
-        # 社群统计
+        db = SessionLocal()
         try:
-            community_stats = await community_simulation.get_community_stats()
-        except:
-            community_stats = None
-        
-        # 数据库状态
-        from modules.shared.database import SessionLocal, CommunityStats
-        db_status = "disconnected"
-        try:
-            db = SessionLocal()
             db.query(CommunityStats).first()
-            db_status = "connected"
+        finally:
             db.close()
-        except:
-            db_status = "error"
+        return "connected"
+    except Exception:
+        return "error"
+
+@router.get("/status/full")
+async def get_full_system_status():
+    """获取完整系统状态"""
+    try:
+        # 各部分并发获取，数据库检查在线程池中执行
+        results, parts = await gather_parts({
+            "llm": AggregatePart(get_llm_data),
+            "simulation": AggregatePart(community_simulation.get_simulation_status),
+            "community": AggregatePart(community_simulation.get_community_stats),
+            "database": AggregatePart(check_database_status, blocking=True, default="error")
+        })
         
         return {
             "success": True,
             "data": {
                 "timestamp": datetime.now().isoformat(),
-                "llm": llm_status,
-                "simulation": simulation_status,
-                "community": community_stats,
+                "llm": results["llm"],
+                "simulation": results["simulation"],
+                "community": results["community"],
                 "database": {
-                    "status": db_status
+                    "status": results["database"]
                 },
                 "system": {
                     "uptime": "运行中",
                     "version": "1.0.0"
-                }
+                },
+                "partial": any(part["status"] != "ok" for part in parts.values()),
+                "parts": parts
             }
         }
         
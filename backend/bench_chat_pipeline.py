@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+聊天生成链路离线压测
+使用进程内的模拟LLM服务（LLM_PROVIDER=local），按真实的首token延迟和生成速度并发生成居民回复，
+统计端到端延迟分位数、备用回复比例和模拟服务注入的错误数
+
+用法: python bench_chat_pipeline.py [请求数] [并发数]
+模拟服务参数见 .env.example 中的 MOCK_LLM_*
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+# 必须在导入LLM模块之前设置，使全局客户端连接进程内模拟服务
+os.environ["LLM_PROVIDER"] = "local"
+os.environ["LOCAL_LLM_INPROCESS"] = "true"
+os.environ.setdefault("LLM_RATE_LIMIT_RPM", "100000")
+os.environ.setdefault("LLM_RATE_LIMIT_TPM", "100000000")
+
+from modules.llm import response_generator
+
+AGENTS = ["张明", "李华", "王丽", "刘强", "陈静", "赵勇", "孙娜", "周杰"]
+TOPICS = ["周末有什么活动？", "最近工作压力好大", "有什么好书推荐吗", "社区要不要办个运动会"]
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+async def one_request(i: int) -> tuple:
+    agent_name = AGENTS[i % len(AGENTS)]
+    topic = f"{TOPICS[i % len(TOPICS)]}#{i}"
+    start = time.perf_counter()
+    result = await response_generator.generate_agent_conversation_response(
+        agent_info={"name": agent_name, "personality": "乐观开朗", "occupation": "教师", "age": 30, "interests": ["阅读"]},
+        original_topic=topic,
+        conversation_history=[f"玩家: {topic}"],
+        current_conversation=[],
+        agent_own_history=[],
+        community_stats={"happiness": 70, "health": 70, "education": 70, "economy": 70},
+        recent_events=[],
+        is_first_speaker=True
+    )
+    return time.perf_counter() - start, result.get("response_type") == "fallback"
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    if response_generator.client is None:
+        print("❌ 模拟LLM客户端初始化失败")
+        return
+    
+    print(f"🚀 压测 {total} 个请求，并发 {concurrency}\n")
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def limited(i: int):
+        async with semaphore:
+            return await one_request(i)
+    
+    start = time.perf_counter()
+    results = await asyncio.gather(*[limited(i) for i in range(total)])
+    elapsed = time.perf_counter() - start
+    
+    latencies = [latency for latency, _ in results]
+    fallbacks = sum(1 for _, fallback in results if fallback)
+    print(f"  吞吐      {total / elapsed:8.1f} 请求/秒  (总耗时 {elapsed:.2f}s)")
+    print(f"  延迟 p50  {percentile(latencies, 0.50) * 1000:8.0f} ms")
+    print(f"  延迟 p95  {percentile(latencies, 0.95) * 1000:8.0f} ms")
+    print(f"  延迟 p99  {percentile(latencies, 0.99) * 1000:8.0f} ms")
+    print(f"  备用回复  {fallbacks:8d} 次 ({fallbacks / total:.1%})\n")
+    
+    status = response_generator.get_client_status()
+    print(f"请求合并: {status['single_flight']}")
+    print(f"前缀缓存: 命中比例 {status['prompt_cache']['cached_share']}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
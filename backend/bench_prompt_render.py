@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+提示词渲染微基准
+对比逐次 str.format 整个模板（旧做法）与预编译模板+前缀缓存的渲染耗时
+
+用法: python bench_prompt_render.py [每项迭代次数]
+"""
+
+import sys
+import time
+
+from modules.llm import game_prompts
+from modules.llm.prompt_assembly import PromptSegment, assemble_messages, assemble_text
+from modules.ai import optimized_chat_system
+
+AGENTS = ["张明", "李华", "王丽", "刘强", "陈静", "赵勇", "孙娜", "周杰"]
+TOPICS = ["social", "health", "education", "work", "art", "community", "technology", "daily"]
+
+def agent_params(i: int) -> dict:
+    """模拟一次居民对话请求的参数：居民固定、社群状态缓慢变化、消息每次不同"""
+    return {
+        "agent_name": AGENTS[i % len(AGENTS)],
+        "personality": "乐观开朗",
+        "occupation": "教师",
+        "age": 30 + i % len(AGENTS),
+        "interests": "阅读, 旅行",
+        "happiness": 60 + (i // 100) % 10,
+        "health": 70,
+        "education": 65,
+        "economy": 55,
+        "recent_events": "社区举办了读书会",
+        "conversation_summary": "聊天室较早的对话：\n玩家提到「周末去哪玩」，张明、李华参与讨论",
+        "conversation_context": f"玩家: 第{i}条消息\n李华: 我也想去",
+        "original_topic": f"周末有什么活动？#{i}",
+        "is_first_speaker": False
+    }
+
+def legacy_assemble(prompt_name: str, **kwargs):
+    """旧做法：线性检查参数，每次对全部分层调用 str.format 并从头计算哈希"""
+    template = game_prompts.templates[prompt_name]
+    missing_params = [param for param in template.parameters if param not in kwargs]
+    if missing_params:
+        raise ValueError(f"缺少必需参数: {missing_params}")
+    # 通用指令含JSON示例的花括号，先转义再format，模拟旧模板对整段文本的格式化开销
+    return assemble_messages(prompt_name, [
+        PromptSegment("static", template.system_prompt.replace("{", "{{").replace("}", "}}").format()),
+        PromptSegment("persona", template.persona_template.format(**kwargs)),
+        PromptSegment("state", template.state_template.format(**kwargs)),
+        PromptSegment("volatile", template.user_template.format(**kwargs))
+    ])
+
+def legacy_character_prompt(agent_name: str, topic_category: str, conversation_context: list, user_message: str):
+    """旧做法：每次重新构建六大模块"""
+    system = optimized_chat_system
+    profile = system.personality_profiles.get(f"{agent_name}_{system._get_agent_occupation(agent_name)}")
+    return assemble_text([
+        PromptSegment("static", system.system_prompts["base_system"]),
+        PromptSegment("static", system._build_guardrails_section()),
+        PromptSegment("persona", system._build_personality_section(profile)),
+        PromptSegment("persona", system._build_tone_section(profile)),
+        PromptSegment("persona", system._build_tools_section(profile)),
+        PromptSegment("state", system._build_environment_section(topic_category, conversation_context)),
+        PromptSegment("state", system._build_goal_section(topic_category)),
+        PromptSegment("volatile", f"用户消息：{user_message}\n对话历史：{conversation_context[-3:]}")
+    ])
+
+def bench(label: str, fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / iterations * 1e6
+    print(f"  {label:<28} {per_call_us:8.2f} µs/次  ({iterations / elapsed:,.0f} 次/秒)")
+    return per_call_us
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"📏 提示词渲染基准（每项 {iterations} 次）\n")
+    
+    # 结果一致性检查
+    params = agent_params(1)
+    compiled = game_prompts.assemble("agent_conversation_response", **params)
+    legacy = legacy_assemble("agent_conversation_response", **params)
+    assert (compiled.system_prompt, compiled.user_prompt, compiled.prefix_hashes) == \
+        (legacy.system_prompt, legacy.user_prompt, legacy.prefix_hashes), "渲染结果不一致"
+    
+    print("agent_conversation_response:")
+    old = bench("str.format（旧）", lambda i: legacy_assemble("agent_conversation_response", **agent_params(i)), iterations)
+    new = bench("预编译 + 前缀缓存", lambda i: game_prompts.assemble("agent_conversation_response", **agent_params(i)), iterations)
+    print(f"  加速 {old / new:.1f}x\n")
+    
+    print("OptimizedChatSystem.build_character_prompt:")
+    old = bench("逐次构建六大模块（旧）", lambda i: legacy_character_prompt(
+        AGENTS[i % len(AGENTS)], TOPICS[i % len(TOPICS)], [f"消息{i}"], f"你好{i}"), iterations)
+    new = bench("按居民/话题缓存前缀", lambda i: optimized_chat_system.build_character_prompt(
+        AGENTS[i % len(AGENTS)], TOPICS[i % len(TOPICS)], [f"消息{i}"], f"你好{i}"), iterations)
+    print(f"  加速 {old / new:.1f}x\n")
+    
+    print(f"前缀缓存: GamePrompts {game_prompts.get_render_stats()}")
+    print(f"          OptimizedChatSystem {optimized_chat_system._prompt_heads.get_status()}")
+
+if __name__ == "__main__":
+    main()
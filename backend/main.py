@@ -7,34 +7,15 @@ AI社群模拟小游戏 - 后端主入口文件
 import os
 from pathlib import Path
 
+from modules.shared.env_file import apply_env_file
+
 # 加载.env文件
 def load_env():
     """加载.env文件中的环境变量"""
     env_path = Path(__file__).parent / '.env'
     if env_path.exists():
-        try:
-            # 尝试UTF-8编码
-            with open(env_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            try:
-                # 如果UTF-8失败，尝试GBK编码
-                with open(env_path, 'r', encoding='gbk') as f:
-                    content = f.read()
-            except UnicodeDecodeError:
-                # 如果还是失败，尝试latin-1编码
-                with open(env_path, 'r', encoding='latin-1') as f:
-                    content = f.read()
-        
-        # 解析环境变量
-        for line in content.splitlines():
-            line = line.strip()
-            if line and not line.startswith('#') and '=' in line:
-                key, value = line.split('=', 1)
-                key = key.strip()
-                value = value.strip().strip('"').strip("'")  # 去除引号
-                os.environ[key] = value
-                print(f"  {key}={value}")
+        for key, value in apply_env_file(env_path).items():
+            print(f"  {key}={value}")
         
         print(f"✅ 已加载环境变量文件: {env_path}")
     else:
@@ -55,8 +36,11 @@ from datetime import datetime
 from api.v1 import community, commands, chat, system, invitation
 
 # 导入模拟和LLM模块
-from modules.simulation import community_simulation
-from modules.llm import validate_llm_config, response_generator
+from modules.simulation import community_simulation, EventJournal
+from modules.llm import validate_llm_config, response_generator, watch_env_file
+from modules.ai import generation_scheduler, conversation_summarizer
+from modules.shared.health import health_monitor
+from modules.shared.aggregation import AggregatePart, gather_parts
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -92,6 +76,38 @@ app.include_router(chat.router, prefix="/api/v1")
 app.include_router(system.router, prefix="/api/v1")
 app.include_router(invitation.router, prefix="/api/v1")
 
+# 健康检查项：由后台监视器定期执行，探针只读取缓存结果
+def check_database():
+    """数据库：执行一次轻量查询"""
+    from modules.shared.database import SessionLocal, CommunityStats
+    db = SessionLocal()
+    try:
+        db.query(CommunityStats).first()
+        return True, "connected"
+    finally:
+        db.close()
+
+def check_llm():
+    """LLM：配置有效、客户端已初始化且熔断器未打开（不发起网络请求）"""
+    is_valid, message = validate_llm_config()
+    initialized = response_generator.client is not None
+    breaker_state = response_generator.circuit_breaker.state
+    return is_valid and initialized and breaker_state != "open", {
+        "config_message": message,
+        "client_initialized": initialized,
+        "circuit_breaker": breaker_state
+    }
+
+def check_simulation():
+    """社群模拟：模拟循环正在运行"""
+    status = community_simulation.get_simulation_status()
+    return status["is_running"], {"agent_count": status["agent_count"], "last_update": status["last_update"]}
+
+# LLM和模拟不可用时聊天会退回备用回复，不影响就绪
+health_monitor.register("database", check_database, critical=True, blocking=True)
+health_monitor.register("llm", check_llm, critical=False)
+health_monitor.register("simulation", check_simulation, critical=False)
+
 # 启动事件处理
 @app.on_event("startup")
 async def startup_event():
@@ -106,6 +122,37 @@ async def startup_event():
         else:
             logger.warning(f"⚠️ LLM配置问题: {config_message}")
         
+        # 从事件日志恢复社群状态
+        try:
+            journal = EventJournal(directory=os.getenv("SIMULATION_JOURNAL_DIR", "./data/journal"))
+            recovery = community_simulation.recover_from_journal(journal)
+            if recovery["recovered"]:
+                logger.info(f"✅ 已从事件日志恢复社群状态 (序号 {recovery['seq']}, {recovery['agent_count']}名居民)")
+            else:
+                logger.info("✅ 事件日志已初始化")
+        except Exception as journal_error:
+            logger.error(f"❌ 事件日志恢复失败: {str(journal_error)}")
+        
+        # 加载社群统计历史
+        try:
+            community_simulation.stats_history.attach_file(os.getenv("SIMULATION_STATS_FILE", "./data/stats_history.bin"))
+        except Exception as stats_error:
+            logger.error(f"❌ 社群统计历史加载失败: {str(stats_error)}")
+        
+        # 分片模式：SIMULATION_SHARDS大于0时在分片进程中模拟大规模人口
+        num_shards = int(os.getenv("SIMULATION_SHARDS", "0"))
+        if num_shards > 0:
+            try:
+                shard_seed = os.getenv("SIMULATION_SHARD_SEED")
+                shard_status = await community_simulation.enable_sharding(
+                    num_shards,
+                    int(os.getenv("SIMULATION_SHARD_POPULATION", "100000")),
+                    int(shard_seed) if shard_seed else None
+                )
+                logger.info(f"✅ 分片模拟已启动 ({shard_status['num_shards']}个分片, {shard_status['population']}名居民)")
+            except Exception as shard_error:
+                logger.error(f"❌ 分片模拟启动失败: {str(shard_error)}")
+        
         # 启动社群模拟
         await community_simulation.start_simulation()
         logger.info("✅ AI社群模拟引擎已启动")
@@ -120,6 +167,25 @@ async def startup_event():
         except Exception as db_error:
             logger.error(f"❌ 数据库连接失败: {str(db_error)}")
         
+        # 预先建立LLM连接，不阻塞启动
+        app.state.llm_warmup = asyncio.create_task(response_generator.warm_up())
+        
+        # 启动后台健康检查
+        await health_monitor.start()
+        logger.info("✅ 健康检查已启动")
+        
+        # 监视.env文件，修改后自动重新加载LLM配置
+        watch_interval = float(os.getenv("LLM_CONFIG_WATCH_INTERVAL", "5"))
+        if watch_interval > 0:
+            app.state.env_watcher = asyncio.create_task(watch_env_file(Path(__file__).parent / '.env', watch_interval))
+        
+        # 启动对话摘要后台压缩
+        try:
+            await conversation_summarizer.start()
+            logger.info("✅ 对话摘要已启动")
+        except Exception as summary_error:
+            logger.error(f"❌ 对话摘要启动失败: {str(summary_error)}")
+        
         logger.info("🎉 所有服务初始化完成")
         
     except Exception as e:
@@ -131,10 +197,31 @@ async def shutdown_event():
     logger.info("🛑 AI社群模拟小游戏API服务关闭中...")
     
     try:
+        # 停止后台健康检查
+        await health_monitor.stop()
+        
+        # 取消尚未完成的居民回复生成
+        await generation_scheduler.shutdown()
+        await conversation_summarizer.stop()
+        
+        # 停止.env文件监视
+        env_watcher = getattr(app.state, "env_watcher", None)
+        if env_watcher:
+            env_watcher.cancel()
+        
         # 停止社群模拟
         await community_simulation.stop_simulation()
+        await community_simulation.disable_sharding()
         logger.info("✅ AI社群模拟引擎已停止")
         
+        # 关闭前写入快照，下次启动无需重放
+        if community_simulation.journal:
+            community_simulation.write_journal_snapshot()
+            community_simulation.journal.close()
+            logger.info("✅ 事件日志已保存")
+        
+        community_simulation.stats_history.save()
+        
     except Exception as e:
         logger.error(f"❌ 关闭过程中发生错误: {str(e)}")
 
@@ -154,6 +241,19 @@ async def read_root():
     }
 
 # API版本前缀路由
+# 存活探针
+@app.get("/livez")
+async def liveness_probe():
+    """存活探针：进程能响应即返回200"""
+    return health_monitor.liveness()
+
+# 就绪探针
+@app.get("/readyz")
+async def readiness_probe():
+    """就绪探针：读取后台健康检查的缓存结果，关键组件不可用时返回503"""
+    ready, report = health_monitor.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=report)
+
 @app.get("/api/v1/health")
 async def health_check():
     """
@@ -195,41 +295,40 @@ async def health_check():
         },
         "messages": {
             "llm_config": llm_message
-        }
+        },
+        "health_checks": health_monitor.get_status()
+    }
+
+def get_agents_info():
+    """居民数量和在线居民"""
+    agents = community_simulation.get_all_agents()
+    active_agents = [agent for agent in agents if agent.is_active]
+    return {
+        "total_agents": len(agents),
+        "active_agents": len(active_agents),
+        "agent_names": [agent.name for agent in active_agents]
     }
 
 @app.get("/api/v1/system/status")
 async def get_system_status():
     """获取系统全面状态信息"""
     try:
-        # 获取社群统计
-        community_stats = await community_simulation.get_community_stats()
-        
-        # 获取模拟状态
-        simulation_status = community_simulation.get_simulation_status()
-        
-        # 获取LLM状态
-        llm_client_status = response_generator.get_client_status()
-        
-        # 获取最近事件
-        recent_events = await community_simulation.get_recent_events(5)
-        
-        # 获取居民数量
-        agents = community_simulation.get_all_agents()
-        active_agents = [agent for agent in agents if agent.is_active]
+        # 各部分互不依赖，并发获取；单个部分超时或出错时返回其余部分
+        # 同步的部分只读取内存状态，直接在事件循环中执行（不限时），避免放到线程中与模拟循环并发读写
+        results, parts = await gather_parts({
+            "community_stats": AggregatePart(community_simulation.get_community_stats),
+            "simulation_status": AggregatePart(community_simulation.get_simulation_status),
+            "llm_client_status": AggregatePart(response_generator.get_client_status),
+            "recent_events": AggregatePart(lambda: community_simulation.get_recent_events(5), default=[]),
+            "agents_info": AggregatePart(get_agents_info)
+        })
         
         return {
             "success": True,
             "data": {
-                "community_stats": community_stats,
-                "simulation_status": simulation_status,
-                "llm_client_status": llm_client_status,
-                "recent_events": recent_events,
-                "agents_info": {
-                    "total_agents": len(agents),
-                    "active_agents": len(active_agents),
-                    "agent_names": [agent.name for agent in active_agents]
-                },
+                **results,
+                "partial": any(part["status"] != "ok" for part in parts.values()),
+                "parts": parts,
                 "timestamp": datetime.now().isoformat()
             }
         }
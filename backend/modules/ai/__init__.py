@@ -8,6 +8,9 @@ from .realistic_chat_system import realistic_chat_system
 from .chat_handler import ChatHandler
 from .optimized_chat_system import optimized_chat_system
 from .smart_chat_handler import smart_chat_handler
+from .generation_scheduler import GenerationScheduler, GenerationJob, generation_scheduler
+from .conversation_summarizer import ConversationSummarizer, conversation_summarizer
+from .near_duplicate import NearDuplicateDetector, near_duplicate_detector
 
 # 创建实例
 chat_handler = ChatHandler()
@@ -17,5 +20,12 @@ __all__ = [
     'realistic_chat_system', 
     'chat_handler',
     'optimized_chat_system',
-    'smart_chat_handler'
+    'smart_chat_handler',
+    'GenerationScheduler',
+    'GenerationJob',
+    'generation_scheduler',
+    'ConversationSummarizer',
+    'conversation_summarizer',
+    'NearDuplicateDetector',
+    'near_duplicate_detector'
 ] 
\ No newline at end of file
@@ -0,0 +1,324 @@
+"""
+对话滚动摘要模块
+后台定期把聊天室中较早的聊天记录压缩进摘要：聊天室整体一份，每位居民一份；
+居民回复时只带最近几条原始消息加上固定预算的摘要，提示词长度不随聊天记录增长。
+默认使用本地抽取式压缩，可选用LLM批量改写聊天室摘要（失败时退回本地压缩）
+"""
+
+from typing import Dict, List, Optional, Any, Tuple, Callable
+from collections import Counter
+from datetime import datetime
+import asyncio
+import logging
+import os
+import re
+
+from sqlalchemy.orm import Session
+
+from modules.shared.database import SessionLocal, ChatMessage, ConversationSummary, engine
+from modules.llm import response_generator, token_counter
+
+# 压缩方式
+MODE_HEURISTIC = "heuristic"  # 本地抽取式压缩
+MODE_LLM = "llm"              # LLM批量改写聊天室摘要
+SUMMARY_MODES = (MODE_HEURISTIC, MODE_LLM)
+
+ROOM_SCOPE = ""  # agent_name为空表示聊天室整体摘要
+
+# 预算不足时较早的要点只保留话题，合并成一行
+EARLIER_PREFIX = "更早："
+EARLIER_SEPARATOR = "；"
+
+SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]+[。！？!?]?")
+CHUNK_PATTERN = re.compile(r"[\u4e00-\u9fff]+|[A-Za-z0-9]+")
+
+def _clip(text: str, limit: int) -> str:
+    """截断文本，超长时以省略号结尾"""
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def _terms(text: str) -> List[str]:
+    """提取用于打分的词项：相邻汉字二元组和英文数字词"""
+    terms = []
+    for chunk in CHUNK_PATTERN.findall(text):
+        if chunk.isascii():
+            if len(chunk) >= 2:
+                terms.append(chunk.lower())
+        else:
+            terms.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+    return terms
+
+def _key_sentence(messages: List[ChatMessage], limit: int) -> str:
+    """选出一组消息中与整组内容重合度最高的一句"""
+    frequency = Counter(term for msg in messages for term in set(_terms(msg.content or "")))
+    best, best_score = "", 0.0
+    for msg in messages:
+        for sentence in SENTENCE_PATTERN.findall(msg.content or ""):
+            sentence = sentence.strip()
+            terms = set(_terms(sentence))
+            if len(sentence) < 4 or not terms:
+                continue
+            # 其他消息也提到的词越多越能代表这组对话；除以词数的平方根以免偏向长句
+            score = sum(frequency[term] - 1 for term in terms) / len(terms) ** 0.5
+            if score > best_score or not best:
+                best, best_score = f"{msg.sender_name}说{sentence}", score
+    return _clip(best, limit)
+
+class ConversationSummarizer:
+    """对话滚动摘要器"""
+    
+    def __init__(
+        self,
+        room: str = "main",
+        raw_window: int = 5,
+        batch_size: int = 200,
+        room_token_budget: int = 300,
+        resident_token_budget: int = 120,
+        interval_seconds: float = 30.0,
+        mode: str = MODE_HEURISTIC,
+        session_factory: Callable[[], Session] = SessionLocal
+    ):
+        if mode not in SUMMARY_MODES:
+            raise ValueError(f"无效的摘要方式: {mode}")
+        self.logger = logging.getLogger(__name__)
+        self.room = room                                  # 消息表暂无聊天室字段，全部消息属于该聊天室
+        self.raw_window = raw_window                      # 最近的几条消息保留原文，不并入摘要
+        self.batch_size = batch_size                      # 每轮最多压缩的消息数
+        self.room_token_budget = room_token_budget
+        self.resident_token_budget = resident_token_budget
+        self.interval_seconds = interval_seconds
+        self.mode = mode
+        self.session_factory = session_factory
+        
+        self._summaries: Dict[Tuple[str, str], List[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        
+        self.stats = {
+            "passes": 0,
+            "messages_compacted": 0,
+            "llm_calls": 0,
+            "llm_fallbacks": 0,
+            "errors": 0
+        }
+    
+    async def start(self):
+        """建表、加载已有摘要并启动后台压缩"""
+        ConversationSummary.__table__.create(bind=engine, checkfirst=True)
+        db = self.session_factory()
+        try:
+            for row in db.query(ConversationSummary).all():
+                self._summaries[(row.room, row.agent_name or ROOM_SCOPE)] = self._split(row.summary)
+        finally:
+            db.close()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+    
+    async def stop(self):
+        """停止后台压缩"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _loop(self):
+        while True:
+            try:
+                await self.compact()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.logger.error(f"对话摘要压缩失败: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+    
+    def get_summary(self, agent_name: str = ROOM_SCOPE, room: Optional[str] = None) -> List[str]:
+        """获取摘要要点（由早到晚），不查询数据库"""
+        return list(self._summaries.get((room or self.room, agent_name), []))
+    
+    async def compact(self) -> Dict[str, Any]:
+        """
+        把聊天室中早于最近raw_window条、尚未压缩的消息并入摘要
+        
+        Returns:
+            Dict: 本轮结果 {"compacted", "residents"}
+        """
+        async with self._lock:
+            db = self.session_factory()
+            try:
+                messages = self._load_pending(db)
+                if not messages:
+                    return {"compacted": 0, "residents": 0}
+                
+                rows = {
+                    row.agent_name or ROOM_SCOPE: row
+                    for row in db.query(ConversationSummary).filter(ConversationSummary.room == self.room).all()
+                }
+                room_row = rows.get(ROOM_SCOPE) or self._new_row(db, rows, ROOM_SCOPE)
+                
+                room_lines = None
+                if self.mode == MODE_LLM:
+                    room_lines = await self._summarize_with_llm(self._split(room_row.summary), messages)
+                if room_lines is None:
+                    room_lines = self._fit(self._split(room_row.summary) + self._summarize_room(messages), self.room_token_budget)
+                self._store(room_row, room_lines, messages)
+                
+                # 居民摘要只记录本人的发言，始终使用本地压缩
+                by_resident: Dict[str, List[ChatMessage]] = {}
+                for msg in messages:
+                    if msg.sender_type == "agent" and msg.sender_name:
+                        by_resident.setdefault(msg.sender_name, []).append(msg)
+                for agent_name, own_messages in by_resident.items():
+                    row = rows.get(agent_name) or self._new_row(db, rows, agent_name)
+                    lines = self._split(row.summary) + [_clip(self._first_sentence(msg.content or ""), 40) for msg in own_messages]
+                    self._store(row, self._fit(self._dedupe(lines), self.resident_token_budget), own_messages)
+                
+                db.commit()
+                for agent_name, row in rows.items():
+                    self._summaries[(self.room, agent_name)] = self._split(row.summary)
+                
+                self.stats["passes"] += 1
+                self.stats["messages_compacted"] += len(messages)
+                return {"compacted": len(messages), "residents": len(by_resident)}
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+    
+    def _load_pending(self, db: Session) -> List[ChatMessage]:
+        """读取已压缩位置之后、最近raw_window条之前的消息"""
+        room_row = db.query(ConversationSummary).filter(
+            ConversationSummary.room == self.room,
+            ConversationSummary.agent_name == ROOM_SCOPE
+        ).first()
+        last_id = room_row.last_message_id if room_row else 0
+        
+        conversation = db.query(ChatMessage).filter(ChatMessage.sender_type.in_(["user", "agent"]))
+        boundary = conversation.order_by(ChatMessage.id.desc()).offset(self.raw_window).first()
+        if boundary is None or boundary.id <= last_id:
+            return []
+        return conversation.filter(ChatMessage.id > last_id, ChatMessage.id <= boundary.id)\
+                           .order_by(ChatMessage.id.asc())\
+                           .limit(self.batch_size)\
+                           .all()
+    
+    def _new_row(self, db: Session, rows: Dict[str, ConversationSummary], agent_name: str) -> ConversationSummary:
+        row = ConversationSummary(room=self.room, agent_name=agent_name, summary="", last_message_id=0, message_count=0, token_count=0)
+        db.add(row)
+        rows[agent_name] = row
+        return row
+    
+    def _store(self, row: ConversationSummary, lines: List[str], messages: List[ChatMessage]):
+        row.summary = "\n".join(lines)
+        row.last_message_id = max(row.last_message_id or 0, messages[-1].id)
+        row.message_count = (row.message_count or 0) + len(messages)
+        row.token_count = token_counter.count(row.summary)
+        row.updated_at = datetime.utcnow()
+    
+    def _summarize_room(self, messages: List[ChatMessage]) -> List[str]:
+        """以玩家的每条消息为界把聊天记录分组，每组压缩成一行"""
+        groups: List[List[ChatMessage]] = []
+        for msg in messages:
+            if msg.sender_type == "user" or not groups:
+                groups.append([])
+            groups[-1].append(msg)
+        
+        lines = []
+        for group in groups:
+            opener = group[0]
+            replies = [msg for msg in group if msg.sender_type == "agent"]
+            names = "、".join(dict.fromkeys(msg.sender_name for msg in replies))
+            if opener.sender_type == "user":
+                line = f"玩家提到「{_clip(opener.content or '', 30)}」"
+                if replies:
+                    line += f"，{names}参与讨论：{_key_sentence(replies, 50)}"
+            else:
+                line = f"{names}聊到：{_key_sentence(replies, 50)}"
+            lines.append(line)
+        return lines
+    
+    async def _summarize_with_llm(self, previous: List[str], messages: List[ChatMessage]) -> Optional[List[str]]:
+        """用一次LLM请求把整批消息并入聊天室摘要，失败时返回None"""
+        if not response_generator.client:
+            return None
+        self.stats["llm_calls"] += 1
+        transcript = "\n".join(
+            f"{'玩家' if msg.sender_type == 'user' else msg.sender_name}: {_clip(msg.content or '', 200)}"
+            for msg in messages
+        )
+        response = await response_generator.generate_response(
+            "history_summary",
+            previous_summary="\n".join(previous) or "暂无",
+            new_messages=transcript,
+            token_budget=self.room_token_budget
+        )
+        lines = self._split(response.content) if response.success else []
+        if not lines:
+            self.stats["llm_fallbacks"] += 1
+            return None
+        return self._fit(lines, self.room_token_budget)
+    
+    def _fit(self, lines: List[str], budget: int) -> List[str]:
+        """
+        把摘要压到预算内：最早的要点依次缩成一句话题并入"更早："行，
+        "更早："行超过一半预算时丢弃其中最早的话题，只剩一条仍超出时截断
+        """
+        earlier: List[str] = []
+        rest = list(lines)
+        if rest and rest[0].startswith(EARLIER_PREFIX):
+            earlier = rest.pop(0)[len(EARLIER_PREFIX):].split(EARLIER_SEPARATOR)
+        
+        def join() -> List[str]:
+            return ([EARLIER_PREFIX + EARLIER_SEPARATOR.join(earlier)] if earlier else []) + rest
+        
+        while token_counter.count("\n".join(join())) > budget:
+            # "更早："行最多占一半预算，保证最近的要点保留细节
+            if len(earlier) > 1 and token_counter.count(join()[0]) > budget // 2:
+                earlier.pop(0)
+            elif rest:
+                topic = _clip(rest.pop(0).split("，", 1)[0], 24)
+                if topic not in earlier:
+                    earlier.append(topic)
+            elif len(earlier) > 1:
+                earlier.pop(0)
+            else:
+                break
+        lines = join()
+        if lines and token_counter.count(lines[0]) > budget:
+            lines[0] = _clip(lines[0], max(1, int(len(lines[0]) * budget / token_counter.count(lines[0]))))
+        return lines
+    
+    @staticmethod
+    def _first_sentence(text: str) -> str:
+        sentences = [sentence.strip() for sentence in SENTENCE_PATTERN.findall(text) if sentence.strip()]
+        return sentences[0] if sentences else text.strip()
+    
+    @staticmethod
+    def _dedupe(lines: List[str]) -> List[str]:
+        return list(dict.fromkeys(line for line in lines if line))
+    
+    @staticmethod
+    def _split(summary: Optional[str]) -> List[str]:
+        return [line.strip() for line in (summary or "").splitlines() if line.strip()]
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取摘要器状态"""
+        room_lines = self._summaries.get((self.room, ROOM_SCOPE), [])
+        return {
+            "mode": self.mode,
+            "running": self._task is not None and not self._task.done(),
+            "room": self.room,
+            "raw_window": self.raw_window,
+            "interval_seconds": self.interval_seconds,
+            "budgets": {"room": self.room_token_budget, "resident": self.resident_token_budget},
+            "room_summary_tokens": token_counter.count("\n".join(room_lines)),
+            "residents": sum(1 for room, agent_name in self._summaries if room == self.room and agent_name),
+            "stats": dict(self.stats)
+        }
+
+# 全局对话摘要器
+conversation_summarizer = ConversationSummarizer(
+    interval_seconds=float(os.getenv("CHAT_SUMMARY_INTERVAL_SECONDS", "30")),
+    mode=os.getenv("CHAT_SUMMARY_MODE", MODE_HEURISTIC)
+)
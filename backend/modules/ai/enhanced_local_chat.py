@@ -15,6 +15,7 @@ from sqlalchemy.orm import Session
 
 from modules.simulation import Agent, AgentPersonality, AgentOccupation
 from modules.shared.database import ChatMessage, Agents
+from modules.llm import fallback_engine
 
 class PersonalityTrait(Enum):
     """性格特征"""
@@ -523,59 +524,7 @@ class EnhancedLocalChatSystem:
     
     def _generate_topic_response(self, profile: Dict[str, Any], user_message: str, topic_category: str) -> str:
         """根据话题生成回复内容"""
-        personality = profile["personality"]
-        occupation = profile["occupation"]
-        
-        topic_responses = {
-            "social": [
-                "我觉得多交流真的很重要，能让我们更好地了解彼此。",
-                "社交活动总是能带来很多乐趣和新的想法。",
-                "和大家在一起聊天是我最喜欢的事情之一。"
-            ],
-            "health": [
-                "健康确实是最重要的，我们都应该多关注自己的身体。",
-                "保持良好的生活习惯对每个人都很重要。",
-                "我觉得心理健康和身体健康同样重要。"
-            ],
-            "education": [
-                "学习是一个终身的过程，我们都应该保持好奇心。",
-                "教育不仅仅是知识的传授，更是思维的培养。",
-                "我相信每个人都有自己独特的学习方式。"
-            ],
-            "work": [
-                "工作虽然有挑战，但也能带来成就感。",
-                "我觉得工作和生活的平衡很重要。",
-                "团队合作总是能产生更好的结果。"
-            ],
-            "art": [
-                "艺术能够表达我们内心深处的情感。",
-                "创造力是人类最宝贵的天赋之一。",
-                "美的事物总是能让人心情愉悦。"
-            ],
-            "community": [
-                "我们的社群就像一个大家庭，需要每个人的参与。",
-                "社区建设需要大家共同努力。",
-                "邻里和谐是幸福生活的基础。"
-            ],
-            "future": [
-                "对未来充满期待总是让人兴奋。",
-                "我相信只要努力，未来一定会更美好。",
-                "规划未来很重要，但也要享受当下。"
-            ]
-        }
-        
-        responses = topic_responses.get(topic_category, topic_responses["social"])
-        base_response = random.choice(responses)
-        
-        # 根据性格调整
-        if personality == "乐观开朗":
-            base_response = base_response.replace("重要", "非常重要").replace("好", "特别好")
-        elif personality == "分析型":
-            base_response = f"从理性角度来看，{base_response}"
-        elif personality == "创造型":
-            base_response = f"我觉得我们可以更有创意地{base_response}"
-        
-        return base_response
+        return fallback_engine.topic_reply(profile, topic_category)
     
     def _add_personality_touch(self, response: str, profile: Dict[str, Any], topic_category: str) -> str:
         """添加个性化元素"""
@@ -0,0 +1,257 @@
+"""
+居民回复生成调度模块
+所有后台LLM生成任务统一排队：全局和单个聊天室都有并发上限，等待队列有界并按策略丢弃，
+同一聊天室有更新的用户消息时取消旧消息尚未完成的生成；每个任务使用自己的数据库会话
+"""
+
+from typing import Dict, List, Optional, Any, Callable, Awaitable
+from collections import deque
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+from sqlalchemy.orm import Session
+
+from modules.shared.database import SessionLocal
+
+# 队列满时的丢弃策略
+SHED_OLDEST = "drop_oldest"  # 丢弃最早排队的任务，优先回应最新消息
+SHED_NEWEST = "reject_new"   # 拒绝新提交的任务
+SHED_POLICIES = (SHED_OLDEST, SHED_NEWEST)
+
+JobRunner = Callable[[Session, "GenerationJob"], Awaitable[Any]]
+
+class GenerationJob:
+    """单个生成任务"""
+    
+    _ids = itertools.count(1)
+    
+    def __init__(self, room: str, key: str, runner: JobRunner):
+        self.id = next(self._ids)
+        self.room = room
+        self.key = key                  # 同一key（居民）同一时间只运行一个任务
+        self.runner = runner
+        self.generation = 0             # 提交时聊天室的消息代数，由调度器填写
+        self.state = "pending"          # pending/queued/running/completed/failed/cancelled/shed
+        self.shielded = False           # 已拿到回复的任务不再因新消息被取消
+        self.cancel_requested = False
+        self.submitted_at = 0.0
+        self.started_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+    
+    def shield(self):
+        """标记任务已越过昂贵阶段（LLM已返回），新消息到达时允许其完成"""
+        self.shielded = True
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "room": self.room,
+            "key": self.key,
+            "generation": self.generation,
+            "state": self.state,
+            "shielded": self.shielded,
+            "waited_seconds": round((self.started_at or time.monotonic()) - self.submitted_at, 3)
+        }
+
+class GenerationScheduler:
+    """居民回复生成调度器"""
+    
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_per_room: int = 4,
+        max_queue: int = 64,
+        shed_policy: str = SHED_OLDEST,
+        max_wait_seconds: float = 30.0,
+        session_factory: Callable[[], Session] = SessionLocal
+    ):
+        if shed_policy not in SHED_POLICIES:
+            raise ValueError(f"无效的丢弃策略: {shed_policy}")
+        self.logger = logging.getLogger(__name__)
+        self.max_concurrency = max_concurrency
+        self.max_per_room = max_per_room
+        self.max_queue = max_queue
+        self.shed_policy = shed_policy
+        self.max_wait_seconds = max_wait_seconds  # 排队超过该时间的任务已无意义，直接丢弃
+        self.session_factory = session_factory
+        
+        self._queue: deque = deque()
+        self._running: Dict[int, GenerationJob] = {}
+        self._running_per_room: Dict[str, int] = {}
+        self._running_keys: set = set()
+        self._room_generations: Dict[str, int] = {}
+        
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "superseded": 0,
+            "shed": 0,
+            "expired": 0
+        }
+    
+    @property
+    def queued_count(self) -> int:
+        return len(self._queue)
+    
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+    
+    def submit(self, room: str, jobs: List[GenerationJob], supersede: bool = True) -> Dict[str, Any]:
+        """
+        提交一条用户消息触发的一组任务（需在事件循环中调用）
+        
+        Args:
+            room: 聊天室
+            jobs: 生成任务
+            supersede: 是否取消该聊天室旧消息尚未完成的任务
+        
+        Returns:
+            Dict: 提交结果 {"generation", "accepted", "shed", "superseded"}
+        """
+        generation = self._room_generations.get(room, 0) + 1
+        self._room_generations[room] = generation
+        superseded = self._supersede(room, generation) if supersede else 0
+        
+        now = time.monotonic()
+        accepted = shed = 0
+        for job in jobs:
+            job.room = room
+            job.generation = generation
+            job.submitted_at = now
+            self.stats["submitted"] += 1
+            
+            if len(self._queue) >= self.max_queue:
+                if self.shed_policy == SHED_NEWEST:
+                    self._finish_unstarted(job, "shed")
+                    shed += 1
+                    continue
+                self._finish_unstarted(self._queue.popleft(), "shed")
+                shed += 1
+            
+            job.state = "queued"
+            self._queue.append(job)
+            accepted += 1
+        
+        self._dispatch()
+        return {"generation": generation, "accepted": accepted, "shed": shed, "superseded": superseded}
+    
+    def _supersede(self, room: str, generation: int) -> int:
+        """取消聊天室内旧代数的排队任务和尚未拿到回复的运行任务"""
+        count = 0
+        for job in [job for job in self._queue if job.room == room and job.generation < generation]:
+            self._queue.remove(job)
+            self._finish_unstarted(job, "cancelled")
+            count += 1
+        for job in list(self._running.values()):
+            if job.room == room and job.generation < generation and not job.shielded and not job.cancel_requested:
+                job.cancel_requested = True
+                job.task.cancel()
+                count += 1
+        self.stats["superseded"] += count
+        return count
+    
+    def _finish_unstarted(self, job: GenerationJob, state: str):
+        job.state = state
+        self.stats["cancelled" if state == "cancelled" else state] += 1
+    
+    def _dispatch(self):
+        """按提交顺序启动满足并发限制的任务"""
+        if not self._queue:
+            return
+        now = time.monotonic()
+        for job in list(self._queue):
+            if len(self._running) >= self.max_concurrency:
+                break
+            if now - job.submitted_at > self.max_wait_seconds:
+                self._queue.remove(job)
+                self._finish_unstarted(job, "expired")
+                continue
+            if self._running_per_room.get(job.room, 0) >= self.max_per_room:
+                continue
+            if (job.room, job.key) in self._running_keys:
+                continue
+            
+            self._queue.remove(job)
+            job.state = "running"
+            job.started_at = now
+            self._running[job.id] = job
+            self._running_per_room[job.room] = self._running_per_room.get(job.room, 0) + 1
+            self._running_keys.add((job.room, job.key))
+            job.task = asyncio.create_task(self._run(job))
+            job.task.add_done_callback(lambda task, job=job: self._on_done(job))
+    
+    async def _run(self, job: GenerationJob):
+        """执行任务：会话由任务独占，结束后释放"""
+        db = self.session_factory()
+        try:
+            await job.runner(db, job)
+            job.state = "completed"
+            self.stats["completed"] += 1
+        except asyncio.CancelledError:
+            db.rollback()
+            raise
+        except Exception as e:
+            job.state = "failed"
+            self.stats["failed"] += 1
+            db.rollback()
+            self.logger.error(f"生成任务失败 {job.room}/{job.key}: {str(e)}")
+        finally:
+            db.close()
+    
+    def _on_done(self, job: GenerationJob):
+        """释放并发名额并调度下一个（任务在开始执行前被取消时也会回调）"""
+        if job.state == "running":
+            job.state = "cancelled"
+            self.stats["cancelled"] += 1
+        self._running.pop(job.id, None)
+        self._running_per_room[job.room] -= 1
+        if not self._running_per_room[job.room]:
+            del self._running_per_room[job.room]
+        self._running_keys.discard((job.room, job.key))
+        self._dispatch()
+    
+    async def shutdown(self):
+        """取消全部排队和运行中的任务"""
+        while self._queue:
+            self._finish_unstarted(self._queue.popleft(), "cancelled")
+        tasks = [job.task for job in self._running.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取调度器状态"""
+        rooms: Dict[str, Dict[str, int]] = {}
+        for job in self._queue:
+            rooms.setdefault(job.room, {"queued": 0, "running": 0})["queued"] += 1
+        for room, running in self._running_per_room.items():
+            rooms.setdefault(room, {"queued": 0, "running": 0})["running"] = running
+        return {
+            "queued": len(self._queue),
+            "running": len(self._running),
+            "rooms": rooms,
+            "running_jobs": [job.to_dict() for job in self._running.values()],
+            "limits": {
+                "max_concurrency": self.max_concurrency,
+                "max_per_room": self.max_per_room,
+                "max_queue": self.max_queue,
+                "shed_policy": self.shed_policy,
+                "max_wait_seconds": self.max_wait_seconds
+            },
+            "stats": dict(self.stats)
+        }
+
+# 全局生成调度器
+generation_scheduler = GenerationScheduler(
+    max_concurrency=int(os.getenv("CHAT_MAX_CONCURRENT_GENERATIONS", "8")),
+    max_per_room=int(os.getenv("CHAT_MAX_GENERATIONS_PER_ROOM", "4")),
+    max_queue=int(os.getenv("CHAT_GENERATION_QUEUE_SIZE", "64")),
+    shed_policy=os.getenv("CHAT_GENERATION_SHED_POLICY", SHED_OLDEST)
+)
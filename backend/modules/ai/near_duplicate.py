@@ -0,0 +1,223 @@
+"""
+近似重复检测模块
+居民回复按字符n-gram切片（中文没有空格，不能按空白分词）计算MinHash签名，签名分段（LSH）放入哈希桶；
+每个聊天室和每位居民各保留最近N条回复的桶，新回复只和同桶的候选比较签名，
+查找耗时与保留的历史长度无关，可以发现不同居民之间的互相复述
+"""
+
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+from collections import deque
+from dataclasses import dataclass
+import os
+import random
+import re
+import zlib
+
+DEFAULT_ROOM = "main"
+
+SCOPE_ROOM = "room"          # 聊天室内任何居民说过的
+SCOPE_RESIDENT = "resident"  # 该居民自己说过的
+
+NORMALIZE_PATTERN = re.compile(r"[\W_]+")  # 去掉标点和空白，只比较文字
+HASH_PRIME = (1 << 61) - 1
+HASH_MASK = (1 << 32) - 1
+
+def shingle_hashes(text: str, size: int) -> List[int]:
+    """去掉标点后按字符切成长度为size的片段，返回片段的32位哈希"""
+    normalized = NORMALIZE_PATTERN.sub("", text.lower())
+    if not normalized:
+        return []
+    if len(normalized) <= size:
+        return [zlib.crc32(normalized.encode("utf-8"))]
+    return list({zlib.crc32(normalized[i:i + size].encode("utf-8")) for i in range(len(normalized) - size + 1)})
+
+@dataclass(frozen=True)
+class ReplyFingerprint:
+    """一条回复的签名"""
+    text: str
+    exact: int                    # 规范化文本的哈希，完全相同时直接命中
+    signature: Tuple[int, ...]    # MinHash签名
+    bands: Tuple[int, ...]        # 每段签名的桶键
+
+@dataclass(frozen=True)
+class DuplicateMatch:
+    """命中的近似重复回复"""
+    speaker: str
+    text: str
+    similarity: float
+    scope: str
+
+class _Entry:
+    __slots__ = ("id", "speaker", "fingerprint")
+    
+    def __init__(self, entry_id: int, speaker: str, fingerprint: ReplyFingerprint):
+        self.id = entry_id
+        self.speaker = speaker
+        self.fingerprint = fingerprint
+
+class _ScopeIndex:
+    """一个范围（聊天室或居民）内最近N条回复的LSH桶"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: deque = deque()
+        self.buckets: Dict[int, Dict[int, _Entry]] = {}
+        self.exact: Dict[int, Dict[int, _Entry]] = {}
+    
+    def add(self, entry: _Entry):
+        if len(self.entries) >= self.capacity:
+            self._evict(self.entries.popleft())
+        self.entries.append(entry)
+        for key in entry.fingerprint.bands:
+            self.buckets.setdefault(key, {})[entry.id] = entry
+        self.exact.setdefault(entry.fingerprint.exact, {})[entry.id] = entry
+    
+    def _evict(self, entry: _Entry):
+        for index, key in [(self.buckets, key) for key in entry.fingerprint.bands] + [(self.exact, entry.fingerprint.exact)]:
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(entry.id, None)
+                if not bucket:
+                    del index[key]
+    
+    def exact_match(self, fingerprint: ReplyFingerprint) -> Optional[_Entry]:
+        bucket = self.exact.get(fingerprint.exact)
+        return next(iter(bucket.values())) if bucket else None
+    
+    def candidates(self, fingerprint: ReplyFingerprint) -> Iterable[_Entry]:
+        """与该签名至少有一段完全相同的历史回复"""
+        seen = {}
+        for key in fingerprint.bands:
+            bucket = self.buckets.get(key)
+            if bucket:
+                seen.update(bucket)
+        return seen.values()
+
+class NearDuplicateDetector:
+    """基于MinHash + LSH的近似重复检测"""
+    
+    def __init__(
+        self,
+        threshold: float = 0.7,
+        shingle_size: int = 2,
+        num_perm: int = 64,
+        bands: int = 16,
+        room_window: int = 300,
+        resident_window: int = 50,
+        seed: int = 1
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm必须是bands的整数倍")
+        self.threshold = threshold          # 估计的Jaccard相似度达到该值视为重复
+        self.shingle_size = shingle_size    # 中文相邻两字接近一个词
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands       # 16段x4行：相似度0.7的回复约99%会进入同一个桶
+        self.room_window = room_window
+        self.resident_window = resident_window
+        rng = random.Random(seed)
+        self._permutations = [(rng.randrange(1, HASH_PRIME), rng.randrange(0, HASH_PRIME)) for _ in range(num_perm)]
+        self._rooms: Dict[str, _ScopeIndex] = {}
+        self._residents: Dict[Tuple[str, str], _ScopeIndex] = {}
+        self._next_id = 0
+        self._last: Optional[ReplyFingerprint] = None  # 检查后紧接着记录同一条回复，避免重复计算
+        self.stats = {"checked": 0, "recorded": 0, "duplicates": 0, "cross_resident": 0, "compared": 0}
+    
+    def fingerprint(self, text: str) -> Optional[ReplyFingerprint]:
+        """计算签名；没有文字内容时返回None"""
+        if self._last is not None and self._last.text == text:
+            return self._last
+        hashes = shingle_hashes(text, self.shingle_size)
+        if not hashes:
+            return None
+        signature = tuple(min([(a * h + b) % HASH_PRIME for h in hashes]) & HASH_MASK for a, b in self._permutations)
+        rows = self.rows
+        bands = tuple(hash((band,) + signature[band * rows:(band + 1) * rows]) for band in range(self.bands))
+        exact = zlib.crc32(NORMALIZE_PATTERN.sub("", text.lower()).encode("utf-8"))
+        self._last = ReplyFingerprint(text, exact, signature, bands)
+        return self._last
+    
+    def similarity(self, a: ReplyFingerprint, b: ReplyFingerprint) -> float:
+        """由签名估计的Jaccard相似度"""
+        return sum(1 for x, y in zip(a.signature, b.signature) if x == y) / self.num_perm
+    
+    def find(self, text: str, resident: str, room: str = DEFAULT_ROOM) -> Optional[DuplicateMatch]:
+        """
+        查找近似重复的历史回复
+        
+        Args:
+            text: 待检查的回复
+            resident: 回复的居民
+            room: 聊天室
+        
+        Returns:
+            Optional[DuplicateMatch]: 相似度最高的重复回复，没有时为None
+        """
+        self.stats["checked"] += 1
+        fingerprint = self.fingerprint(text)
+        if fingerprint is None:
+            return None
+        
+        best: Optional[DuplicateMatch] = None
+        for scope, index in ((SCOPE_RESIDENT, self._residents.get((room, resident))), (SCOPE_ROOM, self._rooms.get(room))):
+            if index is None:
+                continue
+            entry = index.exact_match(fingerprint)
+            if entry is not None:
+                best = DuplicateMatch(entry.speaker, entry.fingerprint.text, 1.0, scope)
+                break
+            for entry in index.candidates(fingerprint):
+                self.stats["compared"] += 1
+                similarity = self.similarity(fingerprint, entry.fingerprint)
+                if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                    best = DuplicateMatch(entry.speaker, entry.fingerprint.text, similarity, scope)
+        
+        if best is not None:
+            self.stats["duplicates"] += 1
+            if best.speaker != resident:
+                self.stats["cross_resident"] += 1
+        return best
+    
+    def add(self, text: str, resident: str, room: str = DEFAULT_ROOM):
+        """记录一条已发出的回复"""
+        fingerprint = self.fingerprint(text)
+        if fingerprint is None:
+            return
+        self.stats["recorded"] += 1
+        self._next_id += 1
+        entry = _Entry(self._next_id, resident, fingerprint)
+        index = self._residents.get((room, resident))
+        if index is None:
+            index = self._residents[(room, resident)] = _ScopeIndex(self.resident_window)
+        index.add(entry)
+        index = self._rooms.get(room)
+        if index is None:
+            index = self._rooms[room] = _ScopeIndex(self.room_window)
+        index.add(entry)
+    
+    def clear(self, room: Optional[str] = None):
+        """清空一个聊天室（默认全部）的历史"""
+        if room is None:
+            self._rooms.clear()
+            self._residents.clear()
+            return
+        self._rooms.pop(room, None)
+        for key in [key for key in self._residents if key[0] == room]:
+            del self._residents[key]
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "room_window": self.room_window,
+            "resident_window": self.resident_window,
+            "rooms": {room: len(index.entries) for room, index in self._rooms.items()},
+            "residents": len(self._residents),
+            **self.stats
+        }
+
+# 全局近似重复检测器
+near_duplicate_detector = NearDuplicateDetector(
+    threshold=float(os.getenv("CHAT_DUPLICATE_THRESHOLD", "0.7")),
+    room_window=int(os.getenv("CHAT_DUPLICATE_ROOM_WINDOW", "300")),
+    resident_window=int(os.getenv("CHAT_DUPLICATE_RESIDENT_WINDOW", "50"))
+)
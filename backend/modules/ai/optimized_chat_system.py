@@ -14,6 +14,7 @@ from sqlalchemy.orm import Session
 
 from modules.simulation import Agent, AgentPersonality, AgentOccupation
 from modules.shared.database import ChatMessage, Agents
+from modules.llm.prompt_assembly import PromptSegment, PromptPrefix, PrefixCache, TIER_STATIC, TIER_PERSONA, TIER_STATE, TIER_VOLATILE
 
 @dataclass
 class PersonalityProfile:
@@ -80,6 +81,14 @@ class OptimizedChatSystem:
         self.personality_profiles = self._init_personality_profiles()
         self.topic_expertise = self._init_topic_expertise()
         
+        # 通用指令和安全边界对所有居民相同，只组装一次
+        self._static_prefix = PromptPrefix().extend([
+            PromptSegment(TIER_STATIC, self.system_prompts['base_system']),
+            PromptSegment(TIER_STATIC, self._build_guardrails_section())
+        ])
+        # 角色相关部分只取决于居民，话题相关部分只取决于话题类别，按 (居民, 话题) 缓存组装好的前缀
+        self._prompt_heads = PrefixCache(256)
+        
     def _init_system_prompts(self) -> Dict[str, str]:
         """初始化系统提示词模板"""
         return {
@@ -268,51 +277,57 @@ class OptimizedChatSystem:
     def create_character_prompt(self, agent_name: str, topic_category: str, 
                               conversation_context: List[str], user_message: str) -> str:
         """创建角色化提示词"""
+        prompt, _ = self.build_character_prompt(agent_name, topic_category, conversation_context, user_message)
+        return prompt
+    
+    def build_character_prompt(self, agent_name: str, topic_category: str,
+                               conversation_context: List[str], user_message: str) -> Tuple[str, Dict[str, str]]:
+        """
+        创建角色化提示词并返回各层前缀哈希
         
-        # 获取角色档案
-        profile_key = f"{agent_name}_{self._get_agent_occupation(agent_name)}"
-        profile = self.personality_profiles.get(profile_key)
-        if not profile:
-            return self._create_fallback_response(agent_name, user_message)
-        
-        # 构建六大模块
-        personality_section = self._build_personality_section(profile)
-        environment_section = self._build_environment_section(topic_category, conversation_context)
-        tone_section = self._build_tone_section(profile)
-        goal_section = self._build_goal_section(topic_category)
-        guardrails_section = self._build_guardrails_section()
-        tools_section = self._build_tools_section(profile)
+        六大模块按变化频率排列：通用指令和安全边界 -> 角色设定、语调、工具 -> 话题环境和目标 -> 当前对话，
+        同一居民的请求共享前面不变的部分；不变部分按 (居民, 话题) 缓存，每次只拼接当前对话
+        """
+        head = self._prompt_heads.get((agent_name, topic_category))
+        if head is None:
+            # 获取角色档案
+            profile_key = f"{agent_name}_{self._get_agent_occupation(agent_name)}"
+            profile = self.personality_profiles.get(profile_key)
+            if not profile:
+                return self._create_fallback_response(agent_name, user_message), {}
+            head = self._build_prompt_head(agent_name, profile, topic_category)
+            self._prompt_heads.put((agent_name, topic_category), head)
         
-        prompt = f"""
-{self.system_prompts['base_system']}
-
-{personality_section}
-
-{environment_section}
-
-{tone_section}
-
-{goal_section}
-
-{guardrails_section}
-
-{tools_section}
-
+        conversation_section = f"""
 ## 当前对话情境：
 用户消息："{user_message}"
 话题类别：{topic_category}
 对话历史：{conversation_context[-3:] if conversation_context else ['无']}
 
+回应内容：
+"""
+        
+        return head.extend([PromptSegment(TIER_VOLATILE, conversation_section)]).to_text()
+    
+    def _build_prompt_head(self, agent_name: str, profile: PersonalityProfile, topic_category: str) -> PromptPrefix:
+        """组装不随消息变化的部分：角色设定、语调、工具、回应要求，以及话题环境和目标"""
+        response_requirements = f"""
 请以{agent_name}的身份，根据以上设定进行自然、有价值的回应。回应应该：
 1. 体现你的专业背景和个人特色
 2. 针对具体话题提供有意义的内容
 3. 保持自然的对话节奏
 4. 长度控制在30-80字之间
 5. 避免重复或套话
-
-回应内容：
 """
-        return prompt
+        
+        return self._static_prefix.extend([
+            PromptSegment(TIER_PERSONA, self._build_personality_section(profile)),
+            PromptSegment(TIER_PERSONA, self._build_tone_section(profile)),
+            PromptSegment(TIER_PERSONA, self._build_tools_section(profile)),
+            PromptSegment(TIER_PERSONA, response_requirements),
+            PromptSegment(TIER_STATE, self._build_environment_section(topic_category, [])),
+            PromptSegment(TIER_STATE, self._build_goal_section(topic_category))
+        ])
     
     def _build_personality_section(self, profile: PersonalityProfile) -> str:
         """构建角色设定部分"""
@@ -15,6 +15,7 @@ from sqlalchemy.orm import Session
 from modules.simulation import Agent, AgentPersonality, AgentOccupation
 from modules.shared.database import ChatMessage, Agents
 from modules.llm import response_generator
+from .conversation_summarizer import conversation_summarizer
 
 class ResponseTiming(Enum):
     """回复时间类型"""
@@ -324,7 +325,9 @@ class RealisticChatSystem:
                 agent_own_history=agent_history,
                 community_stats=await self._get_community_stats(),
                 recent_events=await self._get_recent_events(),
-                is_first_speaker=len(conversation_context) == 0
+                is_first_speaker=len(conversation_context) == 0,
+                room_summary=conversation_summarizer.get_summary(),
+                own_summary=conversation_summarizer.get_summary(profile.name)
             )
             
             if response.get("success"):
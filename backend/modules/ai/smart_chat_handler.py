@@ -12,7 +12,11 @@ from sqlalchemy.orm import Session
 
 from modules.simulation import Agent, AgentPersonality, AgentOccupation
 from modules.shared.database import ChatMessage, Agents
-from modules.llm import response_generator
+from modules.llm import response_generator, Deadline, fallback_engine
+from .conversation_summarizer import conversation_summarizer
+from .near_duplicate import near_duplicate_detector, DEFAULT_ROOM
+
+MIN_ATTEMPT_SECONDS = 1.0  # 离截止时间不足该秒数时不再发起LLM请求，直接使用备用回复
 
 class SmartChatHandler:
     """智能聊天处理器 - 使用LLM生成参与性回复"""
@@ -21,7 +25,6 @@ class SmartChatHandler:
         self.agent_profiles = {}
         self.conversation_memory = {}
         self.topic_keywords = self._init_topic_keywords()
-        self.response_cache = {}
         
     def _init_topic_keywords(self) -> Dict[str, List[str]]:
         """初始化话题关键词"""
@@ -77,25 +80,25 @@ class SmartChatHandler:
             delay = self._calculate_response_delay(profile, i, participation_score)
             
             # 使用LLM生成智能回复
-            response = await self._generate_llm_response(
+            response, response_type = await self._generate_llm_response(
                 profile, user_message, topic_category, conversation_context
             )
             
-            if response and not self._is_duplicate_response(response, profile["name"]):
+            if response and not self._is_duplicate_response(response, profile["name"], response_type=response_type):
                 responses.append({
                     "agent_id": agent_id,
                     "agent_name": profile["name"],
                     "response": response,
                     "delay": delay,
                     "participation_score": participation_score,
-                    "response_type": "llm_generated"
+                    "response_type": response_type
                 })
                 
                 # 更新成员状态
                 self._update_agent_state(profile, user_message, response, topic_category)
                 
                 # 缓存回复，避免重复
-                self._cache_response(response, profile["name"])
+                self._cache_response(response, profile["name"], response_type=response_type)
         
         return responses
     
@@ -274,11 +277,20 @@ class SmartChatHandler:
         return max(0.1, min(3.0, total_delay))
     
     async def _generate_llm_response(self, profile: Dict[str, Any], user_message: str, 
-                                   topic_category: str, conversation_context: List[str]) -> str:
-        """使用LLM生成智能回复 - 重点：参与性而非评价性"""
+                                   topic_category: str, conversation_context: List[str],
+                                   deadline: Optional[Deadline] = None) -> Tuple[str, str]:
+        """
+        使用LLM生成智能回复 - 重点：参与性而非评价性；给定截止时间时，快到期就改用智能后备方案
+        
+        Returns:
+            Tuple: (回复内容, 回复类型：llm_generated或fallback)
+        """
         max_attempts = 3  # 增加重试次数
         
         for attempt in range(max_attempts):
+            if deadline and deadline.remaining() < MIN_ATTEMPT_SECONDS:
+                print(f"⏱️ {profile['name']} 即将超过回复截止时间，停止重试")
+                break
             try:
                 # 调用LLM生成回复
                 response = await response_generator.generate_agent_conversation_response(
@@ -295,125 +307,42 @@ class SmartChatHandler:
                     agent_own_history=[],
                     community_stats={"happiness": 70, "health": 70, "education": 70, "economy": 70},
                     recent_events=[],
-                    is_first_speaker=len(conversation_context) == 0
+                    is_first_speaker=len(conversation_context) == 0,
+                    room_summary=conversation_summarizer.get_summary(),
+                    own_summary=conversation_summarizer.get_summary(profile["name"]),
+                    deadline=deadline
                 )
                 
+                if response.get("response_type") == "deadline_exceeded":
+                    print(f"⏱️ {profile['name']} LLM回复超过截止时间 (尝试 {attempt + 1})")
+                    break
+                
                 if response.get("success") and response.get("agent_response"):
                     content = response["agent_response"].strip()
                     
                     # 验证回复是否符合参与性要求
                     if self._is_participatory_response(content):
                         print(f"✅ {profile['name']} LLM生成成功 (尝试 {attempt + 1})")
-                        return content
+                        return content, "fallback" if response.get("response_type") == "fallback" else "llm_generated"
                     else:
                         print(f"⚠️ {profile['name']} 生成的回复不够参与性 (尝试 {attempt + 1})，重试...")
                         continue
                 else:
                     print(f"⚠️ {profile['name']} LLM回复生成失败 (尝试 {attempt + 1})")
                     continue
-                
+            
             except Exception as e:
                 print(f"❌ {profile['name']} LLM生成回复异常 (尝试 {attempt + 1}): {str(e)}")
                 continue
         
         # 如果所有LLM尝试都失败，使用智能后备方案
         print(f"🔄 {profile['name']} LLM方案失败，使用智能后备方案")
-        return self._generate_smart_fallback_response(profile, user_message, topic_category, conversation_context)
+        return self._generate_smart_fallback_response(profile, user_message, topic_category, conversation_context), "fallback"
     
     def _generate_smart_fallback_response(self, profile: Dict[str, Any], user_message: str, 
                                         topic_category: str, conversation_context: List[str]) -> str:
         """生成智能后备回复 - 基于用户消息类型和角色特征"""
-        agent_name = profile["name"]
-        personality = str(profile["personality"])
-        occupation = str(profile["occupation"])
-        
-        # 分析消息类型并生成相应回复
-        message_lower = user_message.lower()
-        
-        # 问题咨询类
-        if any(word in message_lower for word in ["怎么", "如何", "什么", "哪里", "建议", "方法", "经验"]):
-            if "放松" in message_lower or "压力" in message_lower:
-                responses = [
-                    f"我平时压力大的时候会去附近公园走走，特别是早晨的时候空气很清新。",
-                    f"我喜欢听音乐放松，有时候也会和朋友聊聊天。",
-                    f"我的经验是做些运动比较有效，比如跑步或者游泳。"
-                ]
-            elif "学习" in message_lower or "技能" in message_lower:
-                responses = [
-                    f"我觉得制定学习计划很重要，每天抽出固定时间练习。",
-                    f"我建议可以找一些在线课程跟着学，边学边实践效果比较好。",
-                    f"我的方法是先从基础开始，不要急于求成。"
-                ]
-            elif "工作" in message_lower or "困难" in message_lower:
-                responses = [
-                    f"遇到工作问题时，我通常会先梳理一下思路，看看问题出在哪里。",
-                    f"我的经验是多和同事交流，有时候换个角度就能找到解决办法。",
-                    f"我建议可以把问题拆分成小的部分，逐个解决。"
-                ]
-            else:
-                responses = [
-                    f"这个问题挺有意思的，我觉得可以试试从不同角度考虑一下。",
-                    f"我的经验是遇到这种情况时，先收集一些相关信息比较好。",
-                    f"我建议可以问问身边有经验的朋友，看看他们怎么处理的。"
-                ]
-        
-        # 推荐类
-        elif any(word in message_lower for word in ["推荐", "哪里", "什么地方", "好吃", "好玩"]):
-            if "吃" in message_lower or "餐厅" in message_lower or "火锅" in message_lower:
-                responses = [
-                    f"我知道市中心有家川菜馆挺不错的，他们家的麻婆豆腐特别正宗。",
-                    f"我经常去学校附近那家小火锅店，老板很实在，料也很新鲜。",
-                    f"我推荐试试东街那家面馆，他们的牛肉面分量很足。"
-                ]
-            elif "玩" in message_lower or "去哪" in message_lower:
-                responses = [
-                    f"我周末常去公园那边，可以散步也可以划船，环境挺好的。",
-                    f"我喜欢去图书馆看书，安静而且还能学到新东西。",
-                    f"我建议可以去市博物馆看看，最近有个很有意思的展览。"
-                ]
-            else:
-                responses = [
-                    f"这个要看你的喜好了，我个人比较喜欢安静一点的地方。",
-                    f"我觉得可以先在网上查查评价，然后再做决定。",
-                    f"我的建议是选择离家近一点的，这样比较方便。"
-                ]
-        
-        # 选择决策类
-        elif any(word in message_lower for word in ["怎么样", "好不好", "选择", "决定"]):
-            responses = [
-                f"我觉得这个想法不错，值得试试。",
-                f"我个人觉得可以，不过最终还是要看你自己的喜好。",
-                f"我的建议是可以先试试看，不合适再调整。"
-            ]
-        
-        # 分享类/感慨类
-        elif any(word in message_lower for word in ["最近", "今天", "昨天", "感觉"]):
-            responses = [
-                f"是啊，我最近也有类似的感受。",
-                f"我也注意到了这个情况，确实很有意思。",
-                f"我的感觉和你差不多，可能很多人都是这样想的。"
-            ]
-        
-        # 默认回复
-        else:
-            responses = [
-                f"这个话题让我想起了自己的一些经历，确实值得聊聊。",
-                f"我对这个也挺感兴趣的，平时偶尔会关注一下。",
-                f"我觉得这个角度很有意思，我们可以继续聊聊。"
-            ]
-        
-        # 根据性格特征调整回复
-        if "乐观" in personality:
-            selected = random.choice(responses)
-            selected = selected.replace("。", "！")  # 让乐观的人更有热情
-        elif "内向" in personality:
-            # 内向的人回复更简洁
-            responses = [r for r in responses if len(r) < 50]
-            selected = random.choice(responses) if responses else "我也有类似的想法。"
-        else:
-            selected = random.choice(responses)
-        
-        return selected
+        return fallback_engine.chat_reply(profile, user_message)
     
     def _create_participatory_prompt(self, profile: Dict[str, Any], user_message: str, 
                                    topic_category: str, conversation_context: List[str]) -> str:
@@ -432,7 +361,7 @@ class SmartChatHandler:
 话题：{topic_category}
 
 请提供30-80字的具体参与性回复："""
-    
+
     def _is_participatory_response(self, response: str) -> bool:
         """检查回复是否具有参与性"""
         # 检查是否包含明显的评价性语言（严格禁止）
@@ -513,39 +442,23 @@ class SmartChatHandler:
         # 默认返回false，但标准比之前宽松
         return False
     
-    def _is_duplicate_response(self, response: str, agent_name: str) -> bool:
-        """检查是否是重复回复"""
-        if agent_name not in self.response_cache:
+    def _is_duplicate_response(self, response: str, agent_name: str, room: str = DEFAULT_ROOM,
+                               response_type: str = "llm_generated") -> bool:
+        """检查是否与该居民或聊天室内其他居民最近的回复近似重复"""
+        if response_type == "fallback":
+            # 模板回复的重复由备用回复引擎避免（排除该居民最近用过的模板），不同居民抽到同一模板不算复述
             return False
-        
-        recent_responses = self.response_cache[agent_name]
-        
-        if response in recent_responses:
-            return True
-            
-        for cached_response in recent_responses:
-            response_words = set(response.replace('，', ' ').replace('。', ' ').split())
-            cached_words = set(cached_response.replace('，', ' ').replace('。', ' ').split())
-            
-            if response_words and cached_words:
-                intersection = response_words & cached_words
-                union = response_words | cached_words
-                similarity = len(intersection) / len(union)
-                
-                if similarity > 0.7:
-                    return True
-        
-        return False
+        match = near_duplicate_detector.find(response, agent_name, room)
+        if match is None:
+            return False
+        print(f"🔁 {agent_name} 的回复与{match.speaker}之前的回复重复 (相似度 {match.similarity:.2f})，已丢弃")
+        return True
     
-    def _cache_response(self, response: str, agent_name: str):
-        """缓存回复"""
-        if agent_name not in self.response_cache:
-            self.response_cache[agent_name] = []
-        
-        self.response_cache[agent_name].append(response)
-        
-        if len(self.response_cache[agent_name]) > 3:
-            self.response_cache[agent_name] = self.response_cache[agent_name][-3:]
+    def _cache_response(self, response: str, agent_name: str, room: str = DEFAULT_ROOM,
+                        response_type: str = "llm_generated"):
+        """缓存回复（模板回复不计入）"""
+        if response_type != "fallback":
+            near_duplicate_detector.add(response, agent_name, room)
     
     def _update_agent_state(self, profile: Dict[str, Any], user_message: str, response: str, topic_category: str):
         """更新成员状态"""
@@ -599,17 +512,18 @@ class SmartChatHandler:
             topic_category = agent_info["topic_category"]
             conversation_context = agent_info["conversation_context"]
             
-            # 使用LLM生成智能回复
-            response = await self._generate_llm_response(
-                profile, user_message, topic_category, conversation_context
+            # 使用LLM生成智能回复，截止时间由聊天链路在收到用户消息时确定
+            response, response_type = await self._generate_llm_response(
+                profile, user_message, topic_category, conversation_context, agent_info.get("deadline")
             )
+            room = agent_info.get("room", DEFAULT_ROOM)
             
-            if response and not self._is_duplicate_response(response, profile["name"]):
+            if response and not self._is_duplicate_response(response, profile["name"], room, response_type):
                 # 更新成员状态
                 self._update_agent_state(profile, user_message, response, topic_category)
                 
                 # 缓存回复，避免重复
-                self._cache_response(response, profile["name"])
+                self._cache_response(response, profile["name"], room, response_type)
                 
                 return {
                     "agent_id": agent_info["agent_id"],
@@ -617,11 +531,11 @@ class SmartChatHandler:
                     "response": response,
                     "delay": agent_info["delay"],
                     "participation_score": agent_info["participation_score"],
-                    "response_type": "llm_generated"
+                    "response_type": response_type
                 }
             
             return None
-            
+        
         except Exception as e:
             print(f"❌ 生成 {agent_info['agent_name']} 回复失败: {str(e)}")
             return None
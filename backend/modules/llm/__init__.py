@@ -3,22 +3,41 @@ LLM模块
 包含OpenAI API集成、提示词管理、指令解析和响应生成等功能
 """
 
-from .config import LLMConfig, LLMProvider, get_llm_config, validate_llm_config
+from .config import LLMConfig, LLMProvider, BackendSpec, get_llm_config, validate_llm_config, reload_llm_config, llm_config_manager, watch_env_file
 from .prompts import GamePrompts, PromptType, game_prompts
+from .prompt_assembly import PromptSegment, AssembledPrompt, PromptCacheStats, assemble_messages, assemble_text
 from .command_parser import CommandParser, CommandType, ParsedCommand, command_parser
+from .backends import create_client, register_driver
 from .response_generator import ResponseGenerator, LLMResponse, response_generator
+from .single_flight import SingleFlight, prompt_fingerprint
+from .hedging import Deadline, LatencyTracker, hedged_call
+from .router import LLMBackend, LLMRouter
+from .token_counter import TokenCounter, ContextSection, build_context, token_counter
+from .fallback_engine import FallbackEngine, TemplateTable, fallback_engine
+from .structured_output import OutputField, OutputSchema, StructuredResult, StreamingFieldExtractor, parse_structured, output_schemas
 
 __all__ = [
     # 配置相关
     "LLMConfig",
     "LLMProvider", 
+    "BackendSpec",
     "get_llm_config",
     "validate_llm_config",
+    "reload_llm_config",
+    "llm_config_manager",
+    "watch_env_file",
+    "create_client",
+    "register_driver",
     
     # 提示词相关
     "GamePrompts",
     "PromptType",
     "game_prompts",
+    "PromptSegment",
+    "AssembledPrompt",
+    "PromptCacheStats",
+    "assemble_messages",
+    "assemble_text",
     
     # 指令解析相关
     "CommandParser",
@@ -29,5 +48,37 @@ __all__ = [
     # 响应生成相关
     "ResponseGenerator",
     "LLMResponse",
-    "response_generator"
+    "response_generator",
+    
+    # 请求合并相关
+    "SingleFlight",
+    "prompt_fingerprint",
+    
+    # 对冲与截止时间相关
+    "Deadline",
+    "LatencyTracker",
+    "hedged_call",
+    
+    # 多后端路由相关
+    "LLMBackend",
+    "LLMRouter",
+    
+    # Token计数相关
+    "TokenCounter",
+    "ContextSection",
+    "build_context",
+    "token_counter",
+    
+    # 结构化输出相关
+    "OutputField",
+    "OutputSchema",
+    "StructuredResult",
+    "StreamingFieldExtractor",
+    "parse_structured",
+    "output_schemas",
+    
+    # 备用回复相关
+    "FallbackEngine",
+    "TemplateTable",
+    "fallback_engine"
 ] 
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+LLM后端驱动模块
+按提供商注册客户端构造函数，ResponseGenerator通过统一入口创建客户端；
+所有驱动返回兼容OpenAI Chat Completions接口的异步客户端
+"""
+
+from typing import Dict, Any, Callable, Optional
+import logging
+
+try:
+    from openai import AsyncOpenAI
+except ImportError:
+    AsyncOpenAI = None
+
+from .config import LLMConfig, LLMProvider
+
+# 本地服务通常不校验密钥，但OpenAI客户端要求非空
+LOCAL_PLACEHOLDER_API_KEY = "local"
+LOCAL_INPROCESS_BASE_URL = "http://mock-llm/v1"
+
+ClientDriver = Callable[[LLMConfig, Optional[Any]], Any]
+
+_drivers: Dict[LLMProvider, ClientDriver] = {}
+
+logger = logging.getLogger(__name__)
+
+def register_driver(provider: LLMProvider) -> Callable[[ClientDriver], ClientDriver]:
+    """注册提供商的客户端构造函数（装饰器）"""
+    def decorator(driver: ClientDriver) -> ClientDriver:
+        _drivers[provider] = driver
+        return driver
+    return decorator
+
+def create_client(config: LLMConfig, http_client: Optional[Any] = None) -> Optional[Any]:
+    """
+    按配置创建客户端
+    
+    Args:
+        config: LLM配置
+        http_client: 共享连接池的httpx.AsyncClient，客户端关闭时随之关闭；为None时使用OpenAI库默认连接
+    
+    Returns:
+        Optional[Any]: 异步客户端；提供商没有驱动时返回None
+    """
+    if AsyncOpenAI is None:
+        logger.error("OpenAI库未安装，请运行: pip install openai")
+        return None
+    driver = _drivers.get(config.provider)
+    if driver is None:
+        logger.error(f"暂不支持的LLM提供商: {config.provider.value}")
+        return None
+    return driver(config, http_client)
+
+def get_supported_providers() -> list:
+    """获取已注册驱动的提供商"""
+    return [provider.value for provider in _drivers]
+
+def _transport_options(config: LLMConfig, http_client: Optional[Any]) -> Dict[str, Any]:
+    """超时和连接参数；使用连接池时沿用其分项超时（传入单个数值会覆盖分项超时）"""
+    options = {"max_retries": config.max_retries}
+    if http_client is not None:
+        options["http_client"] = http_client
+        options["timeout"] = http_client.timeout
+    else:
+        options["timeout"] = config.timeout
+    return options
+
+@register_driver(LLMProvider.OPENAI)
+def _create_openai_client(config: LLMConfig, http_client: Optional[Any] = None):
+    client_config = {
+        "api_key": config.api_key,
+        **_transport_options(config, http_client)
+    }
+    if config.base_url:
+        client_config["base_url"] = config.base_url
+    logger.info("OpenAI客户端初始化成功")
+    return AsyncOpenAI(**client_config)
+
+@register_driver(LLMProvider.AZURE_OPENAI)
+def _create_azure_client(config: LLMConfig, http_client: Optional[Any] = None):
+    from openai import AsyncAzureOpenAI
+    logger.info("Azure OpenAI客户端初始化成功")
+    return AsyncAzureOpenAI(
+        api_key=config.api_key,
+        azure_endpoint=config.azure_endpoint,
+        api_version=config.api_version,
+        **_transport_options(config, http_client)
+    )
+
+@register_driver(LLMProvider.LOCAL)
+def _create_local_client(config: LLMConfig, http_client: Optional[Any] = None):
+    """
+    本地后端：连接本机的OpenAI兼容服务（vLLM、Ollama、模拟服务等）；
+    配置为进程内模式时直接在进程内调用模拟服务，不经过网络（不使用连接池）
+    """
+    client_config = {
+        "api_key": config.api_key or LOCAL_PLACEHOLDER_API_KEY,
+        **_transport_options(config, None if config.local_inprocess else http_client)
+    }
+    if config.local_inprocess:
+        import httpx
+        from .mock_server import create_mock_app, InProcessTransport
+        
+        client_config["base_url"] = LOCAL_INPROCESS_BASE_URL
+        client_config["http_client"] = httpx.AsyncClient(
+            transport=InProcessTransport(create_mock_app()),
+            base_url=LOCAL_INPROCESS_BASE_URL,
+            timeout=config.timeout
+        )
+        logger.info("本地模拟LLM（进程内）初始化成功")
+    else:
+        client_config["base_url"] = config.base_url
+        logger.info(f"本地LLM客户端初始化成功: {config.base_url}")
+    return AsyncOpenAI(**client_config)
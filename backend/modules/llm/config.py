@@ -1,13 +1,22 @@
 """
 LLM配置模块
-包含OpenAI API配置和其他LLM相关设置
+包含OpenAI API配置和其他LLM相关设置；
+配置加载一次后缓存为不可变快照，环境变量或.env文件变化后通过reload原子替换并通知监听者
 """
 
 import os
-from typing import Optional, Dict, Any
-from dataclasses import dataclass
+import asyncio
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Tuple
+from dataclasses import dataclass, fields, replace
 from enum import Enum
 
+from modules.shared.env_file import apply_env_file
+
 class LLMProvider(Enum):
     """LLM提供商枚举"""
     OPENAI = "openai"
@@ -15,9 +24,9 @@ class LLMProvider(Enum):
     CLAUDE = "claude"
     LOCAL = "local"
 
-@dataclass
+@dataclass(frozen=True)
 class LLMConfig:
-    """LLM配置类"""
+    """LLM配置类（不可变快照）"""
     provider: LLMProvider = LLMProvider.OPENAI
     api_key: Optional[str] = None
     base_url: Optional[str] = None
@@ -32,20 +41,120 @@ class LLMConfig:
     azure_deployment: Optional[str] = None
     api_version: str = "2023-12-01-preview"
     
+    # 本地后端配置
+    local_inprocess: bool = False  # 在进程内调用模拟服务，无需单独启动
+    
     # 请求限流配置
     rate_limit_requests_per_minute: int = 60
     rate_limit_tokens_per_minute: int = 90000
+    
+    # HTTP连接池配置（read超时沿用timeout）
+    http_max_connections: int = 100
+    http_max_keepalive: int = 20
+    http_keepalive_expiry: float = 120.0
+    http2: bool = True                  # 安装h2时启用
+    http_connect_timeout: float = 5.0
+    http_write_timeout: float = 10.0
+    http_pool_timeout: float = 10.0     # 等待空闲连接的上限
+    http_warmup_connections: int = 4    # 启动时预先建立的连接数
+    
+    # 请求对冲配置：超过该模板近期耗时的hedge_quantile分位数仍未返回时再发一个相同的请求
+    hedge_enabled: bool = True
+    hedge_quantile: float = 0.95
+    hedge_min_delay: float = 0.5
+    
+    # 熔断与自适应并发配置
+    breaker_failure_rate: float = 0.5
+    breaker_min_calls: int = 10
+    breaker_open_seconds: float = 15.0
+    concurrency_initial: int = 16
+    concurrency_min: int = 2
+    concurrency_max: int = 64
+    concurrency_queue_timeout: float = 5.0  # 并发已满时排队等待名额的上限
+    
+    # 额外的后端（LLM_BACKENDS），与本配置（主后端）一起由路由器按模板分配请求
+    backends: Tuple["BackendSpec", ...] = ()
+    
+    # 快照版本，每次配置变化后递增
+    version: int = 0
+
+@dataclass(frozen=True)
+class BackendSpec:
+    """LLM_BACKENDS中的一个后端：未指定的字段沿用主后端配置"""
+    name: str
+    config: LLMConfig
+    templates: Tuple[str, ...] = ()  # 优先处理的提示词模板，空表示不指定
+
+# LLM_BACKENDS条目中可覆盖的字段（rpm/tpm为限流的简写）
+BACKEND_OVERRIDE_FIELDS = {
+    "provider", "base_url", "api_key", "model", "max_tokens", "temperature", "timeout",
+    "azure_endpoint", "azure_deployment", "api_version", "local_inprocess"
+}
+
+ConfigListener = Callable[[LLMConfig, LLMConfig], None]
 
 class LLMConfigManager:
     """LLM配置管理器"""
     
     def __init__(self):
-        self._config = None
+        self.logger = logging.getLogger(__name__)
+        # (配置, 校验结果) 作为一个整体替换，读取方不会看到新配置配旧校验结果
+        self._snapshot: Optional[Tuple[LLMConfig, Tuple[bool, str]]] = None
+        self._listeners: List[ConfigListener] = []
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[float] = None
+        self.reload_count = 0
     
     @property
     def config(self) -> LLMConfig:
-        """获取配置，每次都重新加载以确保获取最新环境变量"""
-        return self._load_config()
+        """获取当前配置快照（只在首次访问时读取环境变量）"""
+        return self._get_snapshot()[0]
+    
+    def _get_snapshot(self) -> Tuple[LLMConfig, Tuple[bool, str]]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._swap(self._load_config())
+                snapshot = self._snapshot
+        return snapshot
+    
+    def add_listener(self, listener: ConfigListener):
+        """注册配置变化监听者，参数为 (旧配置, 新配置)"""
+        self._listeners.append(listener)
+    
+    def reload(self, force: bool = False) -> Tuple[LLMConfig, bool]:
+        """
+        重新读取环境变量；配置有变化（或force）时原子替换快照并通知监听者
+        
+        Returns:
+            Tuple: (当前配置, 是否替换)
+        """
+        with self._lock:
+            old = self._snapshot[0] if self._snapshot else None
+            new = self._load_config()
+            if old is not None and not force and self._same(old, new):
+                return old, False
+            new = replace(new, version=(old.version + 1) if old else 0)
+            self._swap(new)
+            self.reload_count += 1
+        
+        self.logger.info(f"LLM配置已更新到版本 {new.version}")
+        if old is not None:
+            for listener in self._listeners:
+                try:
+                    listener(old, new)
+                except Exception as e:
+                    self.logger.error(f"LLM配置监听者处理失败: {str(e)}")
+        return new, True
+    
+    def _swap(self, config: LLMConfig):
+        self._snapshot = (config, self._validate(config))
+        self.loaded_at = time.time()
+    
+    @staticmethod
+    def _same(a: LLMConfig, b: LLMConfig) -> bool:
+        return all(getattr(a, f.name) == getattr(b, f.name) for f in fields(LLMConfig) if f.name != "version")
     
     def _load_config(self) -> LLMConfig:
         """从环境变量和配置文件加载配置"""
@@ -65,10 +174,15 @@ class LLMConfigManager:
             os.getenv("API_KEY")
         )
         
+        # 本地后端默认连接本机的模拟服务
+        base_url = os.getenv("OPENAI_BASE_URL")
+        if provider == LLMProvider.LOCAL:
+            base_url = os.getenv("LOCAL_LLM_BASE_URL") or base_url or "http://127.0.0.1:8001/v1"
+        
         config = LLMConfig(
             provider=provider,
             api_key=api_key,
-            base_url=os.getenv("OPENAI_BASE_URL"),
+            base_url=base_url,
             model=os.getenv("LLM_MODEL", "gpt-3.5-turbo"),
             max_tokens=int(os.getenv("LLM_MAX_TOKENS", "1000")),
             temperature=float(os.getenv("LLM_TEMPERATURE", "0.7")),
@@ -80,54 +194,155 @@ class LLMConfigManager:
             azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
             api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2023-12-01-preview"),
             
+            # 本地后端配置
+            local_inprocess=os.getenv("LOCAL_LLM_INPROCESS", "false").lower() in ("1", "true", "yes"),
+            
             # 限流配置
             rate_limit_requests_per_minute=int(os.getenv("LLM_RATE_LIMIT_RPM", "60")),
-            rate_limit_tokens_per_minute=int(os.getenv("LLM_RATE_LIMIT_TPM", "90000"))
+            rate_limit_tokens_per_minute=int(os.getenv("LLM_RATE_LIMIT_TPM", "90000")),
+            
+            # HTTP连接池配置
+            http_max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100")),
+            http_max_keepalive=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20")),
+            http_keepalive_expiry=float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "120")),
+            http2=os.getenv("LLM_HTTP2", "true").lower() in ("1", "true", "yes"),
+            http_connect_timeout=float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "5")),
+            http_write_timeout=float(os.getenv("LLM_HTTP_WRITE_TIMEOUT", "10")),
+            http_pool_timeout=float(os.getenv("LLM_HTTP_POOL_TIMEOUT", "10")),
+            http_warmup_connections=int(os.getenv("LLM_HTTP_WARMUP_CONNECTIONS", "4")),
+            
+            # 请求对冲配置
+            hedge_enabled=os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes"),
+            hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+            hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5")),
+            
+            # 熔断与自适应并发配置
+            breaker_failure_rate=float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5")),
+            breaker_min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", "10")),
+            breaker_open_seconds=float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "15")),
+            concurrency_initial=int(os.getenv("LLM_CONCURRENCY_INITIAL", "16")),
+            concurrency_min=int(os.getenv("LLM_CONCURRENCY_MIN", "2")),
+            concurrency_max=int(os.getenv("LLM_CONCURRENCY_MAX", "64")),
+            concurrency_queue_timeout=float(os.getenv("LLM_CONCURRENCY_QUEUE_TIMEOUT", "5"))
         )
         
-        return config
+        return replace(config, backends=self._load_backends(config))
+    
+    def _load_backends(self, base: LLMConfig) -> Tuple[BackendSpec, ...]:
+        """
+        解析LLM_BACKENDS（JSON数组），例如:
+        [{"name": "fast", "model": "Qwen/Qwen2.5-7B-Instruct", "templates": ["agent_conversation_response"], "rpm": 300},
+         {"name": "strong", "model": "Qwen/Qwen3-235B-A22B", "templates": ["command_execution"], "api_key_env": "STRONG_API_KEY"}]
+        格式错误或配置无效的条目会被跳过
+        """
+        raw = os.getenv("LLM_BACKENDS", "").strip()
+        if not raw:
+            return ()
+        try:
+            entries = json.loads(raw)
+            if not isinstance(entries, list):
+                raise ValueError("应为JSON数组")
+        except ValueError as e:
+            self.logger.error(f"LLM_BACKENDS格式错误: {str(e)}")
+            return ()
+        
+        specs = []
+        for entry in entries:
+            try:
+                name = str(entry["name"])
+                templates = entry.get("templates") or []
+                if not isinstance(templates, list) or not all(isinstance(template, str) for template in templates):
+                    raise ValueError("templates应为字符串数组")
+                overrides = {key: value for key, value in entry.items() if key in BACKEND_OVERRIDE_FIELDS}
+                if "provider" in overrides:
+                    overrides["provider"] = LLMProvider(str(overrides["provider"]).lower())
+                if entry.get("api_key_env"):
+                    overrides["api_key"] = os.getenv(entry["api_key_env"])
+                if "rpm" in entry:
+                    overrides["rate_limit_requests_per_minute"] = int(entry["rpm"])
+                if "tpm" in entry:
+                    overrides["rate_limit_tokens_per_minute"] = int(entry["tpm"])
+                config = replace(base, **overrides)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                label = entry.get("name") if isinstance(entry, dict) else type(entry).__name__  # 条目可能含api_key，不整体输出
+                self.logger.error(f"LLM_BACKENDS条目无效，已跳过: {label} ({str(e)})")
+                continue
+            
+            is_valid, message = self._validate(config)
+            if not is_valid:
+                self.logger.error(f"LLM后端 {name} 配置无效，已跳过: {message}")
+                continue
+            specs.append(BackendSpec(name=name, config=config, templates=tuple(templates)))
+        return tuple(specs)
     
     def get_client_config(self) -> Dict[str, Any]:
         """获取客户端配置字典"""
-        if self.config.provider == LLMProvider.OPENAI:
+        config = self.config
+        if config.provider == LLMProvider.OPENAI:
             config_dict = {
-                "api_key": self.config.api_key,
-                "timeout": self.config.timeout,
-                "max_retries": self.config.max_retries
+                "api_key": config.api_key,
+                "timeout": config.timeout,
+                "max_retries": config.max_retries
             }
-            if self.config.base_url:
-                config_dict["base_url"] = self.config.base_url
+            if config.base_url:
+                config_dict["base_url"] = config.base_url
             return config_dict
             
-        elif self.config.provider == LLMProvider.AZURE_OPENAI:
+        elif config.provider == LLMProvider.AZURE_OPENAI:
             return {
-                "api_key": self.config.api_key,
-                "azure_endpoint": self.config.azure_endpoint,
-                "api_version": self.config.api_version,
-                "timeout": self.config.timeout,
-                "max_retries": self.config.max_retries
+                "api_key": config.api_key,
+                "azure_endpoint": config.azure_endpoint,
+                "api_version": config.api_version,
+                "timeout": config.timeout,
+                "max_retries": config.max_retries
+            }
+        
+        elif config.provider == LLMProvider.LOCAL:
+            return {
+                "base_url": config.base_url,
+                "local_inprocess": config.local_inprocess,
+                "timeout": config.timeout,
+                "max_retries": config.max_retries
             }
         
         return {}
     
     def validate_config(self) -> tuple[bool, str]:
-        """验证配置是否有效"""
-        if not self.config.api_key:
+        """验证配置是否有效（结果随快照缓存）"""
+        return self._get_snapshot()[1]
+    
+    @staticmethod
+    def _validate(config: LLMConfig) -> tuple[bool, str]:
+        # 本地后端不需要密钥
+        if not config.api_key and config.provider != LLMProvider.LOCAL:
             return False, "缺少API密钥配置"
         
-        if self.config.provider == LLMProvider.AZURE_OPENAI:
-            if not self.config.azure_endpoint:
+        if config.provider == LLMProvider.LOCAL and not (config.local_inprocess or config.base_url):
+            return False, "本地LLM需要配置 LOCAL_LLM_BASE_URL"
+        
+        if config.provider == LLMProvider.AZURE_OPENAI:
+            if not config.azure_endpoint:
                 return False, "Azure OpenAI 需要配置 endpoint"
-            if not self.config.azure_deployment:
+            if not config.azure_deployment:
                 return False, "Azure OpenAI 需要配置 deployment"
         
-        if self.config.max_tokens <= 0:
+        if config.max_tokens <= 0:
             return False, "max_tokens 必须大于0"
         
-        if not (0 <= self.config.temperature <= 2):
+        if not (0 <= config.temperature <= 2):
             return False, "temperature 必须在0-2之间"
         
         return True, "配置有效"
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取配置快照状态"""
+        config = self.config
+        return {
+            "version": config.version,
+            "loaded_at": self.loaded_at,
+            "reload_count": self.reload_count,
+            "listeners": len(self._listeners)
+        }
 
 # 全局配置实例
 llm_config_manager = LLMConfigManager()
@@ -138,4 +353,26 @@ def get_llm_config() -> LLMConfig:
 
 def validate_llm_config() -> tuple[bool, str]:
     """验证LLM配置"""
-    return llm_config_manager.validate_config() 
\ No newline at end of file
+    return llm_config_manager.validate_config()
+
+def reload_llm_config(force: bool = False) -> Tuple[LLMConfig, bool]:
+    """重新加载LLM配置"""
+    return llm_config_manager.reload(force)
+
+async def watch_env_file(path: Path, interval_seconds: float = 5.0):
+    """监视.env文件，修改后把其中的变量写入环境（文件中删除的变量同步移除）并重新加载LLM配置"""
+    logger = logging.getLogger(__name__)
+    last_mtime = path.stat().st_mtime if path.exists() else None
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            mtime = path.stat().st_mtime if path.exists() else None
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+            apply_env_file(path)
+            config, changed = llm_config_manager.reload()
+            if changed:
+                logger.info(f"检测到 {path.name} 变化，LLM配置已重新加载 (版本 {config.version})")
+        except Exception as e:
+            logger.error(f"监视环境变量文件失败: {str(e)}") 
\ No newline at end of file
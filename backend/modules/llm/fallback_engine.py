@@ -0,0 +1,474 @@
+"""
+本地备用回复模块
+LLM不可用时所有居民回复都由这里生成：模板表在加载时一次性建成索引，键为（话题, 性格, 职业, 发言位置），
+性格相关的改写和过滤也在建索引时完成；每次生成只做关键词分类（预编译正则）、一次字典查找和一次抽样。
+抽样器使用固定种子，并排除每个居民最近用过的模板，避免同一居民反复说同样的话
+"""
+
+from typing import Dict, List, Optional, Any, Callable, Tuple, NamedTuple, Pattern
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import islice
+import os
+import random
+import re
+
+ANY = ""              # 不区分性格/职业
+ANY_TURN = "*"        # 不区分发言位置
+TURN_FIRST = "first"  # 第一个发言
+TURN_REPLY = "reply"  # 回应前面的发言
+
+PERSONALITIES = ("乐观开朗", "现实主义", "创造型", "分析型", "社交型", "内向型", "领导型", "支持型")
+OCCUPATIONS = ("教师", "医生", "工程师", "艺术家", "商人", "农民", "学生", "研究员", "厨师", "建筑工人")
+
+def _value(value: Any) -> str:
+    """枚举取其值，其余转为字符串"""
+    return str(getattr(value, "value", value) or "")
+
+@lru_cache(maxsize=256)
+def canonical_personality(personality: str) -> str:
+    """归一到标准性格（按前两个字匹配，如"乐观"->"乐观开朗"），无法识别时不区分性格"""
+    for name in PERSONALITIES:
+        if name in personality or name[:2] in personality:
+            return name
+    return ANY
+
+@lru_cache(maxsize=256)
+def canonical_occupation(occupation: str) -> str:
+    for name in OCCUPATIONS:
+        if name in occupation:
+            return name
+    return ANY
+
+class KeywordRule(NamedTuple):
+    """关键词分类规则：命中后继续按子规则细分，子规则都不命中时取本规则的话题"""
+    topic: str
+    pattern: Pattern
+    subrules: Tuple["KeywordRule", ...] = ()
+
+def keyword_rule(topic: str, keywords: Tuple[str, ...], *subrules: KeywordRule) -> KeywordRule:
+    return KeywordRule(topic, re.compile("|".join(map(re.escape, keywords))), subrules)
+
+def classify(text: str, rules: Tuple[KeywordRule, ...], default: str) -> str:
+    """按顺序返回第一个命中的规则的话题"""
+    for rule in rules:
+        if rule.pattern.search(text):
+            return classify(text, rule.subrules, rule.topic) if rule.subrules else rule.topic
+    return default
+
+@dataclass(frozen=True)
+class ReplyTemplate:
+    """一条回复模板；同一模板按性格改写后的版本共用id，最近使用排除按id计算"""
+    id: int
+    text: str
+    needs_format: bool
+
+@dataclass
+class TemplateTable:
+    """一组模板及其性格改写规则"""
+    name: str
+    entries: List[Tuple[str, str, str, str, Tuple[str, ...]]]  # (话题, 发言位置, 性格, 职业, 模板)
+    default_topic: str
+    styles: Dict[str, Callable[[str], str]] = field(default_factory=dict)   # 性格 -> 模板改写
+    filters: Dict[str, Callable[[str], bool]] = field(default_factory=dict)  # 性格 -> 模板筛选
+    empty_reply: str = "我也有类似的想法。"  # 筛选后没有模板时使用
+
+class _SafeFields(dict):
+    """缺少的占位字段保持原样"""
+    
+    def __missing__(self, key: str) -> str:
+        return "{" + key + "}"
+
+class RecentUseSampler:
+    """带种子的抽样器，排除每个居民最近用过的模板"""
+    
+    def __init__(self, seed: Optional[int] = None, recent_size: int = 6, attempts: int = 3):
+        self.rng = random.Random(seed)
+        self.recent_size = recent_size
+        self.attempts = attempts  # 随机重抽的次数，仍命中最近使用时才筛选候选
+        self._recent: Dict[str, deque] = {}
+        self.stats = {"sampled": 0, "redrawn": 0, "filtered": 0}
+    
+    def pick(self, resident: str, candidates: Tuple[ReplyTemplate, ...]) -> ReplyTemplate:
+        """排除该居民最近用过的模板后随机抽取；排除个数少于候选数，保证总有模板可选"""
+        recent = self._recent.get(resident)
+        if recent is None:
+            recent = self._recent[resident] = deque(maxlen=self.recent_size)
+        self.stats["sampled"] += 1
+        window = min(len(recent), len(candidates) - 1)
+        excluded = set(islice(reversed(recent), window)) if window > 0 else ()
+        
+        for attempt in range(self.attempts):
+            template = candidates[self.rng.randrange(len(candidates))]
+            if template.id not in excluded:
+                self.stats["redrawn"] += int(attempt > 0)
+                break
+        else:
+            self.stats["filtered"] += 1
+            template = self.rng.choice([candidate for candidate in candidates if candidate.id not in excluded])
+        recent.append(template.id)
+        return template
+    
+    @property
+    def residents(self) -> int:
+        return len(self._recent)
+    
+    def forget(self, resident: str):
+        self._recent.pop(resident, None)
+
+class FallbackEngine:
+    """本地备用回复引擎"""
+    
+    def __init__(self, tables: Tuple[TemplateTable, ...], seed: Optional[int] = None, recent_size: int = 6):
+        self.sampler = RecentUseSampler(seed, recent_size)
+        self.tables = {table.name: table for table in tables}
+        self._template_count = 0
+        self._index: Dict[Tuple[str, str, str, str, str], Tuple[ReplyTemplate, ...]] = {}
+        self._turns: Dict[str, Tuple[str, ...]] = {}
+        for table in tables:
+            self._build_index(table)
+        self.stats: Dict[str, int] = {name: 0 for name in self.tables}
+    
+    def _build_index(self, table: TemplateTable):
+        """展开所有（话题, 性格, 职业, 发言位置）组合，合并通用模板和性格/职业专属模板，并预先完成性格改写"""
+        turns = {turn for _, turn, _, _, _ in table.entries if turn != ANY_TURN} or {ANY_TURN}
+        buckets: Dict[Tuple[str, str, str, str], List[ReplyTemplate]] = {}
+        for topic, turn, personality, occupation, texts in table.entries:
+            templates = []
+            for text in texts:
+                templates.append(ReplyTemplate(self._template_count, text, "{" in text))
+                self._template_count += 1
+            for entry_turn in (turns if turn == ANY_TURN else (turn,)):
+                buckets.setdefault((topic, entry_turn, personality, occupation), []).extend(templates)
+        
+        self._turns[table.name] = tuple(sorted(turns))
+        for topic, turn in {(topic, turn) for topic, turn, _, _ in buckets}:
+            generic = buckets.get((topic, turn, ANY, ANY), [])
+            for personality in (ANY,) + PERSONALITIES:
+                style = table.styles.get(personality)
+                keep = table.filters.get(personality)
+                by_personality = buckets.get((topic, turn, personality, ANY), []) if personality else []
+                for occupation in (ANY,) + OCCUPATIONS:
+                    by_occupation = buckets.get((topic, turn, ANY, occupation), []) if occupation else []
+                    candidates = []
+                    for template in generic + by_personality + by_occupation:
+                        if keep and not keep(template.text):
+                            continue
+                        if style:
+                            template = ReplyTemplate(template.id, style(template.text), template.needs_format)
+                        candidates.append(template)
+                    if not candidates:
+                        candidates = [ReplyTemplate(-1, table.empty_reply, False)]
+                    self._index[(table.name, topic, personality, occupation, turn)] = tuple(candidates)
+    
+    def candidates(self, table: str, topic: str, personality: str = ANY, occupation: str = ANY,
+                   turn: str = ANY_TURN) -> Tuple[ReplyTemplate, ...]:
+        """查找候选模板；该表没有的话题按默认话题，没有的发言位置按该表的第一个发言位置"""
+        turns = self._turns[table]
+        if turn not in turns:
+            turn = turns[0]
+        found = self._index.get((table, topic, canonical_personality(personality), canonical_occupation(occupation), turn))
+        if found is None:
+            found = self._index.get((
+                table, self.tables[table].default_topic,
+                canonical_personality(personality), canonical_occupation(occupation), turn
+            ), ())
+        return found
+    
+    def reply(self, table: str, topic: str, resident: str, personality: str = ANY, occupation: str = ANY,
+              turn: str = ANY_TURN, fields: Optional[Dict[str, str]] = None) -> str:
+        """抽取一条模板并填入字段（{name}、{occupation}等）"""
+        template = self.sampler.pick(resident, self.candidates(table, topic, personality, occupation, turn))
+        self.stats[table] += 1
+        return template.text.format_map(_SafeFields(fields or {})) if template.needs_format else template.text
+    
+    def conversation_reply(
+        self,
+        agent_info: Dict[str, Any],
+        original_topic: str,
+        current_conversation: List[str],
+        agent_own_history: List[str],
+        is_first_speaker: bool
+    ) -> str:
+        """居民对话的备用回复（LLM居民对话生成失败时）"""
+        name = agent_info.get("name", "居民")
+        personality = _value(agent_info.get("personality", "友好"))
+        occupation = _value(agent_info.get("occupation", "居民"))
+        has_spoken_before = len(agent_own_history) > 0
+        last_speaker = "前面的朋友"
+        
+        if is_first_speaker:
+            turn = TURN_FIRST
+            topic = classify(original_topic.lower(), FIRST_TURN_RULES, "general")
+            if has_spoken_before:
+                topic = "revisit_development" if topic == "development" else "revisit"
+        elif current_conversation:
+            turn = TURN_REPLY
+            last_message = current_conversation[-1]
+            if ":" in last_message:
+                last_speaker, last_content = last_message.split(":", 1)
+            else:
+                last_content = ""
+            topic = "revisit" if has_spoken_before else classify(last_content, REPLY_TURN_RULES, "general")
+        else:
+            turn, topic = TURN_REPLY, "unprompted"
+        
+        return self.reply(
+            "conversation", topic, agent_info.get("id") or name, personality, occupation, turn,
+            {"name": name, "occupation": occupation, "personality": personality, "speaker": last_speaker.strip()}
+        )
+    
+    def chat_reply(self, profile: Dict[str, Any], user_message: str) -> str:
+        """玩家消息的备用回复：按消息类型（提问/推荐/选择/分享）和居民性格、职业"""
+        topic = classify(user_message.lower(), CHAT_RULES, "default")
+        return self.reply(
+            "chat", topic, profile.get("agent_id") or profile["name"],
+            _value(profile.get("personality")), _value(profile.get("occupation"))
+        )
+    
+    def topic_reply(self, profile: Dict[str, Any], topic_category: str) -> str:
+        """按话题类别的回复内容（本地聊天系统）"""
+        return self.reply(
+            "topic", topic_category, profile.get("agent_id") or profile["name"],
+            _value(profile.get("personality")), _value(profile.get("occupation"))
+        )
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "templates": self._template_count,
+            "index_keys": len(self._index),
+            "residents": self.sampler.residents,
+            "replies": self.stats,
+            **self.sampler.stats
+        }
+
+# 居民对话：第一个发言时按原始话题分类，回应时按上一条发言分类
+FIRST_TURN_RULES = (
+    keyword_rule("development", ("发展", "社群")),
+    keyword_rule("weather", ("天气",)),
+    keyword_rule("plan", ("计划", "周末")),
+    keyword_rule("activity", ("活动",))
+)
+REPLY_TURN_RULES = (
+    keyword_rule("agree", ("同意", "支持")),
+    keyword_rule("activity", ("活动", "组织"))
+)
+
+# 玩家消息：先按消息类型，再按具体内容
+CHAT_RULES = (
+    keyword_rule(
+        "question", ("怎么", "如何", "什么", "哪里", "建议", "方法", "经验"),
+        keyword_rule("question.relax", ("放松", "压力")),
+        keyword_rule("question.learning", ("学习", "技能")),
+        keyword_rule("question.work", ("工作", "困难"))
+    ),
+    keyword_rule(
+        "recommend", ("推荐", "哪里", "什么地方", "好吃", "好玩"),
+        keyword_rule("recommend.food", ("吃", "餐厅", "火锅")),
+        keyword_rule("recommend.place", ("玩", "去哪"))
+    ),
+    keyword_rule("decision", ("怎么样", "好不好", "选择", "决定")),
+    keyword_rule("sharing", ("最近", "今天", "昨天", "感觉"))
+)
+
+CONVERSATION_TABLE = TemplateTable(
+    name="conversation",
+    default_topic="general",
+    entries=[
+        ("revisit_development", TURN_FIRST, ANY, ANY, (
+            "我是{name}，之前我也关注过这个话题，现在我想补充一些新的想法...",
+            "我是{name}，基于我之前的观察，我觉得社群发展确实有了新的变化。",
+            "大家好！我是{name}，结合我之前的经验，我想分享一些关于社群发展的看法。"
+        )),
+        ("revisit", TURN_FIRST, ANY, ANY, (
+            "我是{name}，这个话题让我想起了之前的一些讨论，我想从新的角度来看。",
+            "我是{name}，虽然之前我们聊过类似的话题，但今天我有了新的想法。",
+            "大家好！我是{name}，基于我之前的思考，我想分享一些新的观点。"
+        )),
+        ("development", TURN_FIRST, ANY, ANY, (
+            "我是{name}，作为{occupation}，我觉得我们社群的发展还是很不错的！大家都很积极参与各种活动。",
+            "嗨！我是{name}，从我{personality}的角度来看，社群最近的氛围越来越好了，邻里关系也更和谐。",
+            "大家好！我是{name}，我觉得我们社群在教育、健康等方面都有不少进步，值得高兴！"
+        )),
+        ("weather", TURN_FIRST, ANY, ANY, (
+            "我是{name}，确实！今天天气特别好，很适合出门活动呢！",
+            "是啊！我是{name}，这样的好天气让人心情都变好了，我们可以组织一些户外活动。",
+            "我是{name}，天气好的时候总是让人精神焕发，社群里的大家也都更有活力了！"
+        )),
+        ("plan", TURN_FIRST, ANY, ANY, (
+            "我是{name}，周末我打算和邻居们一起做些有意义的事情，比如社区志愿活动。",
+            "我是{name}，作为{occupation}，我周末想组织一些有益的活动，让大家都能参与进来。",
+            "我是{name}，周末是放松和交流的好时机，我们可以一起规划一些有趣的事情！"
+        )),
+        ("activity", TURN_FIRST, ANY, ANY, (
+            "我是{name}，我觉得组织活动是个好主意！可以增进大家的感情，让社群更有凝聚力。",
+            "我是{name}，作为{occupation}，我很支持组织各种活动，这对社群发展很有帮助。",
+            "我是{name}，活动能让大家更好地了解彼此，我愿意积极参与和协助组织！"
+        )),
+        ("general", TURN_FIRST, ANY, ANY, (
+            "我是{name}，对于这个话题，我觉得很有意思！作为{occupation}，我想分享一下我的看法。",
+            "大家好！我是{name}，这个话题让我想到了很多，我们可以深入讨论一下。",
+            "我是{name}，从我{personality}的角度来看，这确实是个值得关注的话题。"
+        )),
+        ("general", TURN_FIRST, ANY, "教师", ("我是{name}，作为老师，我想从孩子们的角度说说这个话题。",)),
+        ("general", TURN_FIRST, ANY, "医生", ("我是{name}，平时在医院工作，我想从健康的角度聊聊这个话题。",)),
+        ("general", TURN_FIRST, ANY, "工程师", ("我是{name}，作为工程师，我习惯先把问题拆开来看，这个话题也可以这样分析。",)),
+        ("general", TURN_FIRST, ANY, "艺术家", ("我是{name}，这个话题给了我不少灵感，我想从不一样的角度来看看。",)),
+        ("general", TURN_FIRST, ANY, "商人", ("我是{name}，做生意让我见过各种各样的人，我想分享一点自己的看法。",)),
+        ("general", TURN_FIRST, ANY, "农民", ("我是{name}，我们种地的人看事情比较实在，我说说我的想法。",)),
+        ("general", TURN_FIRST, ANY, "学生", ("我是{name}，作为学生，我对这个话题特别好奇，想听听大家的看法。",)),
+        ("general", TURN_FIRST, ANY, "研究员", ("我是{name}，我做研究习惯先看数据，这个话题我也想认真分析一下。",)),
+        ("general", TURN_FIRST, ANY, "厨师", ("我是{name}，平时在厨房忙，不过这个话题我也很想参与讨论。",)),
+        ("general", TURN_FIRST, ANY, "建筑工人", ("我是{name}，我在工地上干活，对这个话题也有自己的一些体会。",)),
+        ("revisit", TURN_REPLY, ANY, ANY, (
+            "我是{name}，{speaker}的观点很有意思，结合我之前的想法，我觉得...",
+            "我是{name}，听了{speaker}的分享，让我想起了我之前提到的一些观点，现在我想进一步补充...",
+            "我是{name}，{speaker}说得很好，这和我之前的思考有些相似，我想从另一个角度来看..."
+        )),
+        ("agree", TURN_REPLY, ANY, ANY, (
+            "我也同意{speaker}的观点！我是{name}，我想补充一点...",
+            "是的，{speaker}说得很对。我是{name}，从{occupation}的角度来看，这确实很重要。",
+            "我是{name}，{speaker}的想法很好，我们可以一起努力实现这些目标。"
+        )),
+        ("activity", TURN_REPLY, ANY, ANY, (
+            "我是{name}，听了{speaker}的建议，我觉得我们可以从小事做起，逐步扩大活动规模。",
+            "好主意！我是{name}，作为{occupation}，我可以贡献一些专业知识来支持这些活动。",
+            "我是{name}，{speaker}提到的活动让我很感兴趣，我愿意积极参与！"
+        )),
+        ("general", TURN_REPLY, ANY, ANY, (
+            "我是{name}，听了{speaker}的分享，我也想说说我的想法...",
+            "有趣的观点！我是{name}，我想从另一个角度来看这个问题。",
+            "我是{name}，{speaker}说得很有道理，让我想到了一些相关的经历。"
+        )),
+        ("unprompted", TURN_REPLY, ANY, ANY, (
+            "我是{name}，虽然我不是第一个发言，但我也想分享一下我的看法。",
+            "我是{name}，作为{occupation}，我觉得这个话题很值得讨论。",
+            "大家好！我是{name}，听了前面的讨论，我也有一些想法要分享。"
+        ))
+    ]
+)
+
+CHAT_TABLE = TemplateTable(
+    name="chat",
+    default_topic="default",
+    styles={"乐观开朗": lambda text: text.replace("。", "！")},  # 让乐观的人更有热情
+    filters={"内向型": lambda text: len(text) < 50},            # 内向的人回复更简洁
+    entries=[
+        ("question.relax", ANY_TURN, ANY, ANY, (
+            "我平时压力大的时候会去附近公园走走，特别是早晨的时候空气很清新。",
+            "我喜欢听音乐放松，有时候也会和朋友聊聊天。",
+            "我的经验是做些运动比较有效，比如跑步或者游泳。"
+        )),
+        ("question.learning", ANY_TURN, ANY, ANY, (
+            "我觉得制定学习计划很重要，每天抽出固定时间练习。",
+            "我建议可以找一些在线课程跟着学，边学边实践效果比较好。",
+            "我的方法是先从基础开始，不要急于求成。"
+        )),
+        ("question.work", ANY_TURN, ANY, ANY, (
+            "遇到工作问题时，我通常会先梳理一下思路，看看问题出在哪里。",
+            "我的经验是多和同事交流，有时候换个角度就能找到解决办法。",
+            "我建议可以把问题拆分成小的部分，逐个解决。"
+        )),
+        ("question", ANY_TURN, ANY, ANY, (
+            "这个问题挺有意思的，我觉得可以试试从不同角度考虑一下。",
+            "我的经验是遇到这种情况时，先收集一些相关信息比较好。",
+            "我建议可以问问身边有经验的朋友，看看他们怎么处理的。"
+        )),
+        ("recommend.food", ANY_TURN, ANY, ANY, (
+            "我知道市中心有家川菜馆挺不错的，他们家的麻婆豆腐特别正宗。",
+            "我经常去学校附近那家小火锅店，老板很实在，料也很新鲜。",
+            "我推荐试试东街那家面馆，他们的牛肉面分量很足。"
+        )),
+        ("recommend.place", ANY_TURN, ANY, ANY, (
+            "我周末常去公园那边，可以散步也可以划船，环境挺好的。",
+            "我喜欢去图书馆看书，安静而且还能学到新东西。",
+            "我建议可以去市博物馆看看，最近有个很有意思的展览。"
+        )),
+        ("recommend", ANY_TURN, ANY, ANY, (
+            "这个要看你的喜好了，我个人比较喜欢安静一点的地方。",
+            "我觉得可以先在网上查查评价，然后再做决定。",
+            "我的建议是选择离家近一点的，这样比较方便。"
+        )),
+        ("decision", ANY_TURN, ANY, ANY, (
+            "我觉得这个想法不错，值得试试。",
+            "我个人觉得可以，不过最终还是要看你自己的喜好。",
+            "我的建议是可以先试试看，不合适再调整。"
+        )),
+        ("sharing", ANY_TURN, ANY, ANY, (
+            "是啊，我最近也有类似的感受。",
+            "我也注意到了这个情况，确实很有意思。",
+            "我的感觉和你差不多，可能很多人都是这样想的。"
+        )),
+        ("default", ANY_TURN, ANY, ANY, (
+            "这个话题让我想起了自己的一些经历，确实值得聊聊。",
+            "我对这个也挺感兴趣的，平时偶尔会关注一下。",
+            "我觉得这个角度很有意思，我们可以继续聊聊。"
+        )),
+        ("default", ANY_TURN, ANY, "教师", ("我在学校也常和学生聊到类似的事，孩子们的想法有时候特别有意思。",)),
+        ("default", ANY_TURN, ANY, "医生", ("我在医院见过不少类似的情况，平时多注意休息真的很关键。",)),
+        ("default", ANY_TURN, ANY, "工程师", ("我习惯把这种事情拆开来看，一步步分析反而简单。",)),
+        ("default", ANY_TURN, ANY, "艺术家", ("我最近画画的时候也在想类似的事，灵感常常就是这么来的。",)),
+        ("default", ANY_TURN, ANY, "商人", ("我做生意这些年发现，很多事情多和人聊聊就有门路了。",)),
+        ("default", ANY_TURN, ANY, "农民", ("我种地的时候也常琢磨这些，顺着时节来，急不得。",)),
+        ("default", ANY_TURN, ANY, "学生", ("我在学校和同学也讨论过这个，大家的看法还挺不一样的。",)),
+        ("default", ANY_TURN, ANY, "研究员", ("我做研究的习惯是先找点资料看看，心里就有底了。",)),
+        ("default", ANY_TURN, ANY, "厨师", ("我在厨房里也常遇到类似的事，多试几次总能找到窍门。",)),
+        ("default", ANY_TURN, ANY, "建筑工人", ("我在工地上干活也是这样，一步一步来，踏实最重要。",))
+    ]
+)
+
+TOPIC_TABLE = TemplateTable(
+    name="topic",
+    default_topic="social",
+    styles={
+        "乐观开朗": lambda text: text.replace("重要", "非常重要").replace("好", "特别好"),
+        "分析型": lambda text: f"从理性角度来看，{text}",
+        "创造型": lambda text: f"我觉得我们可以更有创意地{text}"
+    },
+    entries=[
+        ("social", ANY_TURN, ANY, ANY, (
+            "我觉得多交流真的很重要，能让我们更好地了解彼此。",
+            "社交活动总是能带来很多乐趣和新的想法。",
+            "和大家在一起聊天是我最喜欢的事情之一。"
+        )),
+        ("health", ANY_TURN, ANY, ANY, (
+            "健康确实是最重要的，我们都应该多关注自己的身体。",
+            "保持良好的生活习惯对每个人都很重要。",
+            "我觉得心理健康和身体健康同样重要。"
+        )),
+        ("education", ANY_TURN, ANY, ANY, (
+            "学习是一个终身的过程，我们都应该保持好奇心。",
+            "教育不仅仅是知识的传授，更是思维的培养。",
+            "我相信每个人都有自己独特的学习方式。"
+        )),
+        ("work", ANY_TURN, ANY, ANY, (
+            "工作虽然有挑战，但也能带来成就感。",
+            "我觉得工作和生活的平衡很重要。",
+            "团队合作总是能产生更好的结果。"
+        )),
+        ("art", ANY_TURN, ANY, ANY, (
+            "艺术能够表达我们内心深处的情感。",
+            "创造力是人类最宝贵的天赋之一。",
+            "美的事物总是能让人心情愉悦。"
+        )),
+        ("community", ANY_TURN, ANY, ANY, (
+            "我们的社群就像一个大家庭，需要每个人的参与。",
+            "社区建设需要大家共同努力。",
+            "邻里和谐是幸福生活的基础。"
+        )),
+        ("future", ANY_TURN, ANY, ANY, (
+            "对未来充满期待总是让人兴奋。",
+            "我相信只要努力，未来一定会更美好。",
+            "规划未来很重要，但也要享受当下。"
+        ))
+    ]
+)
+
+_seed = os.getenv("FALLBACK_REPLY_SEED")
+
+# 全局备用回复引擎
+fallback_engine = FallbackEngine(
+    (CONVERSATION_TABLE, CHAT_TABLE, TOPIC_TABLE),
+    seed=int(_seed) if _seed else None
+)
@@ -0,0 +1,150 @@
+"""
+请求对冲与截止时间模块
+慢请求决定了用户感受到的尾延迟：请求耗时超过该模板近期的p95仍未返回时，再发一个相同的请求，
+先成功的结果胜出，另一个立即取消；调用方传入截止时间，快到期时放弃等待，由调用方改用备用回复
+"""
+
+from typing import Dict, List, Optional, Any, Callable, Awaitable, Tuple
+from collections import deque
+import asyncio
+import time
+
+class Deadline:
+    """调用截止时间（单调时钟），沿聊天链路向下传递"""
+    
+    def __init__(self, at: float):
+        self.at = at
+    
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+    
+    def remaining(self) -> float:
+        """剩余秒数，已过期时为负数"""
+        return self.at - time.monotonic()
+    
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+    
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.2f}s)"
+
+class LatencyTracker:
+    """按提示词模板统计最近成功请求的耗时"""
+    
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples  # 样本不足时不给出分位数
+        self._samples: Dict[str, deque] = {}
+    
+    def record(self, name: str, seconds: float):
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = deque(maxlen=self.window)
+        samples.append(seconds)
+    
+    def quantile(self, name: str, q: float) -> Optional[float]:
+        samples = self._samples.get(name)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+    
+    def get_status(self) -> Dict[str, Any]:
+        status = {}
+        for name, samples in self._samples.items():
+            ordered: List[float] = sorted(samples)
+            status[name] = {
+                "samples": len(ordered),
+                "p50": round(ordered[len(ordered) // 2], 3),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3)
+            }
+        return status
+
+class HedgeStats:
+    """对冲与截止时间统计"""
+    
+    def __init__(self):
+        self.calls = 0
+        self.hedged = 0             # 发出了第二个请求
+        self.hedge_wins = 0         # 第二个请求先成功
+        self.losers_cancelled = 0
+        self.deadline_exceeded = 0  # 截止时间前没有结果
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "losers_cancelled": self.losers_cancelled,
+            "deadline_exceeded": self.deadline_exceeded
+        }
+
+async def hedged_call(
+    fn: Callable[[], Awaitable[Any]],
+    hedge_delay: Optional[float],
+    is_success: Callable[[Any], bool] = lambda result: True,
+    allow_hedge: Callable[[], bool] = lambda: True,
+    stats: Optional[HedgeStats] = None
+) -> Any:
+    """
+    执行请求，超过hedge_delay仍未完成时再发一个相同的请求
+    
+    Args:
+        fn: 发起一次请求的无参协程函数（必须可以安全地重复执行）
+        hedge_delay: 发出第二个请求前等待的秒数，None表示不对冲
+        is_success: 判断结果是否成功；失败的结果不会胜出，继续等待另一个请求
+        allow_hedge: 发出第二个请求前的检查（如限流）
+        stats: 统计
+    
+    Returns:
+        Any: 先成功的结果；都失败时返回最后完成的结果
+    """
+    if stats:
+        stats.calls += 1
+    tasks = {asyncio.create_task(fn()): "primary"}
+    try:
+        if hedge_delay is not None:
+            done, _ = await asyncio.wait(set(tasks), timeout=hedge_delay)
+            if not done and allow_hedge():
+                tasks[asyncio.create_task(fn())] = "hedge"
+                if stats:
+                    stats.hedged += 1
+        
+        pending = set(tasks)
+        last_result, last_error = None, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    continue
+                last_result, last_error = task.result(), None
+                if is_success(last_result):
+                    if stats and tasks[task] == "hedge":
+                        stats.hedge_wins += 1
+                    return last_result
+        if last_error is not None:
+            raise last_error
+        return last_result
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                if stats and len(tasks) > 1:
+                    stats.losers_cancelled += 1
+
+async def run_with_deadline(call: Awaitable[Any], deadline: Optional[Deadline]) -> Tuple[bool, Any]:
+    """
+    在截止时间前等待结果，到期时取消
+    
+    Returns:
+        Tuple: (是否按时完成, 结果)
+    """
+    if deadline is None:
+        return True, await call
+    try:
+        return True, await asyncio.wait_for(call, max(deadline.remaining(), 0))
+    except asyncio.TimeoutError:
+        return False, None
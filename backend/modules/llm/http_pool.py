@@ -0,0 +1,188 @@
+"""
+LLM HTTP连接池模块
+为LLM客户端提供显式配置的连接池：连接数上限、长连接保活、HTTP/2（安装h2时启用）、
+分项超时（建连/读/写/等待连接），启动时预先建立连接，并统计等待连接耗时和连接池饱和度
+"""
+
+from typing import Dict, List, Optional, Any
+from collections import deque
+import asyncio
+import importlib.util
+import logging
+import time
+
+import httpx
+
+from .config import LLMConfig
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+def _percentile(samples: List[float], p: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 2)
+
+class PoolMetrics:
+    """连接池指标"""
+    
+    def __init__(self, sample_size: int = 512):
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.pool_timeouts = 0
+        self.acquire_wait_ms: deque = deque(maxlen=sample_size)  # 从发起请求到拿到连接
+        self.connect_ms: deque = deque(maxlen=sample_size)       # TCP建连
+        self.tls_ms: deque = deque(maxlen=sample_size)           # TLS握手
+    
+    def to_dict(self) -> Dict[str, Any]:
+        acquire = list(self.acquire_wait_ms)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "pool_timeouts": self.pool_timeouts,
+            "acquire_wait_ms": {
+                "p50": _percentile(acquire, 0.5),
+                "p95": _percentile(acquire, 0.95),
+                "max": round(max(acquire), 2) if acquire else None
+            },
+            "connect_ms_p50": _percentile(list(self.connect_ms), 0.5),
+            "tls_ms_p50": _percentile(list(self.tls_ms), 0.5)
+        }
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """通过httpcore的trace扩展记录每个请求等待连接、建连和TLS握手的耗时"""
+    
+    def __init__(self, transport: httpx.AsyncHTTPTransport, metrics: PoolMetrics):
+        self._transport = transport
+        self._metrics = metrics
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        metrics = self._metrics
+        metrics.requests += 1
+        start = time.perf_counter()
+        marks: Dict[str, float] = {}
+        outer_trace = request.extensions.get("trace")
+        
+        async def trace(event: str, info: Dict[str, Any]):
+            now = time.perf_counter()
+            if "acquired" not in marks:
+                # 第一个连接层事件：新建连接从建连开始，复用连接直接发送请求头
+                if event == "connection.connect_tcp.started":
+                    marks["acquired"] = now
+                    metrics.new_connections += 1
+                elif event.endswith("send_request_headers.started"):
+                    marks["acquired"] = now
+                    metrics.reused_connections += 1
+                if "acquired" in marks:
+                    metrics.acquire_wait_ms.append((now - start) * 1000)
+            if event.endswith(".started"):
+                marks[event[:-len(".started")]] = now
+            elif event == "connection.connect_tcp.complete" and "connection.connect_tcp" in marks:
+                metrics.connect_ms.append((now - marks["connection.connect_tcp"]) * 1000)
+            elif event == "connection.start_tls.complete" and "connection.start_tls" in marks:
+                metrics.tls_ms.append((now - marks["connection.start_tls"]) * 1000)
+            if outer_trace is not None:
+                await outer_trace(event, info)
+        
+        request.extensions["trace"] = trace
+        try:
+            return await self._transport.handle_async_request(request)
+        except httpx.PoolTimeout:
+            metrics.pool_timeouts += 1
+            raise
+    
+    async def aclose(self):
+        await self._transport.aclose()
+
+class LLMHttpPool:
+    """LLM客户端使用的HTTP连接池"""
+    
+    def __init__(self, config: LLMConfig):
+        self.logger = logging.getLogger(__name__)
+        self.http2 = config.http2 and HTTP2_AVAILABLE
+        if config.http2 and not HTTP2_AVAILABLE:
+            self.logger.info("未安装h2，LLM连接使用HTTP/1.1（pip install h2 启用HTTP/2）")
+        
+        self.limits = httpx.Limits(
+            max_connections=config.http_max_connections,
+            max_keepalive_connections=config.http_max_keepalive,
+            keepalive_expiry=config.http_keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            connect=config.http_connect_timeout,
+            read=config.timeout,
+            write=config.http_write_timeout,
+            pool=config.http_pool_timeout
+        )
+        self.warmup_connections = config.http_warmup_connections
+        self.metrics = PoolMetrics()
+        self._transport = httpx.AsyncHTTPTransport(http2=self.http2, limits=self.limits, retries=0)
+        self.client = httpx.AsyncClient(
+            transport=InstrumentedTransport(self._transport, self.metrics),
+            timeout=self.timeout
+        )
+        self.last_warmup: Optional[Dict[str, Any]] = None
+    
+    async def warm_up(self, base_url: httpx.URL) -> Dict[str, Any]:
+        """
+        预先建立到服务端的连接（完成TCP和TLS握手），避免空闲后第一条回复承担冷启动开销
+        
+        HTTP/2下一条连接即可多路复用，只建立一条；任何HTTP状态码都说明连接已建立
+        """
+        origin = f"{base_url.scheme}://{base_url.netloc.decode('ascii')}/"
+        count = 1 if self.http2 else max(1, min(self.warmup_connections, self.limits.max_keepalive_connections or 1))
+        start = time.perf_counter()
+        
+        async def touch():
+            await self.client.head(origin)
+        
+        outcomes = await asyncio.gather(*(touch() for _ in range(count)), return_exceptions=True)
+        errors = [str(outcome) for outcome in outcomes if isinstance(outcome, Exception)]
+        self.last_warmup = {
+            "origin": origin,
+            "requested": count,
+            "opened": count - len(errors),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+            "errors": errors[:3],
+            "at": time.time()
+        }
+        if errors:
+            self.logger.warning(f"LLM连接预热部分失败: {errors[0]}")
+        return self.last_warmup
+    
+    def _pool_gauges(self) -> Dict[str, Any]:
+        """读取httpcore连接池当前的连接和排队情况"""
+        pool = getattr(self._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for connection in connections if connection.is_idle())
+        queued = sum(1 for pool_request in getattr(pool, "_requests", []) if pool_request.is_queued())
+        max_connections = self.limits.max_connections
+        return {
+            "connections": len(connections),
+            "active": len(connections) - idle,
+            "idle": idle,
+            "queued_requests": queued,
+            "saturation": round((len(connections) - idle) / max_connections, 4) if max_connections else None
+        }
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取连接池状态"""
+        return {
+            "http2": self.http2,
+            "limits": {
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry
+            },
+            "timeouts": {
+                "connect": self.timeout.connect,
+                "read": self.timeout.read,
+                "write": self.timeout.write,
+                "pool": self.timeout.pool
+            },
+            **self._pool_gauges(),
+            "metrics": self.metrics.to_dict(),
+            "last_warmup": self.last_warmup
+        }
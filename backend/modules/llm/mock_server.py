@@ -0,0 +1,347 @@
+"""
+本地模拟LLM服务
+兼容OpenAI Chat Completions接口（含流式），用于在没有LLM提供商的情况下压测完整聊天流程；
+首token延迟、生成速度和回复长度按可配置的分布抽样，可按比例注入5xx错误和429限流。
+相同的种子和相同的请求序列得到完全相同的回复、延迟和错误
+
+独立运行: python -m modules.llm.mock_server --port 8001
+"""
+
+from typing import Dict, List, Optional, Any, AsyncIterator
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .token_counter import TokenCounter
+
+# 回复语料：模拟居民的参与性发言
+MOCK_SENTENCES = [
+    "我通常周末会去公园跑步，跑完整个人都轻松了。",
+    "我知道市中心新开了一家火锅店，味道很不错。",
+    "我建议先列个计划，每天固定一点时间来做。",
+    "我的经验是多和邻居聊聊，很多问题一下就有思路了。",
+    "我喜欢在家做饭，最近在学做红烧肉。",
+    "我上个月参加了社区的读书会，认识了不少新朋友。",
+    "我会在早上先把最重要的事情做完，下午就轻松多了。",
+    "我觉得可以一起组织个周末活动，大家都能参加。",
+    "我最近在学画画，每天练半小时，进步挺明显的。",
+    "我通常会去图书馆自习，那里安静又方便。"
+]
+RESPONSE_TYPES = ["specific_experience", "practical_advice", "personal_recommendation", "share_method"]
+EMOTIONS = ["happy", "thoughtful", "curious", "neutral"]
+
+@dataclass
+class MockLLMSettings:
+    """模拟服务参数"""
+    seed: int = 42
+    model: str = "mock-llm"
+    ttft_median_ms: float = 400.0       # 首token延迟中位数（对数正态分布）
+    ttft_sigma: float = 0.5             # 首token延迟对数标准差
+    tokens_per_second: float = 40.0     # 生成速度均值（正态分布）
+    tokens_per_second_std: float = 10.0
+    completion_tokens_median: float = 80.0  # 回复长度中位数（对数正态分布，不超过max_tokens）
+    completion_tokens_sigma: float = 0.4
+    error_rate: float = 0.0             # 返回500的比例
+    rate_limit_rate: float = 0.0        # 返回429的比例
+    retry_after_seconds: int = 1
+    time_scale: float = 1.0             # 延迟缩放，0表示不等待
+    history_size: int = 10000           # 记住出现次数的请求数和已缓存的前缀数，超出后淘汰最久未出现的
+    
+    @classmethod
+    def from_env(cls) -> "MockLLMSettings":
+        """从 MOCK_LLM_* 环境变量读取参数"""
+        defaults = cls()
+        values = {}
+        for name, value in asdict(defaults).items():
+            raw = os.getenv(f"MOCK_LLM_{name.upper()}")
+            if raw is not None:
+                values[name] = type(value)(raw)
+        return cls(**values)
+
+class MockLLMEngine:
+    """按请求内容确定性地生成回复和时延"""
+    
+    def __init__(self, settings: MockLLMSettings):
+        self.settings = settings
+        self.counter = TokenCounter()
+        # 长时间压测时请求内容几乎各不相同，按LRU限制条数，内存不随请求数增长
+        self._request_counts: "OrderedDict[str, int]" = OrderedDict()
+        self._seen_prefixes: "OrderedDict[str, None]" = OrderedDict()
+        self.stats = {
+            "requests": 0,
+            "stream_requests": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "completion_tokens": 0
+        }
+    
+    def _remember(self, entries: OrderedDict, key: str, value: Any):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.settings.history_size:
+            entries.popitem(last=False)
+    
+    def _rng(self, body: Dict[str, Any]) -> random.Random:
+        """
+        种子由全局种子、请求内容和该内容第几次出现决定
+        
+        出现次数被淘汰的内容从头计数；淘汰顺序只取决于请求序列，结果仍然确定
+        """
+        fingerprint = hashlib.sha256(
+            json.dumps(body, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        count = self._request_counts.get(fingerprint, 0)
+        self._remember(self._request_counts, fingerprint, count + 1)
+        return random.Random(f"{self.settings.seed}:{fingerprint}:{count}")
+    
+    def plan(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        抽样一次请求的结果
+        
+        Returns:
+            Dict: {"status", "content", "ttft", "token_interval", "prompt_tokens", "cached_tokens", "completion_tokens", "finish_reason"}
+        """
+        settings = self.settings
+        rng = self._rng(body)
+        self.stats["requests"] += 1
+        
+        roll = rng.random()
+        if roll < settings.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return {"status": 429}
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            self.stats["errors"] += 1
+            return {"status": 500}
+        
+        messages = body.get("messages") or []
+        prompt_tokens = self.counter.count_messages(messages)
+        
+        # 与真实服务一样，system消息完全相同的请求视为命中前缀缓存
+        cached_tokens = 0
+        if messages and messages[0].get("role") == "system":
+            prefix = hashlib.sha256((messages[0].get("content") or "").encode("utf-8")).hexdigest()
+            if prefix in self._seen_prefixes:
+                cached_tokens = self.counter.count(messages[0].get("content") or "")
+            self._remember(self._seen_prefixes, prefix, None)
+        
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or 1000
+        target = max(1, int(rng.lognormvariate(math.log(settings.completion_tokens_median), settings.completion_tokens_sigma)))
+        text = ""
+        while self.counter.count(text) < min(target, max_tokens):
+            text += rng.choice(MOCK_SENTENCES)
+        
+        finish_reason = "stop"
+        if self.counter.count(text) > max_tokens:
+            while text and self.counter.count(text) > max_tokens:
+                text = text[:-1]
+            finish_reason = "length"
+        
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_object" and finish_reason == "stop":
+            text = json.dumps({
+                "agent_response": text,
+                "response_type": rng.choice(RESPONSE_TYPES),
+                "emotion": rng.choice(EMOTIONS)
+            }, ensure_ascii=False)
+        
+        completion_tokens = self.counter.count(text)
+        self.stats["completion_tokens"] += completion_tokens
+        rate = max(1.0, rng.gauss(settings.tokens_per_second, settings.tokens_per_second_std))
+        return {
+            "status": 200,
+            "content": text,
+            "ttft": rng.lognormvariate(math.log(settings.ttft_median_ms / 1000), settings.ttft_sigma) * settings.time_scale,
+            "token_interval": completion_tokens / rate / max(1, len(text)) * settings.time_scale,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "finish_reason": finish_reason
+        }
+
+def _error_response(plan: Dict[str, Any], settings: MockLLMSettings) -> JSONResponse:
+    if plan["status"] == 429:
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after": str(settings.retry_after_seconds)},
+            content={"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}}
+        )
+    return JSONResponse(
+        status_code=500,
+        content={"error": {"message": "Upstream error (mock)", "type": "server_error", "code": None}}
+    )
+
+def _usage(plan: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "prompt_tokens": plan["prompt_tokens"],
+        "completion_tokens": plan["completion_tokens"],
+        "total_tokens": plan["prompt_tokens"] + plan["completion_tokens"],
+        "prompt_tokens_details": {"cached_tokens": plan["cached_tokens"]}
+    }
+
+def create_mock_app(settings: Optional[MockLLMSettings] = None) -> FastAPI:
+    """创建模拟服务应用（可独立运行，也可通过InProcessTransport在进程内调用）"""
+    settings = settings or MockLLMSettings.from_env()
+    engine = MockLLMEngine(settings)
+    app = FastAPI(title="Mock LLM")
+    app.state.engine = engine
+    
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": settings.model, "object": "model", "owned_by": "mock"}]}
+    
+    @app.get("/v1/mock/stats")
+    async def get_stats():
+        return {"settings": asdict(settings), "stats": dict(engine.stats)}
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        plan = engine.plan(body)
+        if plan["status"] != 200:
+            return _error_response(plan, settings)
+        
+        completion_id = f"chatcmpl-mock-{engine.stats['requests']}"
+        created = int(time.time())
+        model = body.get("model") or settings.model
+        
+        if not body.get("stream"):
+            await asyncio.sleep(plan["ttft"] + plan["token_interval"] * len(plan["content"]))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": plan["content"]},
+                    "finish_reason": plan["finish_reason"]
+                }],
+                "usage": _usage(plan)
+            }
+        
+        engine.stats["stream_requests"] += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        
+        def frame(choices: List[Dict[str, Any]], **extra) -> bytes:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choices, **extra}
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+        
+        async def events() -> AsyncIterator[bytes]:
+            await asyncio.sleep(plan["ttft"])
+            yield frame([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for char in plan["content"]:
+                if plan["token_interval"]:
+                    await asyncio.sleep(plan["token_interval"])
+                yield frame([{"index": 0, "delta": {"content": char}, "finish_reason": None}])
+            yield frame([{"index": 0, "delta": {}, "finish_reason": plan["finish_reason"]}])
+            if include_usage:
+                yield frame([], usage=_usage(plan))
+            yield b"data: [DONE]\n\n"
+        
+        return StreamingResponse(events(), media_type="text/event-stream")
+    
+    return app
+
+class _QueueByteStream(httpx.AsyncByteStream):
+    """逐块读取应用发出的响应体"""
+    
+    def __init__(self, queue: asyncio.Queue, task: asyncio.Task, disconnected: asyncio.Event):
+        self._queue = queue
+        self._task = task
+        self._disconnected = disconnected
+    
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while True:
+            message = await self._queue.get()
+            if message is None:
+                break
+            if message["type"] == "http.response.body":
+                if message.get("body"):
+                    yield message["body"]
+                if not message.get("more_body"):
+                    break
+    
+    async def aclose(self):
+        self._disconnected.set()
+        if not self._task.done():
+            self._task.cancel()
+
+class InProcessTransport(httpx.AsyncBaseTransport):
+    """
+    在进程内调用ASGI应用的httpx传输层
+    
+    与httpx.ASGITransport不同，响应体按应用发送的节奏逐块返回，流式回复的首token延迟与真实服务一致
+    """
+    
+    def __init__(self, app: Any):
+        self.app = app
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "headers": [(key.lower(), value) for key, value in request.headers.raw],
+            "scheme": request.url.scheme,
+            "path": request.url.path,
+            "raw_path": request.url.raw_path.split(b"?")[0],
+            "query_string": request.url.query,
+            "server": (request.url.host, request.url.port or 80),
+            "client": ("127.0.0.1", 0),
+            "root_path": ""
+        }
+        queue: asyncio.Queue = asyncio.Queue()
+        disconnected = asyncio.Event()
+        request_sent = False
+        
+        async def receive() -> Dict[str, Any]:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+        
+        async def send(message: Dict[str, Any]):
+            await queue.put(message)
+        
+        task = asyncio.create_task(self.app(scope, receive, send))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        
+        start = await queue.get()
+        if start is None:
+            # 应用在发出响应头之前就结束了
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+            raise RuntimeError("模拟服务未返回响应")
+        return httpx.Response(
+            start["status"],
+            headers=start.get("headers", []),
+            stream=_QueueByteStream(queue, task, disconnected),
+            request=request
+        )
+
+def main():
+    import uvicorn
+    
+    parser = argparse.ArgumentParser(description="本地模拟LLM服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    uvicorn.run(create_mock_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
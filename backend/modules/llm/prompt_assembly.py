@@ -0,0 +1,216 @@
+"""
+提示词组装模块
+按变化频率从低到高排列提示词内容：通用指令 -> 角色设定 -> 社群状态 -> 本次对话，
+使同一模板、同一居民的请求共享尽可能长的相同前缀，便于服务端复用前缀缓存；
+同时计算各层前缀的哈希，并根据服务端返回的usage统计命中缓存的token比例
+"""
+
+from typing import Dict, List, Optional, Any, Tuple, Hashable
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hashlib
+
+# 内容分层，按变化频率从低到高
+TIER_STATIC = "static"      # 模板通用指令，所有请求相同
+TIER_PERSONA = "persona"    # 角色设定，同一居民相同
+TIER_STATE = "state"        # 社群状态，缓慢变化
+TIER_VOLATILE = "volatile"  # 本次对话内容，每次不同
+PROMPT_TIERS = (TIER_STATIC, TIER_PERSONA, TIER_STATE, TIER_VOLATILE)
+
+# 放入system消息的层，其余层放入user消息
+SYSTEM_TIERS = (TIER_STATIC, TIER_PERSONA)
+
+SEGMENT_SEPARATOR = "\n\n"
+PREFIX_HASH_LENGTH = 16
+
+@dataclass
+class PromptSegment:
+    """提示词片段"""
+    tier: str
+    text: str
+
+@dataclass
+class AssembledPrompt:
+    """组装后的提示词"""
+    name: str
+    system_prompt: str
+    user_prompt: str
+    prefix_hashes: Dict[str, str] = field(default_factory=dict)  # 层 -> 截至该层的前缀哈希
+    
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": self.user_prompt}
+        ]
+
+def _ordered(segments: List[PromptSegment]) -> List[PromptSegment]:
+    """按层排序（同层保持原顺序），丢弃空片段"""
+    order = {tier: i for i, tier in enumerate(PROMPT_TIERS)}
+    return sorted(
+        (segment for segment in segments if segment.text and segment.text.strip()),
+        key=lambda segment: order[segment.tier]
+    )
+
+class PromptPrefix:
+    """
+    已组装的提示词前缀：保存文本、各层前缀哈希和哈希中间状态
+    
+    不变的前缀（通用指令、角色设定）可以缓存起来，每次请求只追加变化的片段，无需重新拼接和哈希整个提示词
+    """
+    
+    __slots__ = ("system_parts", "user_parts", "hashes", "_digest")
+    
+    def __init__(self):
+        self.system_parts: Tuple[str, ...] = ()
+        self.user_parts: Tuple[str, ...] = ()
+        self.hashes: Dict[str, str] = {}
+        self._digest = hashlib.sha256()
+    
+    def extend(self, segments: List[PromptSegment]) -> "PromptPrefix":
+        """在前缀后按顺序追加片段（调用方保证层顺序），返回新前缀，原前缀不变"""
+        prefix = PromptPrefix()
+        digest = self._digest.copy()
+        hashes = dict(self.hashes)
+        system_parts = list(self.system_parts)
+        user_parts = list(self.user_parts)
+        for segment in segments:
+            if not segment.text or not segment.text.strip():
+                continue
+            digest.update(segment.tier.encode("utf-8"))
+            digest.update(b"\x00")
+            digest.update(segment.text.encode("utf-8"))
+            digest.update(b"\x00")
+            hashes[segment.tier] = digest.copy().hexdigest()[:PREFIX_HASH_LENGTH]
+            (system_parts if segment.tier in SYSTEM_TIERS else user_parts).append(segment.text)
+        prefix.system_parts = tuple(system_parts)
+        prefix.user_parts = tuple(user_parts)
+        prefix.hashes = hashes
+        prefix._digest = digest
+        return prefix
+    
+    def to_prompt(self, name: str) -> AssembledPrompt:
+        """生成system/user两条消息"""
+        return AssembledPrompt(
+            name=name,
+            system_prompt=SEGMENT_SEPARATOR.join(self.system_parts),
+            user_prompt=SEGMENT_SEPARATOR.join(self.user_parts),
+            prefix_hashes=self.hashes
+        )
+    
+    def to_text(self) -> Tuple[str, Dict[str, str]]:
+        """生成单个文本"""
+        return SEGMENT_SEPARATOR.join(self.system_parts + self.user_parts), self.hashes
+
+class PrefixCache:
+    """已组装前缀的LRU缓存"""
+    
+    def __init__(self, max_size: int = 512):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, PromptPrefix]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable) -> Optional[PromptPrefix]:
+        prefix = self._entries.get(key)
+        if prefix is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return prefix
+    
+    def put(self, key: Hashable, prefix: PromptPrefix):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = prefix
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+def compute_prefix_hashes(parts: List[Tuple[str, str]]) -> Dict[str, str]:
+    """
+    计算累积前缀哈希
+    
+    Args:
+        parts: 按顺序排列的 (层, 文本)
+    
+    Returns:
+        Dict: 层 -> 从开头到该层末尾的内容哈希；两次请求某层哈希相同即说明到该层为止前缀完全一致
+    """
+    return PromptPrefix().extend([PromptSegment(tier, text) for tier, text in parts]).hashes
+
+def assemble_messages(name: str, segments: List[PromptSegment]) -> AssembledPrompt:
+    """把片段组装成system/user两条消息"""
+    return PromptPrefix().extend(_ordered(segments)).to_prompt(name)
+
+def assemble_text(segments: List[PromptSegment]) -> Tuple[str, Dict[str, str]]:
+    """把片段按层顺序拼成单个文本，返回 (文本, 前缀哈希)"""
+    return PromptPrefix().extend(_ordered(segments)).to_text()
+
+def extract_cached_tokens(usage: Any) -> int:
+    """从服务端usage中读取命中前缀缓存的token数（兼容OpenAI与DeepSeek等格式）"""
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    return int(cached or 0)
+
+class PromptCacheStats:
+    """按模板统计前缀稳定性和缓存命中情况"""
+    
+    def __init__(self, max_tracked_prefixes: int = 256):
+        self.max_tracked_prefixes = max_tracked_prefixes
+        self._templates: Dict[str, Dict[str, Any]] = {}
+    
+    def record(self, prompt: AssembledPrompt, prompt_tokens: int, cached_tokens: int):
+        """记录一次上游请求"""
+        entry = self._templates.get(prompt.name)
+        if entry is None:
+            entry = self._templates[prompt.name] = {
+                "requests": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "prefixes": {tier: set() for tier in PROMPT_TIERS},
+                "last_prefix_hashes": {}
+            }
+        entry["requests"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["cached_tokens"] += cached_tokens
+        entry["last_prefix_hashes"] = prompt.prefix_hashes
+        for tier, prefix_hash in prompt.prefix_hashes.items():
+            seen = entry["prefixes"][tier]
+            if len(seen) < self.max_tracked_prefixes:
+                seen.add(prefix_hash)
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取统计"""
+        templates = {}
+        total_prompt = total_cached = 0
+        for name, entry in self._templates.items():
+            total_prompt += entry["prompt_tokens"]
+            total_cached += entry["cached_tokens"]
+            templates[name] = {
+                "requests": entry["requests"],
+                "prompt_tokens": entry["prompt_tokens"],
+                "cached_tokens": entry["cached_tokens"],
+                "cached_share": round(entry["cached_tokens"] / entry["prompt_tokens"], 4) if entry["prompt_tokens"] else 0.0,
+                "distinct_prefixes": {tier: len(seen) for tier, seen in entry["prefixes"].items() if seen},
+                "last_prefix_hashes": entry["last_prefix_hashes"]
+            }
+        return {
+            "prompt_tokens": total_prompt,
+            "cached_tokens": total_cached,
+            "cached_share": round(total_cached / total_prompt, 4) if total_prompt else 0.0,
+            "templates": templates
+        }
@@ -3,9 +3,17 @@ LLM提示词设计模块
 包含AI社群模拟小游戏的各种提示词模板
 """
 
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterable, Tuple
 from dataclasses import dataclass
 from enum import Enum
+import re
+
+from .prompt_assembly import (
+    PromptSegment, AssembledPrompt, PromptPrefix, PrefixCache,
+    TIER_STATIC, TIER_PERSONA, TIER_STATE, TIER_VOLATILE
+)
+
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
 
 class PromptType(Enum):
     """提示词类型枚举"""
@@ -18,19 +26,86 @@ class PromptType(Enum):
 
 @dataclass
 class PromptTemplate:
-    """提示词模板类"""
+    """
+    提示词模板类
+    
+    内容按变化频率分层：system_prompt为通用指令，persona_template为角色设定，
+    state_template为社群状态，user_template为本次对话内容
+    """
     name: str
     type: PromptType
     system_prompt: str
     user_template: str
     parameters: List[str]
     description: str
+    persona_template: str = ""
+    state_template: str = ""
+    context_token_budget: int = 0  # 对话历史可占用的token数，0表示模板不带对话历史
+    summary_token_budget: int = 0  # 较早对话摘要可占用的token数
+
+class CompiledTemplate:
+    """
+    预解析的模板片段
+    
+    只把声明过的 {参数} 当作占位符，其余花括号（如JSON格式示例）原样保留，无需转义；
+    解析结果为 文本、参数名、文本、参数名…… 交替排列，渲染时只需填入参数再拼接
+    """
+    
+    __slots__ = ("parts", "parameters", "static_text")
+    
+    def __init__(self, source: str, parameters: Iterable[str]):
+        declared = frozenset(parameters)
+        parts: List[str] = []
+        used = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            name = match.group(1)
+            if name not in declared:
+                continue
+            parts.append(source[position:match.start()])
+            parts.append(name)
+            used.append(name)
+            position = match.end()
+        parts.append(source[position:])
+        
+        self.parts: Tuple[str, ...] = tuple(parts)
+        self.parameters: Tuple[str, ...] = tuple(dict.fromkeys(used))  # 去重并保持出现顺序
+        self.static_text: Optional[str] = source if not used else None
+    
+    def render(self, values: Dict[str, Any]) -> str:
+        """填入参数"""
+        if self.static_text is not None:
+            return self.static_text
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = str(values[parts[i]])
+        return "".join(parts)
+
+class _CompiledPrompt:
+    """编译后的完整模板"""
+    
+    __slots__ = ("required", "ordered_parameters", "static", "persona", "state", "volatile", "static_prefix")
+    
+    def __init__(self, template: PromptTemplate):
+        self.required = frozenset(template.parameters)
+        self.ordered_parameters = tuple(template.parameters)
+        self.static = CompiledTemplate(template.system_prompt, template.parameters)
+        self.persona = CompiledTemplate(template.persona_template, template.parameters)
+        self.state = CompiledTemplate(template.state_template, template.parameters)
+        self.volatile = CompiledTemplate(template.user_template, template.parameters)
+        # 通用指令不含参数时只需组装一次
+        self.static_prefix: Optional[PromptPrefix] = None
+        if self.static.static_text is not None:
+            self.static_prefix = PromptPrefix().extend([PromptSegment(TIER_STATIC, self.static.static_text)])
 
 class GamePrompts:
     """游戏提示词管理器"""
     
-    def __init__(self):
+    def __init__(self, prefix_cache_size: int = 512):
         self.templates = self._init_templates()
+        self._compiled = {name: _CompiledPrompt(template) for name, template in self.templates.items()}
+        # 按 (模板, 角色参数) 缓存已组装的 通用指令+角色设定 前缀
+        self._prefix_cache = PrefixCache(prefix_cache_size)
     
     def _init_templates(self) -> Dict[str, PromptTemplate]:
         """初始化所有提示词模板"""
@@ -42,13 +117,6 @@ class GamePrompts:
             type=PromptType.COMMAND_EXECUTION,
             system_prompt="""你是一个AI社群模拟系统的核心AI。你的任务是理解和执行玩家的指令，并分析这些指令对AI社群的影响。
 
-社群基本信息：
-- 总人口：{population}人
-- 快乐度：{happiness}/100
-- 健康度：{health}/100
-- 教育水平：{education}/100
-- 经济状况：{economy}/100
-
 你需要：
 1. 理解玩家指令的意图和目标
 2. 分析指令对社群各项指标的可能影响
@@ -73,6 +141,12 @@ class GamePrompts:
 }
 
 请始终保持理性和逻辑性，确保模拟结果合理。""",
+            state_template="""社群基本信息：
+- 总人口：{population}人
+- 快乐度：{happiness}/100
+- 健康度：{health}/100
+- 教育水平：{education}/100
+- 经济状况：{economy}/100""",
             user_template="玩家指令：{command}\n\n请分析并执行这个指令，返回执行结果。",
             parameters=["command", "population", "happiness", "health", "education", "economy"],
             description="处理玩家输入的指令并模拟执行结果"
@@ -82,20 +156,7 @@ class GamePrompts:
         templates["agent_response"] = PromptTemplate(
             name="AI居民回复",
             type=PromptType.AGENT_RESPONSE,
-            system_prompt="""你是AI社群中的一位居民，名叫{agent_name}。你有以下特征：
-- 性格：{personality}
-- 职业：{occupation}
-- 年龄：{age}岁
-- 兴趣爱好：{interests}
-
-当前社群状况：
-- 整体快乐度：{happiness}/100
-- 整体健康度：{health}/100
-- 教育水平：{education}/100
-- 经济状况：{economy}/100
-
-最近发生的事件：
-{recent_events}
+            system_prompt="""你是AI社群中的一位居民，下面是你的角色设定。
 
 请以这个居民的身份与玩家对话。你的回复应该：
 1. 符合你的性格和身份设定
@@ -105,6 +166,19 @@ class GamePrompts:
 5. 长度控制在50-150字之间
 
 不要透露你是AI，要自然地扮演一个真实的社群居民。""",
+            persona_template="""你名叫{agent_name}，你有以下特征：
+- 性格：{personality}
+- 职业：{occupation}
+- 年龄：{age}岁
+- 兴趣爱好：{interests}""",
+            state_template="""当前社群状况：
+- 整体快乐度：{happiness}/100
+- 整体健康度：{health}/100
+- 教育水平：{education}/100
+- 经济状况：{economy}/100
+
+最近发生的事件：
+{recent_events}""",
             user_template="玩家说：{user_message}\n\n请以{agent_name}的身份回复。",
             parameters=["agent_name", "personality", "occupation", "age", "interests", 
                        "happiness", "health", "education", "economy", "recent_events", "user_message"],
@@ -115,25 +189,7 @@ class GamePrompts:
         templates["agent_conversation_response"] = PromptTemplate(
             name="AI居民对话回复",
             type=PromptType.AGENT_RESPONSE,
-            system_prompt="""你是AI社群中的一位真实居民，名叫{agent_name}。你有以下特征：
-- 性格：{personality}
-- 职业：{occupation}
-- 年龄：{age}岁
-- 兴趣爱好：{interests}
-
-当前社群状况：
-- 整体快乐度：{happiness}/100
-- 整体健康度：{health}/100
-- 教育水平：{education}/100
-- 经济状况：{economy}/100
-
-最近发生的事件：
-{recent_events}
-
-对话上下文：
-{conversation_context}
-
-原始话题：{original_topic}
+            system_prompt="""你是AI社群中的一位真实居民，你的角色设定、当前社群状况和对话内容会在后面给出。
 
 🚨 **核心参与性要求（必须严格遵守）**：
 1. **禁止评价性回复**：绝对不要说"这个观点很棒"、"讨论很有价值"、"很有启发"、"值得思考"、"很有道理"、"讨论氛围"、"这个话题有意思"、"学到了很多"等空洞评价
@@ -184,18 +240,52 @@ class GamePrompts:
 - 根据年龄调整语言风格（年轻人更活泼，年长者更稳重）
 
 回复格式为JSON：
-{{
+{
     "agent_response": "你的具体参与性回复内容",
     "response_type": "specific_experience/practical_advice/personal_recommendation/share_method/location_suggestion",
     "emotion": "happy/excited/thoughtful/concerned/neutral/curious/amused"
-}}
+}
 
 **注意**：你必须是一个真实的人，分享真实的经验和建议，而不是AI助手。绝对不要进行空洞的评价和赞美！""",
-            user_template="请基于以上信息，以{agent_name}的身份自然地参与对话，分享具体的经验或建议。",
+            persona_template="""你名叫{agent_name}，你有以下特征：
+- 性格：{personality}
+- 职业：{occupation}
+- 年龄：{age}岁
+- 兴趣爱好：{interests}""",
+            state_template="""当前社群状况：
+- 整体快乐度：{happiness}/100
+- 整体健康度：{health}/100
+- 教育水平：{education}/100
+- 经济状况：{economy}/100
+
+最近发生的事件：
+{recent_events}
+
+更早的对话摘要：
+{conversation_summary}""",
+            user_template="对话上下文：\n{conversation_context}\n\n原始话题：{original_topic}\n\n请基于以上信息，以{agent_name}的身份自然地参与对话，分享具体的经验或建议。",
             parameters=["agent_name", "personality", "occupation", "age", "interests", 
                        "happiness", "health", "education", "economy", "recent_events", 
-                       "conversation_context", "original_topic", "is_first_speaker"],
-            description="AI居民参与对话时的自然回复生成"
+                       "conversation_summary", "conversation_context", "original_topic", "is_first_speaker"],
+            description="AI居民参与对话时的自然回复生成",
+            context_token_budget=800,
+            summary_token_budget=400
+        )
+        
+        # 对话摘要提示词（后台批量压缩较早的聊天记录）
+        templates["history_summary"] = PromptTemplate(
+            name="对话历史摘要",
+            type=PromptType.SYSTEM_ANALYSIS,
+            system_prompt="""你负责为AI社群聊天室维护一份滚动摘要，供居民回忆较早的对话。
+
+要求：
+1. 把新的聊天记录并入已有摘要，保留谁说了什么、提出的问题、约定和具体建议
+2. 合并重复的话题，删除寒暄和空洞的评价
+3. 每行一条要点，按时间从早到晚排列，较早的内容写得更简略
+4. 只输出摘要正文，不要标题、编号或解释""",
+            user_template="已有摘要：\n{previous_summary}\n\n新的聊天记录：\n{new_messages}\n\n请输出更新后的摘要，总长度不超过{token_budget}个token。",
+            parameters=["previous_summary", "new_messages", "token_budget"],
+            description="把较早的聊天记录批量压缩进聊天室摘要"
         )
         
         # 社群分析提示词
@@ -204,17 +294,7 @@ class GamePrompts:
             type=PromptType.COMMUNITY_ANALYSIS,
             system_prompt="""你是一个社会学专家AI，负责分析AI社群的状态和发展趋势。
 
-基于以下数据进行分析：
-- 当前人口：{population}
-- 快乐度：{happiness}/100 (变化：{happiness_change})
-- 健康度：{health}/100 (变化：{health_change})
-- 教育水平：{education}/100 (变化：{education_change})
-- 经济状况：{economy}/100 (变化：{economy_change})
-
-最近7天的事件历史：
-{recent_events}
-
-请提供：
+请基于给出的数据提供：
 1. 社群整体状态评估
 2. 各项指标的发展趋势分析
 3. 当前面临的主要问题和挑战
@@ -235,6 +315,15 @@ class GamePrompts:
     "risk_points": ["风险1", "风险2"],
     "future_prediction": "未来发展预测"
 }""",
+            state_template="""基于以下数据进行分析：
+- 当前人口：{population}
+- 快乐度：{happiness}/100 (变化：{happiness_change})
+- 健康度：{health}/100 (变化：{health_change})
+- 教育水平：{education}/100 (变化：{education_change})
+- 经济状况：{economy}/100 (变化：{economy_change})
+
+最近7天的事件历史：
+{recent_events}""",
             user_template="请基于当前数据分析社群状态和发展趋势。",
             parameters=["population", "happiness", "health", "education", "economy",
                        "happiness_change", "health_change", "education_change", "economy_change",
@@ -248,13 +337,6 @@ class GamePrompts:
             type=PromptType.EVENT_GENERATION,
             system_prompt="""你是一个创意事件生成器，负责为AI社群创建有趣的随机事件。
 
-当前社群状态：
-- 人口：{population}
-- 快乐度：{happiness}/100
-- 健康度：{health}/100
-- 教育水平：{education}/100
-- 经济状况：{economy}/100
-
 事件生成规则：
 1. 事件应该合理并且有趣
 2. 事件的影响应该与社群当前状态相关
@@ -262,7 +344,7 @@ class GamePrompts:
 4. 事件影响应该平衡，不要过于极端
 5. 事件描述应该生动有趣，50-100字
 
-生成{event_count}个随机事件，回复格式为JSON：
+按要求的数量生成随机事件，回复格式为JSON：
 {
     "events": [
         {
@@ -278,6 +360,12 @@ class GamePrompts:
         }
     ]
 }""",
+            state_template="""当前社群状态：
+- 人口：{population}
+- 快乐度：{happiness}/100
+- 健康度：{health}/100
+- 教育水平：{education}/100
+- 经济状况：{economy}/100""",
             user_template="请为当前社群生成{event_count}个有趣的随机事件。",
             parameters=["population", "happiness", "health", "education", "economy", "event_count"],
             description="为社群生成随机事件"
@@ -289,13 +377,6 @@ class GamePrompts:
             type=PromptType.CHAT_RESPONSE,
             system_prompt="""你是AI社群模拟小游戏的AI助手。你的任务是与玩家进行友好的对话，并帮助他们了解社群状况。
 
-当前社群状态：
-- 整体快乐度：{community_happiness}/100
-- 整体活跃度：{community_activity}/100
-
-最近发生的事件：
-{recent_events}
-
 你的回复应该：
 1. 友好、热情且有帮助
 2. 适当提及社群的当前状况
@@ -305,6 +386,12 @@ class GamePrompts:
 6. 可以适当提及居民们的反应
 
 回复风格要自然、有趣，像一个真正的社群助手。""",
+            state_template="""当前社群状态：
+- 整体快乐度：{community_happiness}/100
+- 整体活跃度：{community_activity}/100
+
+最近发生的事件：
+{recent_events}""",
             user_template="玩家说：{user_message}\n\n请作为AI助手回复。",
             parameters=["user_message", "community_happiness", "community_activity", "recent_events"],
             description="AI助手与玩家聊天时的回复生成"
@@ -316,7 +403,16 @@ class GamePrompts:
             type=PromptType.SYSTEM_ANALYSIS,
             system_prompt="""你是一个系统诊断专家，负责分析AI社群模拟系统的运行状态。
 
-系统信息：
+请分析系统运行状况并提供优化建议：
+{
+    "system_health": "系统健康状态评级(优秀/良好/一般/差)",
+    "performance_analysis": "性能分析",
+    "bottlenecks": ["瓶颈1", "瓶颈2"],
+    "optimization_suggestions": ["建议1", "建议2"],
+    "maintenance_required": true/false,
+    "risk_level": "风险等级(低/中/高)"
+}""",
+            state_template="""系统信息：
 - 运行时间：{uptime}
 - 处理的指令数：{commands_processed}
 - 生成的事件数：{events_generated}
@@ -327,17 +423,7 @@ class GamePrompts:
 - 平均响应时间：{avg_response_time}ms
 - 错误率：{error_rate}%
 - 内存使用：{memory_usage}MB
-- 数据库连接状态：{db_status}
-
-请分析系统运行状况并提供优化建议：
-{
-    "system_health": "系统健康状态评级(优秀/良好/一般/差)",
-    "performance_analysis": "性能分析",
-    "bottlenecks": ["瓶颈1", "瓶颈2"],
-    "optimization_suggestions": ["建议1", "建议2"],
-    "maintenance_required": true/false,
-    "risk_level": "风险等级(低/中/高)"
-}""",
+- 数据库连接状态：{db_status}""",
             user_template="请分析当前系统状态并提供诊断报告。",
             parameters=["uptime", "commands_processed", "events_generated", "active_agents",
                        "message_count", "avg_response_time", "error_rate", "memory_usage", "db_status"],
@@ -357,27 +443,62 @@ class GamePrompts:
         Returns:
             tuple: (system_prompt, user_prompt)
         """
-        if prompt_name not in self.templates:
-            raise ValueError(f"未找到提示词模板: {prompt_name}")
+        prompt = self.assemble(prompt_name, **kwargs)
+        return prompt.system_prompt, prompt.user_prompt
+    
+    def assemble(self, prompt_name: str, **kwargs) -> AssembledPrompt:
+        """
+        按 通用指令 -> 角色设定 -> 社群状态 -> 本次对话 的顺序组装提示词
         
-        template = self.templates[prompt_name]
+        Args:
+            prompt_name: 提示词模板名称
+            **kwargs: 模板参数
+            
+        Returns:
+            AssembledPrompt: system/user消息及各层前缀哈希
+        """
+        compiled = self._compiled.get(prompt_name)
+        if compiled is None:
+            raise ValueError(f"未找到提示词模板: {prompt_name}")
         
         # 检查必需参数
-        missing_params = []
-        for param in template.parameters:
-            if param not in kwargs:
-                missing_params.append(param)
-        
-        if missing_params:
+        if not compiled.required.issubset(kwargs):
+            missing_params = [param for param in compiled.ordered_parameters if param not in kwargs]
             raise ValueError(f"缺少必需参数: {missing_params}")
         
-        # 格式化提示词
+        # 不变的前缀取缓存，只渲染并追加社群状态和本次对话
+        head = self._get_prompt_head(prompt_name, compiled, kwargs)
+        return head.extend([
+            PromptSegment(TIER_STATE, compiled.state.render(kwargs)),
+            PromptSegment(TIER_VOLATILE, compiled.volatile.render(kwargs))
+        ]).to_prompt(prompt_name)
+    
+    def _get_prompt_head(self, prompt_name: str, compiled: _CompiledPrompt, kwargs: Dict[str, Any]) -> PromptPrefix:
+        """获取 通用指令+角色设定 前缀"""
+        if compiled.static_prefix is None:
+            # 通用指令带参数的模板不缓存
+            return PromptPrefix().extend([
+                PromptSegment(TIER_STATIC, compiled.static.render(kwargs)),
+                PromptSegment(TIER_PERSONA, compiled.persona.render(kwargs))
+            ])
+        if compiled.persona.static_text is not None:
+            return compiled.static_prefix.extend([PromptSegment(TIER_PERSONA, compiled.persona.static_text)])
+        
         try:
-            system_prompt = template.system_prompt.format(**kwargs)
-            user_prompt = template.user_template.format(**kwargs)
-            return system_prompt, user_prompt
-        except KeyError as e:
-            raise ValueError(f"提示词格式化失败，缺少参数: {e}")
+            key = (prompt_name,) + tuple(kwargs[name] for name in compiled.persona.parameters)
+            head = self._prefix_cache.get(key)
+        except TypeError:
+            # 参数不可哈希时直接渲染
+            key = head = None
+        if head is None:
+            head = compiled.static_prefix.extend([PromptSegment(TIER_PERSONA, compiled.persona.render(kwargs))])
+            if key is not None:
+                self._prefix_cache.put(key, head)
+        return head
+    
+    def get_render_stats(self) -> Dict[str, Any]:
+        """获取前缀缓存统计"""
+        return self._prefix_cache.get_status()
     
     def list_templates(self) -> List[Dict[str, Any]]:
         """列出所有可用的提示词模板"""
@@ -0,0 +1,317 @@
+"""
+LLM调用保护模块
+限流器：按每分钟请求数和token数限制调用；
+熔断器：近期失败率过高时打开，打开期间请求立即失败，由调用方改用备用回复，冷却后放少量探测请求，成功即恢复；
+自适应并发限制（AIMD）：请求正常时并发上限缓慢加一，出错或耗时明显高于同等回复长度的基线时按比例下降，
+超出上限的请求排队等待名额，等待超时才拒绝（熔断器打开时才立即失败）
+"""
+
+from typing import Dict, Optional, Any, Tuple
+from collections import deque
+import asyncio
+import logging
+import time
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+MIN_LATENCY_SAMPLES = 10  # 拟合耗时基线前至少需要的成功请求数
+
+def is_provider_failure(error: BaseException) -> bool:
+    """超时、连接失败、5xx和429视为服务端故障；其他4xx是请求本身的问题，不计入熔断"""
+    status = getattr(error, "status_code", None)
+    return status is None or status >= 500 or status == 429
+
+class RateLimiter:
+    """简单的速率限制器"""
+    
+    def __init__(self, requests_per_minute: int = 60, tokens_per_minute: int = 90000):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_times = []
+        self.token_usage = []
+    
+    def can_make_request(self, estimated_tokens: int = 0) -> Tuple[bool, str]:
+        """检查是否可以发起请求"""
+        current_time = time.time()
+        
+        # 清理1分钟前的记录
+        self.request_times = [t for t in self.request_times if current_time - t < 60]
+        self.token_usage = [(t, tokens) for t, tokens in self.token_usage if current_time - t < 60]
+        
+        # 检查请求频率
+        if len(self.request_times) >= self.requests_per_minute:
+            return False, f"请求频率超限，每分钟最多{self.requests_per_minute}次请求"
+        
+        # 检查token使用量
+        current_token_usage = sum(tokens for _, tokens in self.token_usage)
+        if current_token_usage + estimated_tokens > self.tokens_per_minute:
+            return False, f"Token使用量超限，每分钟最多{self.tokens_per_minute}个token"
+        
+        return True, "可以发起请求"
+    
+    def remaining_tokens(self) -> int:
+        """最近1分钟内剩余的token额度"""
+        current_time = time.time()
+        used = sum(tokens for t, tokens in self.token_usage if current_time - t < 60)
+        return max(0, self.tokens_per_minute - used)
+    
+    def record_request(self, tokens_used: int = 0):
+        """记录请求"""
+        current_time = time.time()
+        self.request_times.append(current_time)
+        if tokens_used > 0:
+            self.token_usage.append((current_time, tokens_used))
+
+class CircuitBreaker:
+    """熔断器"""
+    
+    def __init__(
+        self,
+        failure_rate_threshold: float = 0.5,
+        min_calls: int = 10,
+        window_size: int = 20,
+        consecutive_failures_threshold: int = 5,
+        open_seconds: float = 15.0,
+        half_open_max_calls: int = 1
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls                  # 窗口内调用数不足时不按失败率打开
+        self.consecutive_failures_threshold = consecutive_failures_threshold
+        self.open_seconds = open_seconds            # 打开后的冷却时间
+        self.half_open_max_calls = half_open_max_calls
+        self.state = STATE_CLOSED
+        self._outcomes: deque = deque(maxlen=window_size)  # 最近的调用结果（True为成功）
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.stats = {"rejected": 0, "opened": 0, "recovered": 0}
+    
+    def allow(self) -> bool:
+        """是否放行本次调用；放行后必须调用record_success/record_failure/record_ignored之一"""
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.stats["rejected"] += 1
+                return False
+            self._transition(STATE_HALF_OPEN)
+        if self.state == STATE_HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_max_calls:
+                self.stats["rejected"] += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+    
+    def would_allow(self) -> bool:
+        """不改变状态地判断当前是否会放行（用于路由选择）"""
+        if self.state == STATE_OPEN:
+            return time.monotonic() - self._opened_at >= self.open_seconds
+        if self.state == STATE_HALF_OPEN:
+            return self._probes_in_flight < self.half_open_max_calls
+        return True
+    
+    def record_success(self):
+        if self.state == STATE_HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self.stats["recovered"] += 1
+            self._transition(STATE_CLOSED)
+            return
+        self._outcomes.append(True)
+        self._consecutive_failures = 0
+    
+    def record_failure(self):
+        if self.state == STATE_HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self._open()
+            return
+        self._outcomes.append(False)
+        self._consecutive_failures += 1
+        if self.state == STATE_CLOSED and (
+            self._consecutive_failures >= self.consecutive_failures_threshold or
+            (len(self._outcomes) >= self.min_calls and self.failure_rate() >= self.failure_rate_threshold)
+        ):
+            self._open()
+    
+    def record_ignored(self):
+        """调用被取消或失败与服务端状况无关（如请求参数错误）时，只释放探测名额"""
+        if self.state == STATE_HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+    
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+    
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self.stats["opened"] += 1
+        self._transition(STATE_OPEN)
+    
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        self.logger.warning(f"LLM熔断器状态变化: {self.state} -> {state}")
+        self.state = state
+        if state == STATE_CLOSED:
+            self._outcomes.clear()
+            self._consecutive_failures = 0
+        self._probes_in_flight = 0
+    
+    def get_status(self) -> Dict[str, Any]:
+        retry_in = self.open_seconds - (time.monotonic() - self._opened_at) if self.state == STATE_OPEN else 0
+        return {
+            "state": self.state,
+            "failure_rate": round(self.failure_rate(), 3),
+            "window_calls": len(self._outcomes),
+            "consecutive_failures": self._consecutive_failures,
+            "retry_in_seconds": round(max(retry_in, 0), 1),
+            **self.stats
+        }
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD自适应并发限制"""
+    
+    def __init__(
+        self,
+        initial_limit: int = 16,
+        min_limit: int = 2,
+        max_limit: int = 64,
+        backoff_ratio: float = 0.7,
+        latency_tolerance: float = 2.0,
+        queue_timeout: float = 5.0
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio            # 拥塞时上限乘以该比例
+        self.latency_tolerance = latency_tolerance    # 耗时超过同等回复长度基线的该倍数视为拥塞
+        self.queue_timeout = queue_timeout            # 达到上限时排队等待名额的最长时间
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        # 耗时 ≈ 固定开销 + 每token耗时 × 回复token数：按 (token数, 耗时) 的慢速移动平均在线拟合
+        self._fit: Optional[Tuple[float, float, float, float]] = None  # E[x], E[y], E[x²], E[xy]
+        self._fit_samples = 0
+        self._last_decrease = 0.0
+        self.stats = {"accepted": 0, "queued": 0, "rejected": 0, "increases": 0, "decreases": 0}
+    
+    @property
+    def baseline_latency(self) -> Optional[float]:
+        """成功请求的平均耗时"""
+        return self._fit[1] if self._fit is not None else None
+    
+    async def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        获取一个名额：达到上限时按先来后到排队
+        
+        Args:
+            timeout: 最长等待时间（秒），默认为queue_timeout
+        
+        Returns:
+            bool: 是否获得名额；等待超时返回False
+        """
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self.stats["accepted"] += 1
+            return True
+        
+        timeout = self.queue_timeout if timeout is None else timeout
+        if timeout <= 0:
+            self.stats["rejected"] += 1
+            return False
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            return False
+        except asyncio.CancelledError:
+            # 名额已经分给本请求时交还
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight = max(0, self.in_flight - 1)
+                self._wake()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+    
+    def _wake(self):
+        """把空出的名额依次交给排队的请求"""
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            self.stats["accepted"] += 1
+            waiter.set_result(True)
+    
+    def has_capacity(self) -> bool:
+        return not self._waiters and self.in_flight < int(self.limit)
+    
+    def expected_latency(self, completion_tokens: int) -> Optional[float]:
+        """按拟合结果估计该回复长度的正常耗时；样本不足时为None"""
+        if self._fit is None or self._fit_samples < MIN_LATENCY_SAMPLES:
+            return None
+        mean_x, mean_y, mean_xx, mean_xy = self._fit
+        variance = mean_xx - mean_x * mean_x
+        slope = max(0.0, (mean_xy - mean_x * mean_y) / variance) if variance > 1e-9 else 0.0
+        intercept = max(0.0, mean_y - slope * mean_x)
+        expected = intercept + slope * completion_tokens
+        return expected if expected > 0 else None
+    
+    def _observe(self, completion_tokens: int, latency: float):
+        x, y = float(completion_tokens), latency
+        self._fit_samples += 1
+        if self._fit is None:
+            self._fit = (x, y, x * x, x * y)
+            return
+        self._fit = tuple(0.95 * old + 0.05 * new for old, new in zip(self._fit, (x, y, x * x, x * y)))
+    
+    def release(self, latency: Optional[float] = None, success: Optional[bool] = None, completion_tokens: Optional[int] = None):
+        """
+        释放名额并按结果调整上限
+        
+        Args:
+            latency: 本次请求耗时（秒）
+            success: 是否成功；None表示请求被取消，不调整上限
+            completion_tokens: 回复token数；耗时随回复长度增长，未知时耗时不作为拥塞信号
+        """
+        self.in_flight = max(0, self.in_flight - 1)
+        if success is not None:
+            congested = not success
+            if success and latency is not None and completion_tokens is not None:
+                expected = self.expected_latency(completion_tokens)
+                congested = expected is not None and latency > expected * self.latency_tolerance
+                self._observe(completion_tokens, latency)
+            if congested:
+                self._decrease()
+            else:
+                # 每完成约limit个请求上限加一
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.stats["increases"] += 1
+        self._wake()
+    
+    def _decrease(self):
+        # 同一批并发请求一起变慢时只下降一次
+        now = time.monotonic()
+        if self.baseline_latency and now - self._last_decrease < self.baseline_latency:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+        self.stats["decreases"] += 1
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "baseline_latency": round(self.baseline_latency, 3) if self.baseline_latency is not None else None,
+            **self.stats
+        }
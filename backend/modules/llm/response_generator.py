@@ -3,21 +3,25 @@ AI响应生成模块
 集成OpenAI API和响应处理逻辑
 """
 
-import json
 import time
 import asyncio
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, AsyncIterator
 from dataclasses import dataclass
 import logging
 
-try:
-    from openai import AsyncOpenAI
-except ImportError:
-    AsyncOpenAI = None
-
-from .config import get_llm_config, validate_llm_config, LLMProvider
+from .config import get_llm_config, validate_llm_config, llm_config_manager, LLMConfig
+from .backends import get_supported_providers
+from .http_pool import LLMHttpPool
+from .hedging import Deadline, LatencyTracker, HedgeStats, hedged_call, run_with_deadline
+from .resilience import RateLimiter, CircuitBreaker, AdaptiveConcurrencyLimiter, is_provider_failure
+from .router import LLMBackend, LLMRouter, PRIMARY_BACKEND
 from .prompts import game_prompts
 from .command_parser import command_parser, ParsedCommand
+from .single_flight import SingleFlight, prompt_fingerprint
+from .prompt_assembly import AssembledPrompt, PromptCacheStats, extract_cached_tokens
+from .token_counter import token_counter, build_context, ContextSection
+from .structured_output import output_schemas, StreamingFieldExtractor
+from .fallback_engine import fallback_engine
 
 @dataclass
 class LLMResponse:
@@ -29,41 +33,8 @@ class LLMResponse:
     response_time: float
     success: bool
     error_message: Optional[str] = None
-
-class RateLimiter:
-    """简单的速率限制器"""
-    
-    def __init__(self, requests_per_minute: int = 60, tokens_per_minute: int = 90000):
-        self.requests_per_minute = requests_per_minute
-        self.tokens_per_minute = tokens_per_minute
-        self.request_times = []
-        self.token_usage = []
-    
-    def can_make_request(self, estimated_tokens: int = 0) -> Tuple[bool, str]:
-        """检查是否可以发起请求"""
-        current_time = time.time()
-        
-        # 清理1分钟前的记录
-        self.request_times = [t for t in self.request_times if current_time - t < 60]
-        self.token_usage = [(t, tokens) for t, tokens in self.token_usage if current_time - t < 60]
-        
-        # 检查请求频率
-        if len(self.request_times) >= self.requests_per_minute:
-            return False, f"请求频率超限，每分钟最多{self.requests_per_minute}次请求"
-        
-        # 检查token使用量
-        current_token_usage = sum(tokens for _, tokens in self.token_usage)
-        if current_token_usage + estimated_tokens > self.tokens_per_minute:
-            return False, f"Token使用量超限，每分钟最多{self.tokens_per_minute}个token"
-        
-        return True, "可以发起请求"
-    
-    def record_request(self, tokens_used: int = 0):
-        """记录请求"""
-        current_time = time.time()
-        self.request_times.append(current_time)
-        if tokens_used > 0:
-            self.token_usage.append((current_time, tokens_used))
+    prefix_hashes: Optional[Dict[str, str]] = None  # 各层提示词前缀哈希
+    backend: Optional[str] = None  # 处理请求的后端
 
 class ResponseGenerator:
     """AI响应生成器"""
@@ -71,55 +42,101 @@ class ResponseGenerator:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.config = get_llm_config()
-        self.client = None
-        self.rate_limiter = RateLimiter(
-            self.config.rate_limit_requests_per_minute,
-            self.config.rate_limit_tokens_per_minute
-        )
+        self.primary = LLMBackend(PRIMARY_BACKEND, self.config)  # 主后端（LLM_*配置）
+        self.router = LLMRouter(self.primary)
+        self.single_flight = SingleFlight()  # 合并同时进行的相同请求
+        self.prompt_cache_stats = PromptCacheStats()  # 前缀缓存命中统计
+        self.latency_tracker = LatencyTracker()  # 各模板近期耗时（不分后端），决定对冲等待时间
+        self.hedge_stats = HedgeStats()
+        token_counter.set_model(self.config.model)
         self._init_client()
+        self.router.set_backends(self.config.backends)
+        llm_config_manager.add_listener(self._on_config_change)
+    
+    # 主后端的客户端和调用保护组件
+    @property
+    def client(self):
+        return self.primary.client
+    
+    @property
+    def http_pool(self) -> Optional[LLMHttpPool]:
+        return self.primary.http_pool
+    
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        return self.primary.rate_limiter
+    
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self.primary.circuit_breaker
+    
+    @property
+    def concurrency_limiter(self) -> AdaptiveConcurrencyLimiter:
+        return self.primary.concurrency_limiter
     
     def _init_client(self):
-        """初始化LLM客户端"""
+        """初始化主后端的LLM客户端"""
         try:
-            if AsyncOpenAI is None:
-                self.logger.error("OpenAI库未安装，请运行: pip install openai")
-                return
-            
             is_valid, message = validate_llm_config()
             if not is_valid:
                 self.logger.error(f"LLM配置无效: {message}")
                 return
             
-            if self.config.provider == LLMProvider.OPENAI:
-                client_config = {
-                    "api_key": self.config.api_key,
-                    "timeout": self.config.timeout,
-                    "max_retries": self.config.max_retries
-                }
-                if self.config.base_url:
-                    client_config["base_url"] = self.config.base_url
-                
-                self.client = AsyncOpenAI(**client_config)
-                self.logger.info("OpenAI客户端初始化成功")
-            
-            elif self.config.provider == LLMProvider.AZURE_OPENAI:
-                from openai import AsyncAzureOpenAI
-                self.client = AsyncAzureOpenAI(
-                    api_key=self.config.api_key,
-                    azure_endpoint=self.config.azure_endpoint,
-                    api_version=self.config.api_version,
-                    timeout=self.config.timeout,
-                    max_retries=self.config.max_retries
-                )
-                self.logger.info("Azure OpenAI客户端初始化成功")
+            self.primary.connect()
             
         except Exception as e:
             self.logger.error(f"客户端初始化失败: {str(e)}")
-            self.client = None
+            self.primary.client = None
+            self.primary.http_pool = None
+    
+    def _on_config_change(self, old: LLMConfig, new: LLMConfig):
+        """配置重新加载后重建客户端，限流、熔断和并发参数变化时重建对应组件"""
+        self.config = new
+        self.primary.apply_config(new)
+        token_counter.set_model(new.model)
+        
+        old_clients = [self.primary.client] if self.primary.client is not None else []
+        self.primary.client = None
+        self.primary.http_pool = None
+        self._init_client()
+        old_clients += self.router.set_backends(new.backends)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            for old_client in old_clients:
+                # 进行中的请求仍持有旧客户端，超时之后再关闭其连接（连同旧连接池）
+                loop.create_task(self._close_client(old_client, old.timeout))
+            loop.create_task(self.warm_up())
+        self.logger.info(f"LLM客户端已按配置版本 {new.version} 重建")
+    
+    async def warm_up(self) -> Optional[Dict[str, Any]]:
+        """预先建立到各LLM后端的连接，失败不影响后续请求"""
+        results = {}
+        for backend in self.router.backends:
+            if backend.client is None or backend.http_pool is None or backend.http_pool.warmup_connections <= 0:
+                continue
+            try:
+                result = await backend.http_pool.warm_up(backend.client.base_url)
+                if result["opened"]:
+                    self.logger.info(f"LLM后端 {backend.name} 连接预热完成: {result['opened']}/{result['requested']} 条, {result['elapsed_ms']}ms")
+                results[backend.name] = result
+            except Exception as e:
+                self.logger.warning(f"LLM后端 {backend.name} 连接预热失败: {str(e)}")
+        return results or None
+    
+    async def _close_client(self, client: Any, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await client.close()
+        except Exception as e:
+            self.logger.warning(f"关闭旧LLM客户端失败: {str(e)}")
     
     async def generate_response(
         self, 
         prompt_name: str, 
+        deadline: Optional[Deadline] = None,
         **kwargs
     ) -> LLMResponse:
         """
@@ -127,6 +144,7 @@ class ResponseGenerator:
         
         Args:
             prompt_name: 提示词模板名称
+            deadline: 调用截止时间，到期仍没有结果时返回finish_reason为deadline_exceeded的失败响应
             **kwargs: 提示词参数
             
         Returns:
@@ -144,12 +162,87 @@ class ResponseGenerator:
             )
         
         try:
-            # 获取提示词
-            system_prompt, user_prompt = game_prompts.get_prompt(prompt_name, **kwargs)
+            # 获取提示词（按变化频率分层组装，保持前缀稳定）
+            prompt = game_prompts.assemble(prompt_name, **kwargs)
+            request_params = self._build_request_params(prompt)
+            
+            # 相同的请求正在进行时共享同一次上游调用；截止时间只约束本次等待，其他等待者不受影响
+            key = prompt_fingerprint(self.config.model, prompt.messages, **request_params)
+            on_time, response = await run_with_deadline(
+                self.single_flight.do(key, lambda: self._hedged_completion(prompt, request_params)),
+                deadline
+            )
+            if not on_time:
+                self.hedge_stats.deadline_exceeded += 1
+                self.logger.warning(f"{prompt_name} 超过调用截止时间，放弃等待")
+                return LLMResponse(
+                    content="",
+                    usage={},
+                    model="",
+                    finish_reason="deadline_exceeded",
+                    response_time=0.0,
+                    success=False,
+                    error_message="超过调用截止时间"
+                )
+            return response
             
-            # 检查速率限制
-            estimated_tokens = len(system_prompt + user_prompt) // 4  # 粗略估计
-            can_request, limit_message = self.rate_limiter.can_make_request(estimated_tokens)
+        except Exception as e:
+            self.logger.error(f"生成响应失败: {str(e)}")
+            return LLMResponse(
+                content="",
+                usage={},
+                model="",
+                finish_reason="error",
+                response_time=0.0,
+                success=False,
+                error_message=str(e)
+            )
+    
+    def _build_request_params(self, prompt: AssembledPrompt) -> Dict[str, Any]:
+        """构造与后端无关的请求参数"""
+        return {
+            "response_format": output_schemas.response_format(prompt.name)
+        }
+    
+    def _sampling_params(self, prompt: AssembledPrompt, config: LLMConfig) -> Dict[str, Any]:
+        """按选中后端的配置构造采样参数"""
+        return {
+            "max_tokens": config.max_tokens,
+            "temperature": 0.9 if "conversation" in prompt.name else config.temperature  # 对话回复使用更高的温度
+        }
+    
+    def _hedge_delay(self, prompt_name: str) -> Optional[float]:
+        """对冲等待时间：该模板近期耗时的分位数；未启用或样本不足时不对冲"""
+        if not self.config.hedge_enabled:
+            return None
+        delay = self.latency_tracker.quantile(prompt_name, self.config.hedge_quantile)
+        return None if delay is None else max(delay, self.config.hedge_min_delay)
+    
+    async def _hedged_completion(self, prompt: AssembledPrompt, request_params: Dict[str, Any]) -> LLMResponse:
+        """发起请求，慢于该模板近期尾延迟时再发一个相同的请求，先成功的胜出"""
+        prompt_tokens = token_counter.count_messages(prompt.messages)
+        response = await hedged_call(
+            lambda: self._request_completion(prompt, request_params),
+            self._hedge_delay(prompt.name),
+            is_success=lambda result: result.success,
+            allow_hedge=lambda: self.router.has_capacity(prompt_tokens),
+            stats=self.hedge_stats
+        )
+        if response.success:
+            self.latency_tracker.record(prompt.name, response.response_time)
+        return response
+    
+    async def _request_completion(self, prompt: AssembledPrompt, request_params: Dict[str, Any]) -> LLMResponse:
+        """按模板选择后端，向其发起一次请求（合并后的请求只执行一次）"""
+        messages = prompt.messages
+        try:
+            # 选择后端并检查其速率限制
+            prompt_tokens = token_counter.count_messages(messages)
+            backend = self.router.route(prompt.name, prompt_tokens)
+            if backend.client is None:
+                raise RuntimeError(f"LLM后端 {backend.name} 客户端未初始化")
+            estimated_tokens = backend.estimate_tokens(prompt_tokens)
+            can_request, limit_message = backend.rate_limiter.can_make_request(estimated_tokens)
             if not can_request:
                 return LLMResponse(
                     content="",
@@ -161,29 +254,73 @@ class ResponseGenerator:
                     error_message=limit_message
                 )
             
-            # 准备消息
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
+            # 熔断器打开时立即失败，由调用方改用备用回复；并发已满时排队，等待超时才失败
+            breaker, limiter = backend.circuit_breaker, backend.concurrency_limiter
+            if not breaker.allow():
+                return LLMResponse(
+                    content="",
+                    usage={},
+                    model="",
+                    finish_reason="circuit_open",
+                    response_time=0.0,
+                    success=False,
+                    error_message="LLM服务熔断中，暂停调用"
+                )
+            try:
+                acquired = await limiter.acquire()
+            except asyncio.CancelledError:
+                breaker.record_ignored()
+                raise
+            if not acquired:
+                breaker.record_ignored()
+                return LLMResponse(
+                    content="",
+                    usage={},
+                    model="",
+                    finish_reason="overloaded",
+                    response_time=0.0,
+                    success=False,
+                    error_message="等待LLM并发名额超时"
+                )
             
             # 发起请求
             start_time = time.time()
             
-            response = await self.client.chat.completions.create(
-                model=self.config.model,
-                messages=messages,
-                max_tokens=self.config.max_tokens,
-                temperature=0.9 if "conversation" in prompt_name else self.config.temperature,  # 对话回复使用更高的温度
-                response_format={"type": "json_object"} if "JSON" in system_prompt else None
-            )
+            try:
+                response = await backend.client.chat.completions.create(
+                    model=backend.config.model,
+                    messages=messages,
+                    **request_params,
+                    **self._sampling_params(prompt, backend.config)
+                )
+            except asyncio.CancelledError:
+                breaker.record_ignored()
+                limiter.release()
+                raise
+            except Exception as e:
+                backend.stats["failed"] += 1
+                if is_provider_failure(e):
+                    breaker.record_failure()
+                    limiter.release(time.time() - start_time, False)
+                else:
+                    breaker.record_ignored()
+                    limiter.release()
+                raise
             
             end_time = time.time()
             response_time = end_time - start_time
+            breaker.record_success()
+            limiter.release(response_time, True, response.usage.completion_tokens if response.usage else None)
+            backend.latency_tracker.record(prompt.name, response_time)
+            backend.stats["succeeded"] += 1
             
             # 记录请求
             tokens_used = response.usage.total_tokens if response.usage else 0
-            self.rate_limiter.record_request(tokens_used)
+            backend.rate_limiter.record_request(tokens_used)
+            
+            prompt_tokens = response.usage.prompt_tokens if response.usage else 0
+            cached_tokens = extract_cached_tokens(response.usage)
+            self.prompt_cache_stats.record(prompt, prompt_tokens, cached_tokens)
             
             # 构造响应
             content = response.choices[0].message.content or ""
@@ -191,14 +328,17 @@ class ResponseGenerator:
             return LLMResponse(
                 content=content,
                 usage={
-                    "prompt_tokens": response.usage.prompt_tokens if response.usage else 0,
+                    "prompt_tokens": prompt_tokens,
                     "completion_tokens": response.usage.completion_tokens if response.usage else 0,
-                    "total_tokens": response.usage.total_tokens if response.usage else 0
+                    "total_tokens": response.usage.total_tokens if response.usage else 0,
+                    "cached_tokens": cached_tokens
                 },
                 model=response.model,
                 finish_reason=response.choices[0].finish_reason,
                 response_time=response_time,
-                success=True
+                success=True,
+                prefix_hashes=prompt.prefix_hashes,
+                backend=backend.name
             )
             
         except Exception as e:
@@ -213,6 +353,129 @@ class ResponseGenerator:
                 error_message=str(e)
             )
     
+    async def generate_response_stream(
+        self,
+        prompt_name: str,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        流式生成AI响应
+        
+        Args:
+            prompt_name: 提示词模板名称
+            **kwargs: 提示词参数
+            
+        Yields:
+            str: 增量内容；相同的流式请求正在进行时加入其广播
+        """
+        if not self.client:
+            raise RuntimeError("LLM客户端未初始化")
+        
+        prompt = game_prompts.assemble(prompt_name, **kwargs)
+        request_params = self._build_request_params(prompt)
+        key = prompt_fingerprint(self.config.model, prompt.messages, stream=True, **request_params)
+        
+        async for chunk in self.single_flight.stream(key, lambda: self._request_stream(prompt, request_params)):
+            yield chunk
+    
+    async def generate_response_field_stream(
+        self,
+        prompt_name: str,
+        field: Optional[str] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        流式生成JSON模板的响应，只输出其中一个字符串字段的增量内容
+        
+        Args:
+            prompt_name: 提示词模板名称
+            field: 要提取的字段，默认为模板登记的流式字段
+            **kwargs: 提示词参数
+            
+        Yields:
+            str: 字段的增量内容；流结束仍未提取到该字段时，按完整文本解析（失败时输出原文）
+        """
+        schema = output_schemas.get(prompt_name)
+        field = field or (schema.stream_field if schema else None)
+        if not field:
+            raise ValueError(f"模板 {prompt_name} 没有可流式提取的字段")
+        
+        extractor = StreamingFieldExtractor(field)
+        chunks = []
+        async for chunk in self.generate_response_stream(prompt_name, **kwargs):
+            chunks.append(chunk)
+            delta = extractor.feed(chunk)
+            if delta:
+                yield delta
+        
+        if not extractor.value:
+            content = "".join(chunks)
+            parsed = output_schemas.parse(prompt_name, content)
+            value = parsed.data.get(field) if parsed.parsed else content.strip()
+            if value:
+                yield str(value)
+    
+    async def _request_stream(self, prompt: AssembledPrompt, request_params: Dict[str, Any]) -> AsyncIterator[str]:
+        """按模板选择后端，向其发起一次流式请求"""
+        messages = prompt.messages
+        prompt_tokens = token_counter.count_messages(messages)
+        backend = self.router.route(prompt.name, prompt_tokens)
+        if backend.client is None:
+            raise RuntimeError(f"LLM后端 {backend.name} 客户端未初始化")
+        estimated_tokens = backend.estimate_tokens(prompt_tokens)
+        can_request, limit_message = backend.rate_limiter.can_make_request(estimated_tokens)
+        if not can_request:
+            raise RuntimeError(limit_message)
+        
+        breaker, limiter = backend.circuit_breaker, backend.concurrency_limiter
+        if not breaker.allow():
+            raise RuntimeError("LLM服务熔断中，暂停调用")
+        try:
+            acquired = await limiter.acquire()
+        except asyncio.CancelledError:
+            breaker.record_ignored()
+            raise
+        if not acquired:
+            breaker.record_ignored()
+            raise RuntimeError("等待LLM并发名额超时")
+        
+        completion = []
+        success = None  # 被取消或提前结束时不计入熔断和并发调整
+        try:
+            stream = await backend.client.chat.completions.create(
+                model=backend.config.model,
+                messages=messages,
+                stream=True,
+                **request_params,
+                **self._sampling_params(prompt, backend.config)
+            )
+            async for event in stream:
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if delta:
+                    completion.append(delta)
+                    yield delta
+            success = True
+        except Exception as e:
+            if is_provider_failure(e):
+                success = False
+            raise
+        finally:
+            if success:
+                breaker.record_success()
+                backend.stats["succeeded"] += 1
+            elif success is False:
+                breaker.record_failure()
+                backend.stats["failed"] += 1
+            else:
+                breaker.record_ignored()
+            # 流式耗时取决于回复长度，不作为拥塞信号
+            limiter.release(None, success)
+        
+        # 流式响应没有usage，用分词器计数
+        backend.rate_limiter.record_request(prompt_tokens + token_counter.count("".join(completion)))
+    
     async def execute_command(
         self, 
         command_text: str, 
@@ -267,10 +530,10 @@ class ResponseGenerator:
                     }
                 }
             
-            # 解析AI响应
-            try:
-                ai_result = json.loads(response.content)
-            except json.JSONDecodeError:
+            # 解析AI响应（格式错误时先修复，缺失的字段补默认值）
+            parsed = output_schemas.parse("command_execution", response.content)
+            ai_result = parsed.data
+            if not parsed.parsed:
                 # 如果AI没有返回有效JSON，使用解析器的预测结果
                 ai_result = {
                     "understanding": f"理解指令：{parsed_command.action} {', '.join(parsed_command.targets)}",
@@ -385,7 +648,10 @@ class ResponseGenerator:
         agent_own_history: List[str],
         community_stats: Dict[str, Any],
         recent_events: List[str],
-        is_first_speaker: bool = False
+        is_first_speaker: bool = False,
+        room_summary: Optional[List[str]] = None,
+        own_summary: Optional[List[str]] = None,
+        deadline: Optional[Deadline] = None
     ) -> Dict[str, Any]:
         """
         生成基于对话历史的居民回复
@@ -399,6 +665,9 @@ class ResponseGenerator:
             community_stats: 社群统计数据
             recent_events: 最近事件
             is_first_speaker: 是否是第一个发言的居民
+            room_summary: 聊天室较早对话的摘要（每行一条要点，由早到晚）
+            own_summary: 该居民较早发言的摘要
+            deadline: 调用截止时间；到期仍没有结果时返回success为False、response_type为deadline_exceeded，由调用方决定备用回复
             
         Returns:
             Dict: 包含居民回复的字典
@@ -406,27 +675,32 @@ class ResponseGenerator:
         try:
             # 如果LLM客户端可用，尝试使用LLM生成回复
             if self.client:
-                # 构建对话上下文
-                context_parts = []
-                
-                if conversation_history:
-                    context_parts.append("最近的聊天记录：")
-                    context_parts.extend(conversation_history[-5:])  # 只取最近5条
-                
-                if current_conversation and not is_first_speaker:
-                    context_parts.append("\n本轮对话中前面居民的发言：")
-                    context_parts.extend(current_conversation)
-                
-                # 添加居民自己的历史发言
-                if agent_own_history:
-                    context_parts.append("\n我自己之前的发言：")
-                    context_parts.extend(agent_own_history[-3:])  # 只取最近3条自己的发言
+                # 按token预算构建对话上下文：本轮发言优先，其次聊天室记录，最后是自己的历史发言
+                sections = [
+                    ContextSection("最近的聊天记录：", conversation_history or [], priority=1),
+                    ContextSection(
+                        "\n本轮对话中前面居民的发言：",
+                        current_conversation if current_conversation and not is_first_speaker else [],
+                        priority=0
+                    ),
+                    ContextSection("\n我自己之前的发言：", agent_own_history or [], priority=2, max_lines=3)
+                ]
+                template = game_prompts.templates["agent_conversation_response"]
+                conversation_context, _ = build_context(sections, template.context_token_budget, token_counter)
+                conversation_context = conversation_context.strip() or "暂无对话历史"
                 
-                conversation_context = "\n".join(context_parts) if context_parts else "暂无对话历史"
+                # 更早的对话以摘要代替原始记录，占用固定的token预算
+                summary_sections = [
+                    ContextSection("聊天室较早的对话：", room_summary or [], priority=0),
+                    ContextSection("\n我之前聊过：", own_summary or [], priority=1)
+                ]
+                conversation_summary, _ = build_context(summary_sections, template.summary_token_budget, token_counter)
+                conversation_summary = conversation_summary.strip() or "暂无更早的对话"
                 
                 # 使用专门的对话回复提示词
                 response = await self.generate_response(
                     "agent_conversation_response",
+                    deadline=deadline,
                     agent_name=agent_info.get("name", "未知居民"),
                     personality=agent_info.get("personality", "友好"),
                     occupation=agent_info.get("occupation", "居民"),
@@ -437,23 +711,33 @@ class ResponseGenerator:
                     education=community_stats.get("education", 50),
                     economy=community_stats.get("economy", 50),
                     recent_events="\n".join(recent_events) if recent_events else "暂无最近事件",
+                    conversation_summary=conversation_summary,
                     original_topic=original_topic,
                     conversation_context=conversation_context,
                     is_first_speaker=is_first_speaker
                 )
                 
+                if response.finish_reason == "deadline_exceeded":
+                    return {
+                        "success": False,
+                        "message": response.error_message,
+                        "agent_response": "",
+                        "response_type": "deadline_exceeded"
+                    }
+                
                 if response.success:
-                    try:
-                        # 尝试解析JSON响应
-                        response_data = json.loads(response.content)
+                    # 解析JSON响应（被截断或格式有误时先修复）
+                    parsed = output_schemas.parse("agent_conversation_response", response.content)
+                    if parsed.parsed:
+                        response_data = parsed.data
                         return {
                             "success": True,
-                            "agent_response": response_data.get("agent_response", ""),
-                            "response_type": response_data.get("response_type", "normal"),
-                            "emotion": response_data.get("emotion", "neutral"),
+                            "agent_response": response_data["agent_response"],
+                            "response_type": response_data["response_type"],
+                            "emotion": response_data["emotion"],
                             "usage": response.usage
                         }
-                    except json.JSONDecodeError:
+                    else:
                         # 如果不是JSON格式，直接使用内容作为回复
                         return {
                             "success": True,
@@ -504,123 +788,9 @@ class ResponseGenerator:
         """
         生成智能的备用回复，基于对话上下文和居民特征，包括自己的历史发言
         """
-        import random
-        
-        agent_name = agent_info.get("name", "居民")
-        personality = agent_info.get("personality", "友好")
-        occupation = agent_info.get("occupation", "居民")
-        
-        # 分析原始话题的关键词
-        topic_keywords = self._extract_topic_keywords(original_topic)
-        
-        # 检查是否有自己的历史发言，避免重复
-        has_spoken_before = len(agent_own_history) > 0
-        
-        if is_first_speaker:
-            # 第一个发言的居民，主要回应原始话题
-            if has_spoken_before:
-                # 如果之前说过话，可以引用或补充
-                if "发展" in topic_keywords or "社群" in topic_keywords:
-                    responses = [
-                        f"我是{agent_name}，之前我也关注过这个话题，现在我想补充一些新的想法...",
-                        f"我是{agent_name}，基于我之前的观察，我觉得社群发展确实有了新的变化。",
-                        f"大家好！我是{agent_name}，结合我之前的经验，我想分享一些关于社群发展的看法。"
-                    ]
-                else:
-                    responses = [
-                        f"我是{agent_name}，这个话题让我想起了之前的一些讨论，我想从新的角度来看。",
-                        f"我是{agent_name}，虽然之前我们聊过类似的话题，但今天我有了新的想法。",
-                        f"大家好！我是{agent_name}，基于我之前的思考，我想分享一些新的观点。"
-                    ]
-            else:
-                # 第一次发言，按原来的逻辑
-                if "发展" in topic_keywords or "社群" in topic_keywords:
-                    responses = [
-                        f"我是{agent_name}，作为{occupation}，我觉得我们社群的发展还是很不错的！大家都很积极参与各种活动。",
-                        f"嗨！我是{agent_name}，从我{personality}的角度来看，社群最近的氛围越来越好了，邻里关系也更和谐。",
-                        f"大家好！我是{agent_name}，我觉得我们社群在教育、健康等方面都有不少进步，值得高兴！"
-                    ]
-                elif "天气" in topic_keywords:
-                    responses = [
-                        f"我是{agent_name}，确实！今天天气特别好，很适合出门活动呢！",
-                        f"是啊！我是{agent_name}，这样的好天气让人心情都变好了，我们可以组织一些户外活动。",
-                        f"我是{agent_name}，天气好的时候总是让人精神焕发，社群里的大家也都更有活力了！"
-                    ]
-                elif "计划" in topic_keywords or "周末" in topic_keywords:
-                    responses = [
-                        f"我是{agent_name}，周末我打算和邻居们一起做些有意义的事情，比如社区志愿活动。",
-                        f"我是{agent_name}，作为{occupation}，我周末想组织一些有益的活动，让大家都能参与进来。",
-                        f"我是{agent_name}，周末是放松和交流的好时机，我们可以一起规划一些有趣的事情！"
-                    ]
-                elif "活动" in topic_keywords:
-                    responses = [
-                        f"我是{agent_name}，我觉得组织活动是个好主意！可以增进大家的感情，让社群更有凝聚力。",
-                        f"我是{agent_name}，作为{occupation}，我很支持组织各种活动，这对社群发展很有帮助。",
-                        f"我是{agent_name}，活动能让大家更好地了解彼此，我愿意积极参与和协助组织！"
-                    ]
-                else:
-                    responses = [
-                        f"我是{agent_name}，对于这个话题，我觉得很有意思！作为{occupation}，我想分享一下我的看法。",
-                        f"大家好！我是{agent_name}，这个话题让我想到了很多，我们可以深入讨论一下。",
-                        f"我是{agent_name}，从我{personality}的角度来看，这确实是个值得关注的话题。"
-                    ]
-        else:
-            # 后续发言的居民，需要回应前面的对话
-            if current_conversation:
-                last_speaker = current_conversation[-1].split(":")[0] if ":" in current_conversation[-1] else "前面的朋友"
-                last_content = current_conversation[-1].split(":", 1)[1].strip() if ":" in current_conversation[-1] else ""
-                
-                # 如果之前说过话，可以引用自己的观点
-                if has_spoken_before:
-                    responses = [
-                        f"我是{agent_name}，{last_speaker}的观点很有意思，结合我之前的想法，我觉得...",
-                        f"我是{agent_name}，听了{last_speaker}的分享，让我想起了我之前提到的一些观点，现在我想进一步补充...",
-                        f"我是{agent_name}，{last_speaker}说得很好，这和我之前的思考有些相似，我想从另一个角度来看..."
-                    ]
-                else:
-                    # 基于前面的发言内容生成回应
-                    if "同意" in last_content or "支持" in last_content:
-                        responses = [
-                            f"我也同意{last_speaker}的观点！我是{agent_name}，我想补充一点...",
-                            f"是的，{last_speaker}说得很对。我是{agent_name}，从{occupation}的角度来看，这确实很重要。",
-                            f"我是{agent_name}，{last_speaker}的想法很好，我们可以一起努力实现这些目标。"
-                        ]
-                    elif "活动" in last_content or "组织" in last_content:
-                        responses = [
-                            f"我是{agent_name}，听了{last_speaker}的建议，我觉得我们可以从小事做起，逐步扩大活动规模。",
-                            f"好主意！我是{agent_name}，作为{occupation}，我可以贡献一些专业知识来支持这些活动。",
-                            f"我是{agent_name}，{last_speaker}提到的活动让我很感兴趣，我愿意积极参与！"
-                        ]
-                    else:
-                        responses = [
-                            f"我是{agent_name}，听了{last_speaker}的分享，我也想说说我的想法...",
-                            f"有趣的观点！我是{agent_name}，我想从另一个角度来看这个问题。",
-                            f"我是{agent_name}，{last_speaker}说得很有道理，让我想到了一些相关的经历。"
-                        ]
-            else:
-                responses = [
-                    f"我是{agent_name}，虽然我不是第一个发言，但我也想分享一下我的看法。",
-                    f"我是{agent_name}，作为{occupation}，我觉得这个话题很值得讨论。",
-                    f"大家好！我是{agent_name}，听了前面的讨论，我也有一些想法要分享。"
-                ]
-        
-        return random.choice(responses)
-    
-    def _extract_topic_keywords(self, topic: str) -> List[str]:
-        """从话题中提取关键词"""
-        keywords = []
-        topic_lower = topic.lower()
-        
-        keyword_list = [
-            "发展", "社群", "天气", "计划", "周末", "活动", "组织", "讨论", 
-            "建议", "想法", "问题", "解决", "改善", "提升", "合作", "参与"
-        ]
-        
-        for keyword in keyword_list:
-            if keyword in topic_lower:
-                keywords.append(keyword)
-        
-        return keywords
+        return fallback_engine.conversation_reply(
+            agent_info, original_topic, current_conversation, agent_own_history, is_first_speaker
+        )
     
     async def analyze_community(
         self,
@@ -660,8 +830,9 @@ class ResponseGenerator:
                     "message": f"社群分析失败: {response.error_message}"
                 }
             
-            try:
-                analysis_result = json.loads(response.content)
+            parsed = output_schemas.parse("community_analysis", response.content)
+            if parsed.parsed:
+                analysis_result = parsed.data
                 return {
                     "success": True,
                     "analysis": analysis_result,
@@ -671,7 +842,7 @@ class ResponseGenerator:
                         "tokens_used": response.usage.get("total_tokens", 0)
                     }
                 }
-            except json.JSONDecodeError:
+            else:
                 return {
                     "success": False,
                     "message": "AI分析结果格式错误",
@@ -694,11 +865,28 @@ class ResponseGenerator:
             "config_valid": is_valid,
             "config_message": config_message,
             "provider": self.config.provider.value,
+            "config_version": self.config.version,
+            "supported_providers": get_supported_providers(),
             "model": self.config.model,
             "rate_limits": {
                 "requests_per_minute": self.config.rate_limit_requests_per_minute,
                 "tokens_per_minute": self.config.rate_limit_tokens_per_minute
-            }
+            },
+            "http_pool": self.http_pool.get_status() if self.http_pool else None,
+            "circuit_breaker": self.circuit_breaker.get_status(),
+            "concurrency": self.concurrency_limiter.get_status(),
+            "backends": self.router.get_status(),
+            "single_flight": self.single_flight.get_status(),
+            "hedging": {
+                "enabled": self.config.hedge_enabled,
+                "quantile": self.config.hedge_quantile,
+                **self.hedge_stats.to_dict(),
+                "latency": self.latency_tracker.get_status()
+            },
+            "prompt_cache": self.prompt_cache_stats.get_status(),
+            "structured_output": output_schemas.get_status(),
+            "fallback": fallback_engine.get_status(),
+            "token_counter": token_counter.get_status()
         }
 
 # 全局响应生成器实例
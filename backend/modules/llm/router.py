@@ -0,0 +1,184 @@
+"""
+LLM路由模块
+同时持有多个后端（主后端来自LLM_*配置，其余来自LLM_BACKENDS），每个后端有独立的客户端、连接池、
+限流器、熔断器、并发限制和按模板统计的耗时；每次请求按模板偏好、近期p50/p95耗时、失败率和剩余TPM额度选择后端
+"""
+
+from typing import Dict, List, Optional, Any, Iterable
+import logging
+
+from .config import LLMConfig, LLMProvider, BackendSpec
+from .backends import create_client
+from .http_pool import LLMHttpPool
+from .hedging import LatencyTracker
+from .resilience import RateLimiter, CircuitBreaker, AdaptiveConcurrencyLimiter
+
+PRIMARY_BACKEND = "default"
+
+# 失败率每增加10%，得分（预期耗时）增加40%
+ERROR_RATE_PENALTY = 4.0
+# 剩余TPM额度低于该比例后按最低值计算，避免得分无穷大
+MIN_TPM_HEADROOM = 0.1
+
+class LLMBackend:
+    """一个LLM后端及其调用保护和统计"""
+    
+    def __init__(self, name: str, config: LLMConfig, templates: Iterable[str] = ()):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.config = config
+        self.templates = set(templates)
+        self.client = None
+        self.http_pool: Optional[LLMHttpPool] = None  # 客户端关闭时随之关闭
+        self.rate_limiter = self._create_rate_limiter(config)
+        self.circuit_breaker = self._create_circuit_breaker(config)
+        self.concurrency_limiter = self._create_concurrency_limiter(config)
+        self.latency_tracker = LatencyTracker()
+        self.stats = {"routed": 0, "succeeded": 0, "failed": 0}
+    
+    @staticmethod
+    def _create_rate_limiter(config: LLMConfig) -> RateLimiter:
+        return RateLimiter(config.rate_limit_requests_per_minute, config.rate_limit_tokens_per_minute)
+    
+    @staticmethod
+    def _create_circuit_breaker(config: LLMConfig) -> CircuitBreaker:
+        return CircuitBreaker(
+            failure_rate_threshold=config.breaker_failure_rate,
+            min_calls=config.breaker_min_calls,
+            open_seconds=config.breaker_open_seconds
+        )
+    
+    @staticmethod
+    def _create_concurrency_limiter(config: LLMConfig) -> AdaptiveConcurrencyLimiter:
+        return AdaptiveConcurrencyLimiter(
+            initial_limit=config.concurrency_initial,
+            min_limit=config.concurrency_min,
+            max_limit=config.concurrency_max,
+            queue_timeout=config.concurrency_queue_timeout
+        )
+    
+    def connect(self):
+        """创建连接池和客户端；失败时客户端为None"""
+        try:
+            if self.config.provider == LLMProvider.LOCAL and self.config.local_inprocess:
+                self.http_pool = None
+            else:
+                self.http_pool = LLMHttpPool(self.config)
+            self.client = create_client(self.config, self.http_pool.client if self.http_pool else None)
+        except Exception as e:
+            self.logger.error(f"LLM后端 {self.name} 客户端初始化失败: {str(e)}")
+            self.client = None
+            self.http_pool = None
+    
+    def apply_config(self, config: LLMConfig):
+        """换用新配置：参数变化的组件重建，其余保留已积累的状态；客户端由调用方重建"""
+        old, self.config = self.config, config
+        if (old.rate_limit_requests_per_minute, old.rate_limit_tokens_per_minute) != \
+                (config.rate_limit_requests_per_minute, config.rate_limit_tokens_per_minute):
+            self.rate_limiter = self._create_rate_limiter(config)
+        if (old.breaker_failure_rate, old.breaker_min_calls, old.breaker_open_seconds) != \
+                (config.breaker_failure_rate, config.breaker_min_calls, config.breaker_open_seconds):
+            self.circuit_breaker = self._create_circuit_breaker(config)
+        if (old.concurrency_initial, old.concurrency_min, old.concurrency_max) != \
+                (config.concurrency_initial, config.concurrency_min, config.concurrency_max):
+            self.concurrency_limiter = self._create_concurrency_limiter(config)
+        else:
+            self.concurrency_limiter.queue_timeout = config.concurrency_queue_timeout
+        if old.model != config.model:
+            self.latency_tracker = LatencyTracker()
+    
+    def estimate_tokens(self, prompt_tokens: int) -> int:
+        """请求在该后端占用的token数：回复按该后端的max_tokens预留（与服务端TPM限流的计算方式一致）"""
+        return prompt_tokens + (self.config.max_tokens or 0)
+    
+    def available(self, prompt_tokens: int) -> bool:
+        """客户端可用、熔断器放行、并发和限流都有余量"""
+        return (
+            self.client is not None and
+            self.circuit_breaker.would_allow() and
+            self.concurrency_limiter.has_capacity() and
+            self.rate_limiter.can_make_request(self.estimate_tokens(prompt_tokens))[0]
+        )
+    
+    def tpm_headroom(self) -> float:
+        """剩余TPM额度比例"""
+        return self.rate_limiter.remaining_tokens() / max(self.config.rate_limit_tokens_per_minute, 1)
+    
+    def score(self, template: str) -> float:
+        """预期耗时得分，越低越好；样本不足的模板得分为0，先分到请求以积累样本"""
+        p50 = self.latency_tracker.quantile(template, 0.5)
+        p95 = self.latency_tracker.quantile(template, 0.95)
+        if p50 is None or p95 is None:
+            return 0.0
+        latency = (p50 + p95) / 2
+        penalty = 1 + ERROR_RATE_PENALTY * self.circuit_breaker.failure_rate()
+        return latency * penalty / max(self.tpm_headroom(), MIN_TPM_HEADROOM)
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "provider": self.config.provider.value,
+            "model": self.config.model,
+            "client_initialized": self.client is not None,
+            "templates": sorted(self.templates),
+            "tpm_headroom": round(self.tpm_headroom(), 3),
+            **self.stats,
+            "circuit_breaker": self.circuit_breaker.get_status(),
+            "concurrency": self.concurrency_limiter.get_status(),
+            "latency": self.latency_tracker.get_status(),
+            "http_pool": self.http_pool.get_status() if self.http_pool else None
+        }
+
+class LLMRouter:
+    """按模板为每次请求选择后端"""
+    
+    def __init__(self, primary: LLMBackend):
+        self.logger = logging.getLogger(__name__)
+        self.primary = primary
+        self.extra: List[LLMBackend] = []
+    
+    @property
+    def backends(self) -> List[LLMBackend]:
+        return [self.primary] + self.extra
+    
+    def set_backends(self, specs: Iterable[BackendSpec]) -> List[Any]:
+        """
+        按LLM_BACKENDS重建额外后端
+        
+        Returns:
+            List: 被替换的旧客户端，由调用方在进行中的请求结束后关闭
+        """
+        old_clients = [backend.client for backend in self.extra if backend.client is not None]
+        self.extra = []
+        for spec in specs:
+            if spec.name == PRIMARY_BACKEND:
+                self.logger.error(f"LLM后端名称 {PRIMARY_BACKEND} 保留给主后端，已跳过")
+                continue
+            backend = LLMBackend(spec.name, spec.config, spec.templates)
+            backend.connect()
+            self.extra.append(backend)
+            self.logger.info(f"LLM后端 {spec.name} 已加入路由: {spec.config.model}")
+        return old_clients
+    
+    def route(self, template: str, prompt_tokens: int = 0) -> LLMBackend:
+        """
+        选择后端：优先声明了该模板的后端，其次未声明模板的通用后端，最后任意可用后端；
+        同一层内选得分最低的，得分相同时选进行中请求最少的；都不可用时返回主后端（由其自身的限流和熔断返回失败）
+        """
+        candidates = [backend for backend in self.backends if backend.available(prompt_tokens)]
+        tier = (
+            [backend for backend in candidates if template in backend.templates] or
+            [backend for backend in candidates if not backend.templates] or
+            candidates
+        )
+        if not tier:
+            return self.primary
+        backend = min(tier, key=lambda b: (b.score(template), b.concurrency_limiter.in_flight))
+        backend.stats["routed"] += 1
+        return backend
+    
+    def has_capacity(self, prompt_tokens: int = 0) -> bool:
+        """是否还有后端可以接收请求（用于决定是否发出对冲请求）"""
+        return any(backend.available(prompt_tokens) for backend in self.backends)
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {backend.name: backend.get_status() for backend in self.backends}
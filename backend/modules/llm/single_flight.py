@@ -0,0 +1,161 @@
+"""
+请求合并模块（single-flight）
+同一时刻内容完全相同的LLM请求只向上游发起一次，所有等待者共享同一个结果；
+流式请求同样只建立一条上游连接，增量内容广播给所有订阅者，后加入的订阅者先补发已生成的部分
+"""
+
+from typing import Dict, List, Optional, Any, Callable, Awaitable, AsyncIterator
+import asyncio
+import hashlib
+import json
+import logging
+
+def prompt_fingerprint(model: str, messages: List[Dict[str, str]], **params) -> str:
+    """根据模型、完整消息和请求参数计算请求指纹"""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class _Flight:
+    """一次进行中的普通请求"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _StreamFlight:
+    """一次进行中的流式请求：保存已生成的增量，供所有订阅者按各自进度读取"""
+    
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+    
+    def push(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+    
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+    
+    def _notify(self):
+        # 唤醒当前所有等待者后换一个新的Event给下一轮等待
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+class SingleFlight:
+    """相同请求合并器"""
+    
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._flights: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        
+        self.stats = {
+            "calls": 0,
+            "upstream_calls": 0,
+            "coalesced": 0,
+            "stream_calls": 0,
+            "stream_upstream_calls": 0,
+            "stream_coalesced": 0
+        }
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行请求；相同key的请求正在进行时直接等待其结果
+        
+        上游调用在独立任务中执行，单个等待者被取消不影响其他等待者；所有等待者都取消后才取消上游调用
+        """
+        self.stats["calls"] += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            self.stats["upstream_calls"] += 1
+            flight = _Flight(asyncio.create_task(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._forget(self._flights, key, flight))
+        else:
+            self.stats["coalesced"] += 1
+        
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                self._forget(self._flights, key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+    
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        流式执行请求；相同key的流正在进行时加入广播
+        
+        Yields:
+            str: 增量内容（后加入的订阅者会先收到已生成的全部增量）
+        """
+        self.stats["stream_calls"] += 1
+        flight = self._streams.get(key)
+        if flight is None:
+            self.stats["stream_upstream_calls"] += 1
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.create_task(self._pump(fn, flight))
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._forget(self._streams, key, flight))
+        else:
+            self.stats["stream_coalesced"] += 1
+        
+        flight.waiters += 1
+        position = 0
+        try:
+            while True:
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.changed.wait()
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done and flight.task:
+                self._forget(self._streams, key, flight)
+                flight.task.cancel()
+    
+    async def _pump(self, fn: Callable[[], AsyncIterator[str]], flight: _StreamFlight):
+        """读取上游流并广播"""
+        try:
+            async for chunk in fn():
+                flight.push(chunk)
+            flight.finish()
+        except asyncio.CancelledError:
+            flight.finish(asyncio.CancelledError())
+            raise
+        except Exception as e:
+            self.logger.error(f"流式请求失败: {str(e)}")
+            flight.finish(e)
+    
+    @staticmethod
+    def _forget(flights: Dict[str, Any], key: str, flight: Any):
+        # 完成后立即移除：合并只针对同时进行的请求，结果不做缓存
+        if flights.get(key) is flight:
+            del flights[key]
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取合并器状态"""
+        return {
+            "in_flight": len(self._flights),
+            "streams_in_flight": len(self._streams),
+            **self.stats
+        }
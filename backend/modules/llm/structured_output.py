@@ -0,0 +1,426 @@
+"""
+结构化输出模块
+按提示词模板登记输出结构（字段类型、默认值、可选值），登记时编译为校验函数；
+模型输出先直接解析，失败时修复常见的格式问题（代码块标记、尾逗号、未闭合的字符串和括号等），避免因格式错误重新生成；
+流式生成时增量提取指定的字符串字段（如agent_response），不必等整个JSON对象生成完
+"""
+
+from typing import Dict, List, Optional, Any, Callable, Tuple
+from dataclasses import dataclass, field
+import copy
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+CODE_FENCE_PATTERN = re.compile(r"^\s*```(?:json|JSON)?\s*|\s*```\s*$")
+NUMBER_PATTERN = re.compile(r"^[+-]?\d+(?:\.\d+)?$")
+WORD_PATTERN = re.compile(r"[A-Za-z]+")
+
+JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+@dataclass(frozen=True)
+class OutputField:
+    """输出字段定义"""
+    type: str = "str"            # str/int/float/bool/list/dict/number_map（值为整数的字典）
+    default: Any = None
+    required: bool = True
+    choices: Tuple[str, ...] = ()
+
+Converter = Callable[[Any], Tuple[Any, bool]]  # 返回 (转换后的值, 是否有效)
+
+def _to_number(value: Any, cast: Callable[[float], Any]) -> Tuple[Any, bool]:
+    if isinstance(value, bool):
+        return None, False
+    if isinstance(value, (int, float)):
+        return cast(value), True
+    if isinstance(value, str) and NUMBER_PATTERN.match(value.strip()):
+        return cast(float(value.strip())), True
+    return None, False
+
+def _convert_str(value: Any) -> Tuple[Any, bool]:
+    if isinstance(value, str):
+        return value, True
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value), True
+    return None, False
+
+def _convert_bool(value: Any) -> Tuple[Any, bool]:
+    if isinstance(value, bool):
+        return value, True
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true", True
+    return None, False
+
+def _convert_list(value: Any) -> Tuple[Any, bool]:
+    if isinstance(value, list):
+        return value, True
+    if isinstance(value, str):
+        return [value], True
+    return None, False
+
+def _convert_dict(value: Any) -> Tuple[Any, bool]:
+    return (value, True) if isinstance(value, dict) else (None, False)
+
+def _convert_number_map(value: Any) -> Tuple[Any, bool]:
+    """值为整数的字典（如指标变化），无法转换的项丢弃"""
+    if not isinstance(value, dict):
+        return None, False
+    result = {}
+    for key, item in value.items():
+        number, valid = _to_number(item, lambda x: int(round(x)))
+        if valid:
+            result[key] = number
+    return result, True
+
+CONVERTERS: Dict[str, Converter] = {
+    "str": _convert_str,
+    "int": lambda value: _to_number(value, lambda x: int(round(x))),
+    "float": lambda value: _to_number(value, float),
+    "bool": _convert_bool,
+    "list": _convert_list,
+    "dict": _convert_dict,
+    "number_map": _convert_number_map
+}
+
+def _compile_field(spec: OutputField) -> Converter:
+    convert = CONVERTERS[spec.type]
+    if not spec.choices:
+        return convert
+    choices = frozenset(spec.choices)
+    
+    def convert_choice(value: Any) -> Tuple[Any, bool]:
+        value, valid = convert(value)
+        return (value, True) if valid and value in choices else (None, False)
+    return convert_choice
+
+class OutputSchema:
+    """一个模板的输出结构"""
+    
+    def __init__(self, fields: Dict[str, OutputField], stream_field: Optional[str] = None, json_mode: bool = True):
+        self.fields = fields
+        self.stream_field = stream_field  # 流式生成时增量提取的字段
+        self.json_mode = json_mode        # 请求时是否要求JSON格式输出（提示词中需含"JSON"字样）
+        self._validators = tuple((name, spec, _compile_field(spec)) for name, spec in fields.items())
+    
+    def validate(self, data: Any) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        校验并规范化
+        
+        Returns:
+            Tuple: (规范化后的数据，缺失或无效的字段用默认值, 错误列表)
+        """
+        errors = []
+        if not isinstance(data, dict):
+            errors.append("输出不是JSON对象")
+            data = {}
+        result = dict(data)
+        for name, spec, convert in self._validators:
+            value = data.get(name)
+            if value is None:
+                if spec.required:
+                    errors.append(f"缺少字段 {name}")
+                result[name] = copy.deepcopy(spec.default)
+                continue
+            value, valid = convert(value)
+            if not valid:
+                errors.append(f"字段 {name} 无效")
+                value = copy.deepcopy(spec.default)
+            result[name] = value
+        return result, errors
+
+@dataclass
+class StructuredResult:
+    """结构化输出的解析结果"""
+    data: Dict[str, Any]
+    parsed: bool                  # 是否解析出了JSON
+    repaired: bool = False        # 是否经过修复
+    errors: List[str] = field(default_factory=list)
+    
+    @property
+    def ok(self) -> bool:
+        return self.parsed and not self.errors
+
+def strip_code_fence(text: str) -> str:
+    """去掉```json代码块标记和JSON对象前后的说明文字"""
+    text = CODE_FENCE_PATTERN.sub("", text.strip())
+    start = text.find("{")
+    return text[start:] if start > 0 else text
+
+def repair_json(text: str) -> str:
+    """
+    修复常见的JSON格式问题：字符串中的原始换行、尾逗号、Python字面量、
+    被截断的字符串、缺少值的键和未闭合的括号
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+            elif char == "\r":
+                char = ""
+            elif char == "\t":
+                char = "\\t"
+            out.append(char)
+            i += 1
+            continue
+        
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                stack.pop()
+            if not stack:
+                # 顶层对象已结束，丢弃后面的说明文字
+                out.append(char)
+                break
+        elif char.isascii() and char.isalpha():
+            word = WORD_PATTERN.match(text, i).group(0)
+            out.append(PYTHON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        out.append(char)
+        i += 1
+    
+    # 截断处理：闭合字符串，补全缺少的值，再闭合括号
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    _drop_trailing_comma(out)
+    tail = "".join(out).rstrip()
+    if tail.endswith(":"):
+        out.append(" null")
+    elif stack and stack[-1] == "}" and tail.endswith('"') and _ends_with_dangling_key(tail):
+        out.append(": null")
+    out.extend(reversed(stack))
+    return "".join(out)
+
+def _drop_trailing_comma(out: List[str]):
+    position = len(out) - 1
+    while position >= 0 and out[position].isspace():
+        position -= 1
+    if position >= 0 and out[position] == ",":
+        del out[position]
+
+def _ends_with_dangling_key(text: str) -> bool:
+    """对象中最后一个完整字符串是键而不是值（前面是 { 或 ,）"""
+    end = len(text) - 1
+    position = end - 1
+    while position >= 0:
+        if text[position] == '"' and (position == 0 or text[position - 1] != "\\"):
+            break
+        position -= 1
+    before = text[:position].rstrip()
+    return before.endswith("{") or before.endswith(",")
+
+def parse_structured(text: str, schema: Optional[OutputSchema] = None) -> StructuredResult:
+    """解析模型输出：直接解析，失败时修复后再解析；给定结构时校验并补齐默认值"""
+    candidate = strip_code_fence(text or "")
+    repaired = False
+    try:
+        data = json.loads(candidate)
+    except ValueError:
+        try:
+            data = json.loads(repair_json(candidate))
+            repaired = True
+        except ValueError:
+            return StructuredResult(data={}, parsed=False, errors=["无法解析为JSON"])
+    
+    if schema is None:
+        return StructuredResult(data=data if isinstance(data, dict) else {"value": data}, parsed=True, repaired=repaired)
+    normalized, errors = schema.validate(data)
+    return StructuredResult(data=normalized, parsed=True, repaired=repaired, errors=errors)
+
+class StreamingFieldExtractor:
+    """
+    从流式生成的JSON文本中增量提取一个顶层字符串字段的内容
+    
+    逐字符扫描，只跟踪嵌套深度、字符串和转义状态，不构造对象；每次feed返回该字段新解码出的文本
+    """
+    
+    def __init__(self, field_name: str):
+        self.field_name = field_name
+        self.value = ""             # 已提取的全部内容
+        self.complete = False       # 字段的字符串已结束
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode: Optional[str] = None     # 正在读取的\uXXXX的十六进制位
+        self._high_surrogate: Optional[int] = None
+        self._expect_key = False
+        self._string_is_key = False
+        self._in_target = False
+        self._last_key: Optional[str] = None
+        self._key_chars: List[str] = []
+    
+    def feed(self, chunk: str) -> str:
+        emitted: List[str] = []
+        for char in chunk:
+            if self._in_string:
+                self._consume_string_char(char, emitted)
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_is_key = self._depth == 1 and self._expect_key
+                self._in_target = (
+                    self._depth == 1 and not self._expect_key and
+                    self._last_key == self.field_name and not self.complete
+                )
+                self._key_chars = []
+            elif char in "{[":
+                self._depth += 1
+                self._expect_key = self._depth == 1 and char == "{"
+            elif char in "}]":
+                self._depth -= 1
+            elif self._depth == 1:
+                if char == ",":
+                    self._expect_key = True
+                elif char == ":":
+                    self._expect_key = False
+        text = "".join(emitted)
+        self.value += text
+        return text
+    
+    def _consume_string_char(self, char: str, emitted: List[str]):
+        if self._unicode is not None:
+            self._unicode += char
+            if len(self._unicode) == 4:
+                self._append(self._decode_unicode(self._unicode), emitted)
+                self._unicode = None
+            return
+        if self._escape:
+            self._escape = False
+            if char == "u":
+                self._unicode = ""
+            else:
+                self._append(JSON_ESCAPES.get(char, char), emitted)
+            return
+        if char == "\\":
+            self._escape = True
+        elif char == '"':
+            self._in_string = False
+            if self._string_is_key:
+                self._last_key = "".join(self._key_chars)
+            elif self._in_target:
+                self._in_target = False
+                self.complete = True
+        else:
+            self._append(char, emitted)
+    
+    def _decode_unicode(self, digits: str) -> str:
+        try:
+            code = int(digits, 16)
+        except ValueError:
+            return ""
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ""
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        return chr(code)
+    
+    def _append(self, text: str, emitted: List[str]):
+        if self._string_is_key:
+            self._key_chars.append(text)
+        elif self._in_target:
+            emitted.append(text)
+
+class SchemaRegistry:
+    """提示词模板 -> 输出结构"""
+    
+    def __init__(self):
+        self._schemas: Dict[str, OutputSchema] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+    
+    def register(self, template: str, schema: OutputSchema):
+        self._schemas[template] = schema
+    
+    def get(self, template: str) -> Optional[OutputSchema]:
+        return self._schemas.get(template)
+    
+    def response_format(self, template: str) -> Optional[Dict[str, str]]:
+        """请求参数中的response_format（登记时确定，不再检查提示词内容）"""
+        schema = self._schemas.get(template)
+        return {"type": "json_object"} if schema is not None and schema.json_mode else None
+    
+    def parse(self, template: str, text: str) -> StructuredResult:
+        """按模板的输出结构解析，并统计修复和失败次数"""
+        result = parse_structured(text, self._schemas.get(template))
+        stats = self._stats.setdefault(template, {"parsed": 0, "repaired": 0, "invalid": 0, "failed": 0})
+        if not result.parsed:
+            stats["failed"] += 1
+            logger.warning(f"{template} 输出无法解析为JSON")
+        else:
+            stats["parsed"] += 1
+            stats["repaired"] += int(result.repaired)
+            stats["invalid"] += int(bool(result.errors))
+        return result
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "templates": sorted(self._schemas),
+            "stats": self._stats
+        }
+
+# 全局输出结构登记表
+output_schemas = SchemaRegistry()
+
+output_schemas.register("command_execution", OutputSchema({
+    "understanding": OutputField("str", ""),
+    "execution_process": OutputField("str", ""),
+    "result_description": OutputField("str", ""),
+    "stat_changes": OutputField("number_map", {}),
+    "events_generated": OutputField("list", []),
+    "success": OutputField("bool", True, required=False),
+    "message": OutputField("str", "指令执行完成")
+}))
+
+output_schemas.register("agent_conversation_response", OutputSchema({
+    "agent_response": OutputField("str", ""),
+    "response_type": OutputField("str", "normal", required=False),
+    "emotion": OutputField(
+        "str", "neutral", required=False,
+        choices=("happy", "excited", "thoughtful", "concerned", "neutral", "curious", "amused")
+    )
+}, stream_field="agent_response"))
+
+output_schemas.register("community_analysis", OutputSchema({
+    "overall_assessment": OutputField("str", ""),
+    "trend_analysis": OutputField("dict", {}),
+    "main_challenges": OutputField("list", []),
+    "recommendations": OutputField("list", []),
+    "risk_points": OutputField("list", [], required=False),
+    "future_prediction": OutputField("str", "", required=False)
+}))
+
+output_schemas.register("event_generation", OutputSchema({
+    "events": OutputField("list", [])
+}))
+
+# 提示词没有"JSON"字样，不能要求JSON格式输出（OpenAI会拒绝请求）
+output_schemas.register("system_analysis", OutputSchema({
+    "system_health": OutputField("str", ""),
+    "performance_analysis": OutputField("str", ""),
+    "bottlenecks": OutputField("list", [], required=False),
+    "optimization_suggestions": OutputField("list", [], required=False),
+    "maintenance_required": OutputField("bool", False, required=False),
+    "risk_level": OutputField("str", "", required=False)
+}, json_mode=False))
@@ -0,0 +1,163 @@
+"""
+Token计数与上下文预算模块
+优先使用本地tiktoken分词器精确计数，未安装时按中日韩字符和其他字符分别估算；
+单条文本的计数结果会被缓存，历史消息按优先级装入每个模板的token预算
+"""
+
+from typing import Dict, List, Optional, Any, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import logging
+import math
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 估算参数：中文在常见BPE词表中平均约1.2个token/字，其他文本约4个字符/token
+CJK_TOKENS_PER_CHAR = 1.2
+OTHER_CHARS_PER_TOKEN = 4.0
+CJK_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]")
+
+# 对话格式中每条消息的固定开销和回复引导开销
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+class TokenCounter:
+    """带缓存的token计数器"""
+    
+    def __init__(self, model: Optional[str] = None, cache_size: int = 8192):
+        self.logger = logging.getLogger(__name__)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._encoding = None
+        self.backend = "estimate"
+        self.hits = 0
+        self.misses = 0
+        if model:
+            self.set_model(model)
+    
+    def set_model(self, model: str):
+        """按模型选择分词器；tiktoken不可用或词表无法加载时使用估算"""
+        encoding = None
+        if tiktoken is not None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                try:
+                    encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    self.logger.warning(f"tiktoken词表加载失败，使用估算计数: {str(e)}")
+            except Exception as e:
+                self.logger.warning(f"tiktoken词表加载失败，使用估算计数: {str(e)}")
+        if encoding is not self._encoding:
+            self._encoding = encoding
+            self._cache.clear()
+        self.backend = f"tiktoken:{encoding.name}" if encoding is not None else "estimate"
+    
+    @staticmethod
+    def estimate(text: str) -> int:
+        """不依赖分词器的估算"""
+        if not text:
+            return 0
+        cjk = len(CJK_PATTERN.findall(text))
+        other = len(text) - cjk
+        return math.ceil(cjk * CJK_TOKENS_PER_CHAR + other / OTHER_CHARS_PER_TOKEN)
+    
+    def count(self, text: str) -> int:
+        """计算单条文本的token数（结果缓存）"""
+        if not text:
+            return 0
+        cached = self._cache.get(text)
+        if cached is not None:
+            self.hits += 1
+            self._cache.move_to_end(text)
+            return cached
+        
+        self.misses += 1
+        if self._encoding is not None:
+            tokens = len(self._encoding.encode(text, disallowed_special=()))
+        else:
+            tokens = self.estimate(text)
+        self._cache[text] = tokens
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return tokens
+    
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """计算对话消息列表的prompt token数"""
+        return sum(TOKENS_PER_MESSAGE + self.count(message.get("content") or "") for message in messages) + TOKENS_PER_REPLY
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取计数器状态"""
+        return {
+            "backend": self.backend,
+            "cache_size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+@dataclass
+class ContextSection:
+    """上下文中的一段历史"""
+    title: str
+    lines: List[str]
+    priority: int              # 数字越小越先装入预算
+    max_lines: Optional[int] = None
+    kept: List[str] = field(default_factory=list)
+
+def build_context(
+    sections: List[ContextSection],
+    token_budget: int,
+    counter: TokenCounter,
+    separator: str = "\n"
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    按优先级把历史消息装入token预算
+    
+    每段按优先级从高到低、段内从新到旧装入，装不下即停止该段；不同段中重复的内容只保留在优先级高的段，
+    输出时各段保持传入顺序、段内保持时间顺序
+    
+    Returns:
+        Tuple: (上下文文本, 统计 {"tokens", "budget", "kept", "dropped"})
+    """
+    used = 0
+    seen = set()
+    kept_count = dropped_count = 0
+    for section in sorted(sections, key=lambda section: section.priority):
+        section.kept = []
+        title_tokens = counter.count(section.title) if section.title else 0
+        lines = section.lines
+        for i in range(len(lines) - 1, -1, -1):
+            line = lines[i]
+            if line in seen:
+                continue
+            cost = counter.count(line) + (title_tokens if not section.kept else 0)
+            full = section.max_lines is not None and len(section.kept) >= section.max_lines
+            if full or used + cost > token_budget:
+                # 段内只保留连续的最近消息，避免历史出现断层
+                dropped_count += i + 1
+                break
+            used += cost
+            seen.add(line)
+            section.kept.append(line)
+            kept_count += 1
+        section.kept.reverse()
+    
+    parts = []
+    for section in sections:
+        if section.kept:
+            if section.title:
+                parts.append(section.title)
+            parts.extend(section.kept)
+    return separator.join(parts), {
+        "tokens": used,
+        "budget": token_budget,
+        "kept": kept_count,
+        "dropped": dropped_count
+    }
+
+# 全局token计数器
+token_counter = TokenCounter()
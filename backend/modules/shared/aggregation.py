@@ -0,0 +1,65 @@
+"""
+并发聚合模块
+状态类接口由多个互不依赖的部分组成，逐个等待时耗时是各部分之和；
+这里把各部分并发执行（同步阻塞的部分放到线程池），超时或出错的部分返回默认值，其余部分照常返回
+
+限时只对协程和 blocking=True 的部分生效：普通同步函数直接在事件循环中依次执行，
+无法被打断，只适合读取内存状态这类很快的操作；可能变慢的同步调用（数据库、文件、大量计算）应标记为 blocking
+"""
+
+from typing import Dict, Any, Callable, Tuple
+from dataclasses import dataclass
+import asyncio
+import inspect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class AggregatePart:
+    """聚合中的一个部分"""
+    fn: Callable[[], Any]     # 无参函数，可以是协程函数
+    timeout: float = 2.0      # 对普通同步函数不生效
+    blocking: bool = False    # 同步阻塞的函数（如数据库查询）放到线程池执行并限时
+    default: Any = None       # 超时或出错时的结果
+
+async def _run_part(part: AggregatePart) -> Any:
+    """执行一个部分：blocking的放到线程池、协程等待时限时，普通同步函数直接调用（不限时）"""
+    if part.blocking:
+        return await asyncio.wait_for(asyncio.to_thread(part.fn), part.timeout)
+    result = part.fn()
+    if inspect.isawaitable(result):
+        result = await asyncio.wait_for(result, part.timeout)
+    return result
+
+async def gather_parts(parts: Dict[str, AggregatePart]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    并发执行各部分
+    
+    Args:
+        parts: 部分名 -> 部分
+    
+    Returns:
+        Tuple: (部分名 -> 结果, 部分名 -> {"status": ok/timeout/error, "latency_ms", "error"})
+    """
+    async def timed(name: str, part: AggregatePart) -> Tuple[Any, Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            result, meta = await _run_part(part), {"status": "ok"}
+        except asyncio.TimeoutError:
+            result, meta = part.default, {"status": "timeout", "error": f"超过{part.timeout}秒"}
+            logger.warning(f"聚合部分 {name} 超时")
+        except Exception as e:
+            result, meta = part.default, {"status": "error", "error": str(e)}
+            logger.error(f"聚合部分 {name} 失败: {str(e)}")
+        meta["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return result, meta
+    
+    outcomes = await asyncio.gather(*(timed(name, part) for name, part in parts.items()))
+    results = {}
+    meta = {}
+    for name, (result, part_meta) in zip(parts, outcomes):
+        results[name] = result
+        meta[name] = part_meta
+    return results, meta
@@ -158,6 +158,25 @@ class ChatMessage(Base):
     def __repr__(self):
         return f"<ChatMessage(id={self.id}, sender={self.sender_name}, type={self.sender_type})>"
 
+class ConversationSummary(Base):
+    """
+    对话摘要表
+    存储每个聊天室及其中每位居民较早对话的滚动摘要
+    """
+    __tablename__ = "conversation_summaries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    room = Column(String(50), index=True, comment="聊天室")
+    agent_name = Column(String(100), default="", index=True, comment="居民姓名，空字符串表示聊天室整体摘要")
+    summary = Column(Text, default="", comment="摘要内容，每行一条要点")
+    last_message_id = Column(Integer, default=0, comment="已并入摘要的最后一条消息ID")
+    message_count = Column(Integer, default=0, comment="已并入摘要的消息数")
+    token_count = Column(Integer, default=0, comment="摘要token数")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="最后更新时间")
+    
+    def __repr__(self):
+        return f"<ConversationSummary(room={self.room}, agent={self.agent_name}, messages={self.message_count})>"
+
 class ExternalUser(Base):
     """
     外部用户表
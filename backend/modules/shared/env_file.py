@@ -0,0 +1,48 @@
+"""
+.env文件读取模块
+启动时和配置热加载共用同一套解码和解析规则；不依赖其他业务模块，可在加载环境变量之前导入
+"""
+
+import os
+from pathlib import Path
+from typing import Dict
+
+# 上次从.env文件写入环境的变量，用于在文件中删除某项后同步移除
+_applied: Dict[str, str] = {}
+
+def read_env_file(path: Path) -> Dict[str, str]:
+    """读取.env文件（依次尝试UTF-8、GBK、latin-1编码）"""
+    content = None
+    for encoding in ("utf-8", "gbk", "latin-1"):
+        try:
+            content = path.read_text(encoding=encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    
+    values = {}
+    for line in (content or "").splitlines():
+        line = line.strip()
+        if line and not line.startswith('#') and '=' in line:
+            key, value = line.split('=', 1)
+            values[key.strip()] = value.strip().strip('"').strip("'")  # 去除引号
+    return values
+
+def apply_env_file(path: Path) -> Dict[str, str]:
+    """
+    把.env文件中的变量写入环境
+    
+    上次由该文件写入、这次已从文件中删除的变量会从环境中移除；
+    若该变量此后被其他途径改成了别的值则保留，不覆盖进程外部设置的环境变量
+    
+    Returns:
+        Dict[str, str]: 本次写入的变量
+    """
+    values = read_env_file(path) if path.exists() else {}
+    for key, value in _applied.items():
+        if key not in values and os.environ.get(key) == value:
+            del os.environ[key]
+    os.environ.update(values)
+    _applied.clear()
+    _applied.update(values)
+    return values
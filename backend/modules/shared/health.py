@@ -0,0 +1,194 @@
+"""
+健康检查模块
+后台按固定周期检查各组件（数据库、LLM、社群模拟等）并缓存结果，
+存活/就绪探针直接读取缓存状态，探针请求本身不访问数据库也不做任何计算
+"""
+
+from typing import Dict, Optional, Any, Callable, Awaitable, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import asyncio
+import inspect
+import logging
+import os
+import time
+
+CheckResult = Tuple[bool, Any]  # (是否健康, 详情)
+HealthCheck = Callable[[], Union[CheckResult, Awaitable[CheckResult]]]
+
+# 组件状态
+STATUS_UNKNOWN = "unknown"  # 尚未检查
+STATUS_OK = "ok"
+STATUS_DOWN = "down"
+
+# 阻塞检查专用的线程数：检查卡住时最多占住这几个线程，不会挤占默认线程池
+CHECK_WORKERS = 2
+
+class ComponentHealth:
+    """单个组件的检查项和最近一次结果"""
+    
+    def __init__(self, name: str, check: HealthCheck, critical: bool, timeout: float, blocking: bool):
+        self.name = name
+        self.check = check
+        self.critical = critical            # 关键组件不健康时服务不就绪
+        self.timeout = timeout
+        self.blocking = blocking            # 同步阻塞的检查（如数据库查询）放到线程池执行
+        self.status = STATUS_UNKNOWN
+        self.detail: Any = None
+        self.last_checked: Optional[float] = None
+        self.latency_ms: Optional[float] = None
+        self.consecutive_failures = 0
+        self.pending: Optional[asyncio.Future] = None  # 仍在线程中执行的阻塞检查
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "critical": self.critical,
+            "last_checked": datetime.fromtimestamp(self.last_checked).isoformat() if self.last_checked else None,
+            "latency_ms": self.latency_ms,
+            "consecutive_failures": self.consecutive_failures,
+            "detail": self.detail
+        }
+
+class HealthMonitor:
+    """组件健康监视器"""
+    
+    def __init__(self, interval_seconds: float = 10.0, stale_after_seconds: Optional[float] = None):
+        self.logger = logging.getLogger(__name__)
+        self.interval_seconds = interval_seconds
+        # 超过该时间没有检查结果视为状态未知（监视循环卡住时就绪探针不会一直返回旧结果）
+        self.stale_after_seconds = stale_after_seconds or interval_seconds * 3
+        self.started_at = time.time()
+        self._components: Dict[str, ComponentHealth] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+    
+    def register(self, name: str, check: HealthCheck, critical: bool = True, timeout: float = 5.0, blocking: bool = False):
+        """
+        注册检查项
+        
+        Args:
+            name: 组件名
+            check: 检查函数，返回 (是否健康, 详情)，可以是协程函数
+            critical: 是否关键组件
+            timeout: 单次检查超时（秒）
+            blocking: 是否为同步阻塞的检查
+        """
+        self._components[name] = ComponentHealth(name, check, critical, timeout, blocking)
+    
+    async def start(self):
+        """先完成一轮检查再启动后台循环，启动后就绪探针立即有结果"""
+        await self.check_all()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._executor:
+            # 不等待卡住的检查线程
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.check_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"健康检查失败: {str(e)}")
+    
+    async def check_all(self):
+        """并发检查全部组件"""
+        await asyncio.gather(*(self._check(component) for component in self._components.values()))
+    
+    def _run_blocking(self, component: ComponentHealth) -> asyncio.Future:
+        """在专用线程池中执行阻塞检查；超时只停止等待，线程结束前该组件不再发起新的检查"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=CHECK_WORKERS, thread_name_prefix="health-check")
+        future = asyncio.get_running_loop().run_in_executor(self._executor, component.check)
+        # 超时后无人等待结果，取走异常避免事件循环报告未处理的异常
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        component.pending = future
+        return future
+    
+    async def _check(self, component: ComponentHealth):
+        start = time.perf_counter()
+        try:
+            if component.blocking:
+                if component.pending is not None and not component.pending.done():
+                    # 上次检查仍卡在线程中（如数据库无响应），不再占用新的线程
+                    raise RuntimeError(f"上次检查仍未结束（已超过{component.timeout}秒）")
+                # shield: 超时不取消future，pending保持到线程真正结束
+                result = await asyncio.wait_for(asyncio.shield(self._run_blocking(component)), component.timeout)
+            else:
+                result = component.check()
+                if inspect.isawaitable(result):
+                    result = await asyncio.wait_for(result, component.timeout)
+            healthy, detail = result
+        except asyncio.TimeoutError:
+            healthy, detail = False, f"检查超时（{component.timeout}秒）"
+        except Exception as e:
+            healthy, detail = False, str(e)
+        
+        previous = component.status
+        component.latency_ms = round((time.perf_counter() - start) * 1000, 2)
+        component.last_checked = time.time()
+        component.status = STATUS_OK if healthy else STATUS_DOWN
+        component.detail = detail
+        component.consecutive_failures = 0 if healthy else component.consecutive_failures + 1
+        if previous != component.status and previous != STATUS_UNKNOWN:
+            self.logger.warning(f"组件 {component.name} 状态变化: {previous} -> {component.status}")
+    
+    def _effective_status(self, component: ComponentHealth, now: float) -> str:
+        if component.last_checked is None or now - component.last_checked > self.stale_after_seconds:
+            return STATUS_UNKNOWN
+        return component.status
+    
+    def liveness(self) -> Dict[str, Any]:
+        """存活：进程和事件循环能响应即可"""
+        return {
+            "status": STATUS_OK,
+            "uptime_seconds": round(time.time() - self.started_at, 1)
+        }
+    
+    def readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        就绪：全部关键组件最近一次检查健康且结果未过期
+        
+        Returns:
+            Tuple: (是否就绪, 各组件状态摘要)
+        """
+        now = time.time()
+        components = {}
+        ready = True
+        for name, component in self._components.items():
+            status = self._effective_status(component, now)
+            components[name] = {
+                "status": status,
+                "critical": component.critical,
+                "age_seconds": round(now - component.last_checked, 1) if component.last_checked else None
+            }
+            if component.critical and status != STATUS_OK:
+                ready = False
+        return ready, {"status": "ready" if ready else "not_ready", "components": components}
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取全部组件的详细检查结果"""
+        now = time.time()
+        return {
+            "interval_seconds": self.interval_seconds,
+            "stale_after_seconds": self.stale_after_seconds,
+            "running": self._task is not None and not self._task.done(),
+            "components": {
+                name: {**component.to_dict(), "status": self._effective_status(component, now)}
+                for name, component in self._components.items()
+            }
+        }
+
+# 全局健康监视器
+health_monitor = HealthMonitor(interval_seconds=float(os.getenv("HEALTH_CHECK_INTERVAL", "10")))
@@ -0,0 +1,159 @@
+"""
+实时推送模块
+进程内的事件中心：持久事件带递增序号并保存在环形缓冲区，断线重连后可按序号补发；
+每个订阅者有独立的有界队列，跟不上的订阅者会被断开，由客户端按序号续传
+"""
+
+from typing import Dict, List, Optional, Any, Tuple
+from collections import deque
+from datetime import datetime
+import asyncio
+import threading
+
+class Subscription:
+    """单个订阅者"""
+    
+    def __init__(self, hub: "RealtimeHub", queue_size: int):
+        self.hub = hub
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.closed = False
+    
+    def _offer(self, event: Dict[str, Any]):
+        """放入事件；队列满时标记溢出并关闭订阅"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.close()
+    
+    async def get_batch(self, max_events: int = 256, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        等待至少一个事件，然后取走队列中已有的全部事件（最多max_events个）
+        
+        超时返回空列表；订阅被关闭时返回空列表且closed为True
+        """
+        if self.closed and self.queue.empty():
+            return []
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        if first is None:
+            return []
+        batch = [first]
+        while len(batch) < max_events and not self.queue.empty():
+            event = self.queue.get_nowait()
+            if event is None:
+                break
+            batch.append(event)
+        return batch
+    
+    def close(self):
+        """关闭订阅并唤醒等待者"""
+        if self.closed:
+            return
+        self.closed = True
+        self.hub._remove(self)
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            # 队列已满时清掉一个位置放入结束标记
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+class RealtimeHub:
+    """实时事件中心"""
+    
+    def __init__(self, buffer_size: int = 2048, queue_size: int = 512):
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.last_seq = 0
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._subscribers: List[Subscription] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        
+        self.published_count = 0
+        self.dropped_subscribers = 0
+    
+    def _remove(self, subscription: Subscription):
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+            if subscription.overflowed:
+                self.dropped_subscribers += 1
+    
+    def subscribe(self) -> Subscription:
+        """新建订阅（需在事件循环中调用）"""
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(self, self.queue_size)
+        self._subscribers.append(subscription)
+        return subscription
+    
+    def replay(self, since_seq: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        取序号大于since_seq的缓冲事件
+        
+        Returns:
+            Tuple: (事件列表, 是否完整)；缓冲区已不包含since_seq之后的全部事件时不完整，客户端需全量刷新
+        """
+        with self._lock:
+            events = [event for event in self._buffer if event["seq"] > since_seq]
+            oldest = self._buffer[0]["seq"] if self._buffer else self.last_seq + 1
+        complete = since_seq >= oldest - 1 and since_seq <= self.last_seq
+        return events, complete
+    
+    def publish(self, event_type: str, data: Dict[str, Any], durable: bool = True) -> Optional[int]:
+        """
+        发布事件，可在任意线程调用
+        
+        Args:
+            event_type: 事件类型（message/token/status/stats等）
+            data: 事件数据
+            durable: 持久事件分配序号并进入补发缓冲区；非持久事件（如逐字增量）只推送给当前在线的订阅者
+        
+        Returns:
+            Optional[int]: 持久事件的序号
+        """
+        event: Dict[str, Any] = {"type": event_type, "data": data, "ts": datetime.now().isoformat()}
+        seq = None
+        if durable:
+            with self._lock:
+                self.last_seq += 1
+                seq = self.last_seq
+                event["seq"] = seq
+                self._buffer.append(event)
+        self.published_count += 1
+        
+        loop = self._loop
+        if loop is None or not self._subscribers:
+            return seq
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._fan_out(event)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(self._fan_out, event)
+        return seq
+    
+    def _fan_out(self, event: Dict[str, Any]):
+        for subscription in list(self._subscribers):
+            subscription._offer(event)
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取事件中心状态"""
+        return {
+            "last_seq": self.last_seq,
+            "buffered_events": len(self._buffer),
+            "buffer_size": self.buffer_size,
+            "subscribers": len(self._subscribers),
+            "published_count": self.published_count,
+            "dropped_subscribers": self.dropped_subscribers
+        }
+
+# 全局实时事件中心
+realtime_hub = RealtimeHub()
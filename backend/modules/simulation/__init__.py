@@ -5,7 +5,11 @@ AI社群模拟模块
 
 from .agent import Agent, AgentPersonality, AgentOccupation, AgentStats, AgentMemory
 from .events import GameEvent, EventGenerator, EventImpact, EventType, EventSeverity, event_generator
+from .compatibility import CompatibilityIndex, compute_all_pairs_top_k
+from .journal import EventJournal
+from .timeseries import StatsTimeSeries
 from .engine import CommunitySimulation, community_simulation
+from .sharding import ShardedCommunitySimulation
 
 __all__ = [
     # 居民代理相关
@@ -23,7 +27,20 @@ __all__ = [
     "EventSeverity",
     "event_generator",
     
+    # 兼容性评分相关
+    "CompatibilityIndex",
+    "compute_all_pairs_top_k",
+    
+    # 事件日志相关
+    "EventJournal",
+    
+    # 统计时间序列相关
+    "StatsTimeSeries",
+    
     # 模拟引擎相关
     "CommunitySimulation",
-    "community_simulation"
+    "community_simulation",
+    
+    # 分片模拟相关
+    "ShardedCommunitySimulation"
 ] 
\ No newline at end of file
@@ -3,7 +3,7 @@ AI居民代理模块
 定义AI社群中每个居民的属性、行为和状态
 """
 
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 import random
@@ -34,6 +34,141 @@ class AgentOccupation(Enum):
     CHEF = "厨师"
     BUILDER = "建筑工人"
 
+# 职业兼容性表：职业 -> 与之合得来的职业
+OCCUPATION_COMPATIBILITY: Dict[AgentOccupation, Tuple[AgentOccupation, ...]] = {
+    AgentOccupation.TEACHER: (AgentOccupation.STUDENT, AgentOccupation.RESEARCHER),
+    AgentOccupation.DOCTOR: (AgentOccupation.TEACHER, AgentOccupation.RESEARCHER),
+    AgentOccupation.ENGINEER: (AgentOccupation.RESEARCHER, AgentOccupation.BUILDER),
+    AgentOccupation.ARTIST: (AgentOccupation.CHEF, AgentOccupation.TEACHER),
+    AgentOccupation.MERCHANT: (AgentOccupation.FARMER, AgentOccupation.BUILDER),
+    AgentOccupation.CHEF: (AgentOccupation.FARMER, AgentOccupation.ARTIST),
+    AgentOccupation.RESEARCHER: (AgentOccupation.TEACHER, AgentOccupation.DOCTOR, AgentOccupation.ENGINEER)
+}
+
+# 性格兼容性表：性格 -> 与之合得来的性格
+PERSONALITY_COMPATIBILITY: Dict[AgentPersonality, Tuple[AgentPersonality, ...]] = {
+    AgentPersonality.OPTIMISTIC: (AgentPersonality.SOCIAL, AgentPersonality.CREATIVE),
+    AgentPersonality.SOCIAL: (AgentPersonality.OPTIMISTIC, AgentPersonality.LEADER),
+    AgentPersonality.LEADER: (AgentPersonality.SOCIAL, AgentPersonality.ANALYTICAL),
+    AgentPersonality.CREATIVE: (AgentPersonality.OPTIMISTIC,),
+    AgentPersonality.ANALYTICAL: (AgentPersonality.REALISTIC,),
+    AgentPersonality.INTROVERT: (AgentPersonality.SUPPORTER, AgentPersonality.REALISTIC)
+}
+
+# 交友阈值
+FRIENDSHIP_COMPATIBILITY_THRESHOLD = 60  # 兼容性分数需高于该值
+FRIENDSHIP_RELATIONSHIP_THRESHOLD = 50   # 关系强度高于该值视为已是朋友
+
+# 根据职业调整初始属性
+OCCUPATION_STAT_MODIFIERS: Dict[AgentOccupation, Dict[str, int]] = {
+    AgentOccupation.TEACHER: {"education": 20, "social_connections": 15},
+    AgentOccupation.DOCTOR: {"health": 25, "wealth": 15, "education": 15},
+    AgentOccupation.ENGINEER: {"education": 20, "wealth": 10},
+    AgentOccupation.ARTIST: {"happiness": 15, "education": 10},
+    AgentOccupation.MERCHANT: {"wealth": 20, "social_connections": 10},
+    AgentOccupation.FARMER: {"health": 15, "happiness": 10},
+    AgentOccupation.STUDENT: {"education": 15, "happiness": 5},
+    AgentOccupation.RESEARCHER: {"education": 25, "wealth": 5},
+    AgentOccupation.CHEF: {"happiness": 15, "health": 10},
+    AgentOccupation.BUILDER: {"health": 20, "wealth": 5}
+}
+
+# 根据性格调整初始属性
+PERSONALITY_STAT_MODIFIERS: Dict[AgentPersonality, Dict[str, int]] = {
+    AgentPersonality.OPTIMISTIC: {"happiness": 20, "social_connections": 10},
+    AgentPersonality.REALISTIC: {"health": 10, "wealth": 10},
+    AgentPersonality.CREATIVE: {"happiness": 15, "education": 10},
+    AgentPersonality.ANALYTICAL: {"education": 15, "wealth": 5},
+    AgentPersonality.SOCIAL: {"social_connections": 25, "happiness": 10},
+    AgentPersonality.INTROVERT: {"health": 10, "education": 10},
+    AgentPersonality.LEADER: {"social_connections": 20, "wealth": 10},
+    AgentPersonality.SUPPORTER: {"happiness": 10, "social_connections": 15}
+}
+
+# 性格对事件反应强度的倍率
+PERSONALITY_REACTION_MULTIPLIERS: Dict[AgentPersonality, float] = {
+    AgentPersonality.OPTIMISTIC: 0.8,
+    AgentPersonality.REALISTIC: 1.0,
+    AgentPersonality.CREATIVE: 1.2,
+    AgentPersonality.ANALYTICAL: 0.9,
+    AgentPersonality.SOCIAL: 1.1,
+    AgentPersonality.INTROVERT: 0.7,
+    AgentPersonality.LEADER: 1.3,
+    AgentPersonality.SUPPORTER: 1.0
+}
+
+# 职业与事件影响指标的相关性
+OCCUPATION_RELEVANCE: Dict[str, Dict[AgentOccupation, float]] = {
+    "education": {
+        AgentOccupation.TEACHER: 1.5,
+        AgentOccupation.STUDENT: 1.3,
+        AgentOccupation.RESEARCHER: 1.4
+    },
+    "health": {
+        AgentOccupation.DOCTOR: 1.5,
+        AgentOccupation.FARMER: 1.2,
+        AgentOccupation.BUILDER: 1.3
+    },
+    "economy": {
+        AgentOccupation.MERCHANT: 1.5,
+        AgentOccupation.ENGINEER: 1.3,
+        AgentOccupation.ARTIST: 1.2
+    }
+}
+
+def calculate_reaction_intensity(personality: AgentPersonality, event_impact: Dict[str, int]) -> int:
+    """计算某种性格对事件的反应强度（1-5）"""
+    # 基于事件影响的绝对值
+    total_impact = sum(abs(value) for value in event_impact.values())
+    
+    # 根据性格调整
+    multiplier = PERSONALITY_REACTION_MULTIPLIERS.get(personality, 1.0)
+    intensity = int(total_impact * multiplier / 10)
+    
+    return max(1, min(5, intensity))
+
+def classify_emotion(event_impact: Dict[str, int], intensity: int) -> str:
+    """根据事件影响趋势和反应强度得出情绪"""
+    # 计算整体影响趋势
+    total_positive = sum(max(0, value) for value in event_impact.values())
+    total_negative = sum(min(0, value) for value in event_impact.values())
+    
+    if total_positive > abs(total_negative):
+        if intensity >= 4:
+            return "非常高兴"
+        elif intensity >= 3:
+            return "高兴"
+        else:
+            return "满意"
+    elif abs(total_negative) > total_positive:
+        if intensity >= 4:
+            return "非常担忧"
+        elif intensity >= 3:
+            return "担忧"
+        else:
+            return "不满"
+    else:
+        return "平静"
+
+def calculate_personal_impact(occupation: AgentOccupation, event_impact: Dict[str, int], intensity: int) -> Dict[str, int]:
+    """计算事件对某个职业居民的个人影响"""
+    personal_impact = {}
+    
+    for stat, impact in event_impact.items():
+        if stat in ["happiness", "health", "education", "wealth"]:
+            stat_name = stat if stat != "economy" else "wealth"
+            
+            # 基础影响
+            base_impact = impact * (intensity / 5.0)
+            
+            # 应用职业相关性
+            if stat in OCCUPATION_RELEVANCE and occupation in OCCUPATION_RELEVANCE[stat]:
+                base_impact *= OCCUPATION_RELEVANCE[stat][occupation]
+            
+            personal_impact[stat_name] = int(base_impact * 0.5)  # 个人影响通常比社群影响小
+    
+    return personal_impact
+
 @dataclass
 class AgentMemory:
     """居民记忆系统"""
@@ -117,39 +252,13 @@ class Agent:
     
     def _initialize_stats_by_profile(self):
         """根据职业和性格初始化属性"""
-        # 根据职业调整属性
-        occupation_modifiers = {
-            AgentOccupation.TEACHER: {"education": 20, "social_connections": 15},
-            AgentOccupation.DOCTOR: {"health": 25, "wealth": 15, "education": 15},
-            AgentOccupation.ENGINEER: {"education": 20, "wealth": 10},
-            AgentOccupation.ARTIST: {"happiness": 15, "education": 10},
-            AgentOccupation.MERCHANT: {"wealth": 20, "social_connections": 10},
-            AgentOccupation.FARMER: {"health": 15, "happiness": 10},
-            AgentOccupation.STUDENT: {"education": 15, "happiness": 5},
-            AgentOccupation.RESEARCHER: {"education": 25, "wealth": 5},
-            AgentOccupation.CHEF: {"happiness": 15, "health": 10},
-            AgentOccupation.BUILDER: {"health": 20, "wealth": 5}
-        }
-        
-        # 根据性格调整属性
-        personality_modifiers = {
-            AgentPersonality.OPTIMISTIC: {"happiness": 20, "social_connections": 10},
-            AgentPersonality.REALISTIC: {"health": 10, "wealth": 10},
-            AgentPersonality.CREATIVE: {"happiness": 15, "education": 10},
-            AgentPersonality.ANALYTICAL: {"education": 15, "wealth": 5},
-            AgentPersonality.SOCIAL: {"social_connections": 25, "happiness": 10},
-            AgentPersonality.INTROVERT: {"health": 10, "education": 10},
-            AgentPersonality.LEADER: {"social_connections": 20, "wealth": 10},
-            AgentPersonality.SUPPORTER: {"happiness": 10, "social_connections": 15}
-        }
-        
         # 应用职业修饰符
-        if self.occupation in occupation_modifiers:
-            self.stats.update_stats(occupation_modifiers[self.occupation])
+        if self.occupation in OCCUPATION_STAT_MODIFIERS:
+            self.stats.update_stats(OCCUPATION_STAT_MODIFIERS[self.occupation])
         
         # 应用性格修饰符
-        if self.personality in personality_modifiers:
-            self.stats.update_stats(personality_modifiers[self.personality])
+        if self.personality in PERSONALITY_STAT_MODIFIERS:
+            self.stats.update_stats(PERSONALITY_STAT_MODIFIERS[self.personality])
     
     def add_memory(self, event_description: str, importance: int = 3, emotion: str = "中性"):
         """添加记忆"""
@@ -205,86 +314,15 @@ class Agent:
     
     def _calculate_reaction_intensity(self, event_impact: Dict[str, int]) -> int:
         """计算对事件的反应强度"""
-        # 基于事件影响的绝对值
-        total_impact = sum(abs(value) for value in event_impact.values())
-        
-        # 根据性格调整
-        personality_multipliers = {
-            AgentPersonality.OPTIMISTIC: 0.8,
-            AgentPersonality.REALISTIC: 1.0,
-            AgentPersonality.CREATIVE: 1.2,
-            AgentPersonality.ANALYTICAL: 0.9,
-            AgentPersonality.SOCIAL: 1.1,
-            AgentPersonality.INTROVERT: 0.7,
-            AgentPersonality.LEADER: 1.3,
-            AgentPersonality.SUPPORTER: 1.0
-        }
-        
-        multiplier = personality_multipliers.get(self.personality, 1.0)
-        intensity = int(total_impact * multiplier / 10)
-        
-        return max(1, min(5, intensity))
+        return calculate_reaction_intensity(self.personality, event_impact)
     
     def _generate_emotional_response(self, event_impact: Dict[str, int], intensity: int) -> str:
         """生成情绪反应"""
-        # 计算整体影响趋势
-        total_positive = sum(max(0, value) for value in event_impact.values())
-        total_negative = sum(min(0, value) for value in event_impact.values())
-        
-        if total_positive > abs(total_negative):
-            if intensity >= 4:
-                return "非常高兴"
-            elif intensity >= 3:
-                return "高兴"
-            else:
-                return "满意"
-        elif abs(total_negative) > total_positive:
-            if intensity >= 4:
-                return "非常担忧"
-            elif intensity >= 3:
-                return "担忧"
-            else:
-                return "不满"
-        else:
-            return "平静"
+        return classify_emotion(event_impact, intensity)
     
     def _calculate_personal_impact(self, event_impact: Dict[str, int], intensity: int) -> Dict[str, int]:
         """计算事件对个人的影响"""
-        personal_impact = {}
-        
-        # 根据职业相关性调整影响
-        occupation_relevance = {
-            "education": {
-                AgentOccupation.TEACHER: 1.5,
-                AgentOccupation.STUDENT: 1.3,
-                AgentOccupation.RESEARCHER: 1.4
-            },
-            "health": {
-                AgentOccupation.DOCTOR: 1.5,
-                AgentOccupation.FARMER: 1.2,
-                AgentOccupation.BUILDER: 1.3
-            },
-            "economy": {
-                AgentOccupation.MERCHANT: 1.5,
-                AgentOccupation.ENGINEER: 1.3,
-                AgentOccupation.ARTIST: 1.2
-            }
-        }
-        
-        for stat, impact in event_impact.items():
-            if stat in ["happiness", "health", "education", "wealth"]:
-                stat_name = stat if stat != "economy" else "wealth"
-                
-                # 基础影响
-                base_impact = impact * (intensity / 5.0)
-                
-                # 应用职业相关性
-                if stat in occupation_relevance and self.occupation in occupation_relevance[stat]:
-                    base_impact *= occupation_relevance[stat][self.occupation]
-                
-                personal_impact[stat_name] = int(base_impact * 0.5)  # 个人影响通常比社群影响小
-        
-        return personal_impact
+        return calculate_personal_impact(self.occupation, event_impact, intensity)
     
     def _generate_comment(self, event_description: str, emotion: str) -> str:
         """生成对事件的简短评论"""
@@ -317,6 +355,36 @@ class Agent:
             "relationship_count": len(self.relationships)
         }
     
+    def to_snapshot(self) -> Dict[str, Any]:
+        """导出完整档案（用于事件日志快照，不含记忆和对话历史）"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "age": self.age,
+            "personality": self.personality.value,
+            "occupation": self.occupation.value,
+            "interests": list(self.interests),
+            "stats": self.stats.to_dict(),
+            "relationships": dict(self.relationships),
+            "is_active": self.is_active
+        }
+    
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "Agent":
+        """从快照档案恢复居民"""
+        agent = cls(
+            name=data["name"],
+            age=data["age"],
+            personality=AgentPersonality(data["personality"]),
+            occupation=AgentOccupation(data["occupation"]),
+            interests=list(data.get("interests", []))
+        )
+        agent.id = data["id"]
+        agent.stats = AgentStats(**data["stats"])
+        agent.relationships = dict(data.get("relationships", {}))
+        agent.is_active = data.get("is_active", True)
+        return agent
+    
     def get_profile_summary(self) -> str:
         """获取个人资料摘要"""
         return f"{self.name}，{self.age}岁，{self.occupation.value}，性格{self.personality.value}，兴趣爱好：{', '.join(self.interests[:3])}"
@@ -412,6 +480,17 @@ class Agent:
     
     def should_make_friends_with(self, other_agent: 'Agent') -> bool:
         """判断是否应该与另一个居民成为朋友"""
+        if not self._is_friendship_candidate(other_agent):
+            return False
+        
+        # 计算兼容性分数
+        compatibility_score = self._calculate_compatibility(other_agent)
+        
+        # 兼容性分数高于60就可以成为朋友
+        return compatibility_score > FRIENDSHIP_COMPATIBILITY_THRESHOLD
+    
+    def _is_friendship_candidate(self, other_agent: 'Agent') -> bool:
+        """检查兼容性评分之前的前置条件"""
         if not self.is_active or not other_agent.is_active:
             return False
         
@@ -419,14 +498,10 @@ class Agent:
             return False
         
         # 已经是朋友了就不需要重复建立关系
-        if other_agent.id in self.relationships and self.relationships[other_agent.id] > 50:
+        if self.relationships.get(other_agent.id, 0) > FRIENDSHIP_RELATIONSHIP_THRESHOLD:
             return False
         
-        # 计算兼容性分数
-        compatibility_score = self._calculate_compatibility(other_agent)
-        
-        # 兼容性分数高于60就可以成为朋友
-        return compatibility_score > 60
+        return True
     
     def _calculate_compatibility(self, other_agent: 'Agent') -> float:
         """计算与另一个居民的兼容性分数"""
@@ -442,32 +517,11 @@ class Agent:
             score += 5
         
         # 职业相关性
-        occupation_compatibility = {
-            AgentOccupation.TEACHER: [AgentOccupation.STUDENT, AgentOccupation.RESEARCHER],
-            AgentOccupation.DOCTOR: [AgentOccupation.TEACHER, AgentOccupation.RESEARCHER],
-            AgentOccupation.ENGINEER: [AgentOccupation.RESEARCHER, AgentOccupation.BUILDER],
-            AgentOccupation.ARTIST: [AgentOccupation.CHEF, AgentOccupation.TEACHER],
-            AgentOccupation.MERCHANT: [AgentOccupation.FARMER, AgentOccupation.BUILDER],
-            AgentOccupation.CHEF: [AgentOccupation.FARMER, AgentOccupation.ARTIST],
-            AgentOccupation.RESEARCHER: [AgentOccupation.TEACHER, AgentOccupation.DOCTOR, AgentOccupation.ENGINEER]
-        }
-        
-        if (self.occupation in occupation_compatibility and 
-            other_agent.occupation in occupation_compatibility[self.occupation]):
+        if other_agent.occupation in OCCUPATION_COMPATIBILITY.get(self.occupation, ()):
             score += 15
         
         # 性格兼容性
-        personality_compatibility = {
-            AgentPersonality.OPTIMISTIC: [AgentPersonality.SOCIAL, AgentPersonality.CREATIVE],
-            AgentPersonality.SOCIAL: [AgentPersonality.OPTIMISTIC, AgentPersonality.LEADER],
-            AgentPersonality.LEADER: [AgentPersonality.SOCIAL, AgentPersonality.ANALYTICAL],
-            AgentPersonality.CREATIVE: [AgentPersonality.OPTIMISTIC, AgentPersonality.ARTIST],
-            AgentPersonality.ANALYTICAL: [AgentPersonality.REALISTIC, AgentPersonality.RESEARCHER],
-            AgentPersonality.INTROVERT: [AgentPersonality.SUPPORTER, AgentPersonality.REALISTIC]
-        }
-        
-        if (self.personality in personality_compatibility and 
-            other_agent.personality in personality_compatibility[self.personality]):
+        if other_agent.personality in PERSONALITY_COMPATIBILITY.get(self.personality, ()):
             score += 20
         
         # 共同兴趣加分
@@ -481,18 +535,15 @@ class Agent:
         return min(100, max(0, score))
     
     def get_friendship_potential_friends(self, all_agents: List['Agent']) -> List['Agent']:
-        """获取有潜力成为朋友的居民列表"""
-        potential_friends = []
-        
-        for agent in all_agents:
-            if self.should_make_friends_with(agent):
-                potential_friends.append(agent)
+        """获取有潜力成为朋友的居民列表（按兼容性索引批量评分，结果与逐个调用should_make_friends_with一致）"""
+        from .compatibility import CompatibilityIndex  # compatibility依赖本模块，在调用时导入
         
-        # 按兼容性分数排序
-        potential_friends.sort(key=lambda a: self._calculate_compatibility(a), reverse=True)
+        agents = {agent.id: agent for agent in all_agents}
+        agents[self.id] = self
+        index = CompatibilityIndex.from_agents(agents.values())
         
         # 只返回前5个最兼容的
-        return potential_friends[:5]
+        return [agents[agent_id] for agent_id, _ in index.top_k(self.id, 5)]
     
     def initiate_invitation_behavior(self, all_agents: List['Agent']) -> Dict[str, Any]:
         """主动发起邀请行为"""
@@ -0,0 +1,241 @@
+"""
+居民兼容性批量评分模块
+把性格、职业、兴趣编码成小整数/位集特征，按年龄段分块剪枝，
+支持"一个居民对全体"的批量评分和分块多进程的全量Top-K交友推荐
+"""
+
+from typing import Dict, List, Optional, Tuple, Iterable
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import logging
+
+from .agent import (
+    Agent,
+    AgentPersonality,
+    AgentOccupation,
+    OCCUPATION_COMPATIBILITY,
+    PERSONALITY_COMPATIBILITY,
+    FRIENDSHIP_COMPATIBILITY_THRESHOLD,
+    FRIENDSHIP_RELATIONSHIP_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+# 枚举 -> 小整数编码
+PERSONALITY_CODES: Dict[AgentPersonality, int] = {p: i for i, p in enumerate(AgentPersonality)}
+OCCUPATION_CODES: Dict[AgentOccupation, int] = {o: i for i, o in enumerate(AgentOccupation)}
+
+# 按编码展开的兼容性加分表：BONUS[自己的编码][对方的编码]
+OCCUPATION_BONUS: List[List[int]] = [
+    [15 if other in OCCUPATION_COMPATIBILITY.get(occupation, ()) else 0 for other in AgentOccupation]
+    for occupation in AgentOccupation
+]
+PERSONALITY_BONUS: List[List[int]] = [
+    [20 if other in PERSONALITY_COMPATIBILITY.get(personality, ()) else 0 for other in AgentPersonality]
+    for personality in AgentPersonality
+]
+
+# 年龄差 -> 加分（与Agent._calculate_compatibility保持一致）
+MAX_AGE_DIFF = 256
+AGE_BONUS: List[int] = [15 if d <= 5 else 10 if d <= 10 else 5 if d <= 15 else 0 for d in range(MAX_AGE_DIFF)]
+
+AGE_BAND_WIDTH = 5          # 年龄分块宽度（岁）
+DEFAULT_CHUNK_SIZE = 2048   # 全量Top-K时每个任务处理的居民数
+
+if hasattr(int, "bit_count"):
+    _popcount = int.bit_count  # Python 3.10+ 原生实现
+else:
+    def _popcount(value: int) -> int:
+        """统计位集中1的个数"""
+        return bin(value).count("1")
+
+class CompatibilityIndex:
+    """居民兼容性特征索引（列式快照）"""
+    
+    def __init__(self):
+        self.ids: List[str] = []
+        self.ages = array("h")
+        self.personalities = array("b")
+        self.occupations = array("b")
+        self.socials = array("h")
+        self.active = array("b")
+        self.interest_masks: List[int] = []
+        self.friends: List[frozenset] = []
+        self.interest_bits: Dict[str, int] = {}
+        self.position: Dict[str, int] = {}
+        
+        # 年龄分块：块号 -> 居民下标列表 / 块内最大社交值
+        self.bands: Dict[int, List[int]] = {}
+        self.band_max_social: Dict[int, int] = {}
+    
+    @classmethod
+    def from_agents(cls, agents: Iterable[Agent]) -> "CompatibilityIndex":
+        """从居民列表构建索引"""
+        index = cls()
+        agents = list(agents)
+        
+        for agent in agents:
+            index.position[agent.id] = len(index.ids)
+            index.ids.append(agent.id)
+            index.ages.append(max(0, min(MAX_AGE_DIFF - 1, int(agent.age))))
+            index.personalities.append(PERSONALITY_CODES[agent.personality])
+            index.occupations.append(OCCUPATION_CODES[agent.occupation])
+            index.socials.append(int(agent.stats.social_connections))
+            index.active.append(1 if agent.is_active else 0)
+            index.interest_masks.append(index._encode_interests(agent.interests))
+        
+        # 关系图需要在所有ID编码完成后再转换
+        for agent in agents:
+            index.friends.append(frozenset(
+                index.position[other_id]
+                for other_id, strength in agent.relationships.items()
+                if strength > FRIENDSHIP_RELATIONSHIP_THRESHOLD and other_id in index.position
+            ))
+        
+        for i, age in enumerate(index.ages):
+            band = age // AGE_BAND_WIDTH
+            index.bands.setdefault(band, []).append(i)
+            if index.socials[i] > index.band_max_social.get(band, -1):
+                index.band_max_social[band] = index.socials[i]
+        
+        return index
+    
+    def _encode_interests(self, interests: Iterable[str]) -> int:
+        """把兴趣列表编码为位集"""
+        mask = 0
+        for interest in interests:
+            bit = self.interest_bits.get(interest)
+            if bit is None:
+                bit = len(self.interest_bits)
+                self.interest_bits[interest] = bit
+            mask |= 1 << bit
+        return mask
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def score_candidates(
+        self,
+        i: int,
+        threshold: float = FRIENDSHIP_COMPATIBILITY_THRESHOLD
+    ) -> List[Tuple[float, int]]:
+        """
+        计算居民i与所有其他居民的兼容性，返回分数高于阈值的 (分数, 下标) 列表
+        
+        年龄分块剪枝：先按块求分数上界，上界不超过阈值的整块跳过，结果与逐对计算完全一致
+        """
+        if not self.active[i]:
+            return []
+        
+        age_i = self.ages[i]
+        social_i = self.socials[i]
+        mask_i = self.interest_masks[i]
+        occupation_bonus = OCCUPATION_BONUS[self.occupations[i]]
+        personality_bonus = PERSONALITY_BONUS[self.personalities[i]]
+        friends_i = self.friends[i]
+        
+        # 块内除年龄和社交外能拿到的最高加分
+        static_upper = 50.0 + max(occupation_bonus) + max(personality_bonus) + 5 * _popcount(mask_i)
+        
+        ages = self.ages
+        socials = self.socials
+        active = self.active
+        occupations = self.occupations
+        personalities = self.personalities
+        masks = self.interest_masks
+        
+        results: List[Tuple[float, int]] = []
+        for band, members in self.bands.items():
+            low = band * AGE_BAND_WIDTH
+            high = low + AGE_BAND_WIDTH - 1
+            min_diff = 0 if low <= age_i <= high else min(abs(age_i - low), abs(age_i - high))
+            upper = static_upper + AGE_BONUS[min_diff] + ((social_i + self.band_max_social[band]) / 2 - 50) * 0.3
+            if upper <= threshold:
+                continue
+            
+            for j in members:
+                if j == i or not active[j] or j in friends_i:
+                    continue
+                # 运算顺序与Agent._calculate_compatibility一致，保证浮点结果相同
+                score = 50.0
+                score += AGE_BONUS[abs(age_i - ages[j])]
+                score += occupation_bonus[occupations[j]]
+                score += personality_bonus[personalities[j]]
+                score += _popcount(mask_i & masks[j]) * 5
+                score += ((social_i + socials[j]) / 2 - 50) * 0.3
+                score = min(100, max(0, score))
+                if score > threshold:
+                    results.append((score, j))
+        
+        return results
+    
+    def top_k(self, agent_id: str, k: int = 5) -> List[Tuple[str, float]]:
+        """获取单个居民最兼容的k个潜在朋友"""
+        i = self.position.get(agent_id)
+        if i is None:
+            return []
+        return [(self.ids[j], score) for score, j in self._top_k_for_row(i, k)]
+    
+    def _top_k_for_row(self, i: int, k: int) -> List[Tuple[float, int]]:
+        """取分数最高的k个，同分时按下标稳定排序"""
+        return heapq.nlargest(k, self.score_candidates(i), key=lambda item: (item[0], -item[1]))
+
+# 进程池工作进程持有的索引副本（由initializer注入，避免每个任务重复传输）
+_worker_index: Optional[CompatibilityIndex] = None
+
+def _init_worker(index: CompatibilityIndex):
+    """进程池初始化：保存索引"""
+    global _worker_index
+    _worker_index = index
+
+def _top_k_rows(index: CompatibilityIndex, start: int, end: int, k: int) -> List[Tuple[int, List[Tuple[float, int]]]]:
+    """计算一段居民的Top-K"""
+    return [(i, index._top_k_for_row(i, k)) for i in range(start, end)]
+
+def _top_k_chunk(start: int, end: int, k: int) -> List[Tuple[int, List[Tuple[float, int]]]]:
+    """在工作进程中计算一段居民的Top-K"""
+    return _top_k_rows(_worker_index, start, end, k)
+
+def compute_all_pairs_top_k(
+    index: CompatibilityIndex,
+    k: int = 5,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: Optional[int] = None
+) -> Dict[str, List[Tuple[str, float]]]:
+    """
+    全量"谁该和谁交朋友"计算
+    
+    Args:
+        index: 兼容性索引
+        k: 每个居民保留的推荐数
+        chunk_size: 每个任务处理的居民数
+        max_workers: 进程数，None为CPU核数；人口不足一个分块时直接在当前进程计算
+    
+    Returns:
+        Dict: 居民ID -> [(朋友ID, 分数), ...]
+    """
+    n = len(index)
+    chunk_size = max(1, chunk_size)
+    ranges = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    
+    if len(ranges) <= 1 or max_workers == 1:
+        chunks = [_top_k_rows(index, start, end, k) for start, end in ranges]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(index,)
+        ) as executor:
+            futures = [executor.submit(_top_k_chunk, start, end, k) for start, end in ranges]
+            chunks = [future.result() for future in futures]
+    
+    ids = index.ids
+    recommendations: Dict[str, List[Tuple[str, float]]] = {}
+    for chunk in chunks:
+        for i, top in chunk:
+            recommendations[ids[i]] = [(ids[j], score) for score, j in top]
+    
+    logger.info(f"全量交友推荐计算完成: {n}名居民, {len(ranges)}个分块")
+    return recommendations
+
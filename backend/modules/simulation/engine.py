@@ -11,6 +11,12 @@ from datetime import datetime, timedelta
 
 from .agent import Agent, AgentPersonality, AgentOccupation
 from .events import GameEvent, EventGenerator, EventImpact, event_generator
+from .compatibility import CompatibilityIndex, compute_all_pairs_top_k
+from .interactions import InteractionScheduler
+from .journal import EventJournal
+from .timeseries import StatsTimeSeries
+from .sharding import ShardedCommunitySimulation
+from modules.shared.realtime import realtime_hub
 
 class CommunitySimulation:
     """AI社群模拟引擎"""
@@ -26,6 +32,26 @@ class CommunitySimulation:
         self.auto_event_interval_hours = 6  # 自动事件生成间隔
         self.agent_interaction_probability = 0.1  # 居民互动概率
         self.stat_decay_rate = 0.5  # 属性自然衰减率（每天）
+        self.interaction_time_budget_ms = 50.0  # 互动阶段每个周期的时间预算
+        self.stats_sample_interval_seconds = 60  # 社群统计采样间隔
+        self.friend_recommendation_interval_hours = 24  # 全量交友推荐的计算间隔
+        
+        # 居民互动调度
+        self.interaction_scheduler = InteractionScheduler(time_budget_ms=self.interaction_time_budget_ms)
+        
+        # 事件日志（启动时通过recover_from_journal启用）
+        self.journal: Optional[EventJournal] = None
+        
+        # 社群统计历史
+        self.stats_history = StatsTimeSeries()
+        
+        # 最近一次全量交友推荐：居民ID -> 推荐列表
+        self.friend_recommendations: Dict[str, List[Dict[str, Any]]] = {}
+        self.friend_recommendations_updated: Optional[datetime] = None
+        
+        # 分片模式（启动时通过enable_sharding启用）：大规模人口在分片进程中模拟，
+        # 社群统计、居民查询和事件结算合并分片的结果
+        self.shards: Optional[ShardedCommunitySimulation] = None
         
         # 初始化
         self._initialize_default_agents()
@@ -64,12 +90,37 @@ class CommunitySimulation:
         
         # 启动后台任务
         asyncio.create_task(self._simulation_loop())
+        asyncio.create_task(self._stats_sampling_loop())
+        asyncio.create_task(self._friend_recommendation_loop())
     
     async def stop_simulation(self):
         """停止模拟"""
         self.simulation_running = False
         self.logger.info("AI社群模拟已停止")
     
+    async def enable_sharding(self, num_shards: int, population: int, seed: Optional[int] = None) -> Dict[str, Any]:
+        """
+        启用分片模式：启动分片进程并在各分片本地生成人口
+        
+        分片人口按种子生成，不写入事件日志；重启后重新生成
+        """
+        if self.shards is None:
+            shards = ShardedCommunitySimulation(num_shards)
+            await shards.start()
+            try:
+                await shards.populate(population, seed)
+            except Exception:
+                await shards.stop()
+                raise
+            self.shards = shards
+        return await self.shards.get_simulation_status()
+    
+    async def disable_sharding(self):
+        """停止分片进程"""
+        if self.shards is not None:
+            shards, self.shards = self.shards, None
+            await shards.stop()
+    
     async def _simulation_loop(self):
         """模拟主循环"""
         while self.simulation_running:
@@ -80,6 +131,31 @@ class CommunitySimulation:
                 self.logger.error(f"模拟更新出错: {str(e)}")
                 await asyncio.sleep(60)  # 出错后等待1分钟再继续
     
+    async def _stats_sampling_loop(self):
+        """按固定间隔采样社群统计"""
+        while self.simulation_running:
+            try:
+                await self.record_stats_sample()
+            except Exception as e:
+                self.logger.error(f"社群统计采样出错: {str(e)}")
+            await asyncio.sleep(self.stats_sample_interval_seconds)
+    
+    async def _friend_recommendation_loop(self):
+        """按固定间隔（默认每天）全量计算交友推荐"""
+        while self.simulation_running:
+            try:
+                await self.compute_friendship_recommendations()
+            except Exception as e:
+                self.logger.error(f"全量交友推荐计算出错: {str(e)}")
+            await asyncio.sleep(self.friend_recommendation_interval_hours * 3600)
+    
+    async def record_stats_sample(self) -> Dict[str, int]:
+        """记录一条社群统计采样"""
+        community_stats = await self.get_community_stats()
+        self.stats_history.record(community_stats)
+        realtime_hub.publish("stats", community_stats)
+        return community_stats
+    
     async def _update_simulation(self):
         """更新模拟状态"""
         now = datetime.now()
@@ -89,6 +165,9 @@ class CommunitySimulation:
         if hours_passed < 0.1:  # 少于6分钟不更新
             return
         
+        # 居民互动阶段（受时间预算约束）
+        self._run_interaction_phase(hours_passed)
+        
         # 更新社群统计
         await self._update_community_stats()
         
@@ -98,6 +177,25 @@ class CommunitySimulation:
         
         self.last_update = now
     
+    def _run_interaction_phase(self, hours_passed: float):
+        """执行居民之间的互动和属性自然衰减"""
+        self.interaction_scheduler.time_budget_ms = self.interaction_time_budget_ms
+        summary = self.interaction_scheduler.run_tick(
+            self.agents,
+            interaction_probability=self.agent_interaction_probability,
+            stat_decay_rate=self.stat_decay_rate,
+            hours_passed=hours_passed
+        )
+        self.logger.info(f"居民互动阶段完成: {summary}")
+        
+        scheduler = self.interaction_scheduler
+        if scheduler.last_stat_changes or scheduler.last_relationship_changes:
+            self._journal_append(
+                "append_tick",
+                scheduler.last_stat_changes,
+                scheduler.last_relationship_changes
+            )
+    
     async def _update_community_stats(self):
         """更新社群整体统计"""
         if not self.agents:
@@ -132,17 +230,8 @@ class CommunitySimulation:
             await self.apply_event(event)
     
     async def get_community_stats(self) -> Dict[str, int]:
-        """获取社群统计数据"""
+        """获取社群统计数据（分片模式下包含分片人口）"""
         try:
-            if not self.agents:
-                return {
-                    "population": 0,
-                    "happiness": 50,
-                    "health": 50,
-                    "education": 50,
-                    "economy": 50
-                }
-            
             # 计算平均值
             total_happiness = sum(agent.stats.happiness for agent in self.agents.values())
             total_health = sum(agent.stats.health for agent in self.agents.values())
@@ -151,6 +240,23 @@ class CommunitySimulation:
             
             agent_count = len(self.agents)
             
+            if self.shards is not None:
+                shard_count, shard_totals = await self.shards.get_stat_totals()
+                agent_count += shard_count
+                total_happiness += shard_totals["happiness"]
+                total_health += shard_totals["health"]
+                total_education += shard_totals["education"]
+                total_wealth += shard_totals["wealth"]
+            
+            if not agent_count:
+                return {
+                    "population": 0,
+                    "happiness": 50,
+                    "health": 50,
+                    "education": 50,
+                    "economy": 50
+                }
+            
             return {
                 "population": agent_count,
                 "happiness": int(total_happiness / agent_count),
@@ -173,22 +279,37 @@ class CommunitySimulation:
         try:
             # 让居民对事件做出反应
             agent_reactions = []
+            stat_deltas: Dict[str, Dict[str, int]] = {}
             for agent in self.agents.values():
                 if not event.affects_agents or agent.id in event.affects_agents:
+                    before = agent.stats.to_dict()
                     reaction = agent.react_to_event(event.description, event.impact.to_dict())
                     agent_reactions.append(reaction)
+                    
+                    # 记录截断后的实际变化，重放时才能得到相同结果
+                    after = agent.stats.to_dict()
+                    deltas = {stat: after[stat] - value for stat, value in before.items() if after[stat] != value}
+                    if deltas:
+                        stat_deltas[agent.id] = deltas
+            
+            # 分片模式下同一事件广播到各分片结算
+            shard_reactions = await self.shards.broadcast_event(event) if self.shards is not None else None
             
             # 添加到事件历史
             self.event_generator.add_event_to_history(event)
+            self._journal_append("append_event", event.to_dict(), stat_deltas)
             
             self.logger.info(f"事件已应用: {event.title}")
             
-            return {
+            result = {
                 "success": True,
                 "event": event.to_dict(),
                 "agent_reactions": agent_reactions,
                 "community_impact": event.impact.to_dict()
             }
+            if shard_reactions is not None:
+                result["shard_reaction_summary"] = shard_reactions
+            return result
             
         except Exception as e:
             self.logger.error(f"应用事件失败: {str(e)}")
@@ -197,6 +318,69 @@ class CommunitySimulation:
                 "error": str(e)
             }
     
+    def _journal_append(self, method: str, *args) -> Optional[int]:
+        """写入事件日志，到达间隔时自动快照；日志故障不影响模拟本身"""
+        if self.journal is None:
+            return None
+        try:
+            seq = getattr(self.journal, method)(*args)
+            if self.journal.should_snapshot():
+                self.write_journal_snapshot()
+            return seq
+        except Exception as e:
+            self.logger.error(f"写入事件日志失败: {str(e)}")
+            return None
+    
+    def write_journal_snapshot(self) -> int:
+        """把当前完整状态写入日志快照"""
+        return self.journal.write_snapshot(
+            [agent.to_snapshot() for agent in self.agents.values()],
+            [event.to_dict() for event in self.event_generator.recent_events]
+        )
+    
+    def _restore_state(self, state: Dict[str, Any]):
+        """用重放得到的状态替换当前居民和事件历史"""
+        self.agents = {}
+        for profile in state["agents"].values():
+            agent = Agent.from_snapshot(profile)
+            self.agents[agent.id] = agent
+        self.event_generator.recent_events = [GameEvent.from_dict(data) for data in state["events"]]
+    
+    def recover_from_journal(self, journal: EventJournal) -> Dict[str, Any]:
+        """
+        启用事件日志并从中恢复状态
+        
+        日志为空时以当前居民写入初始快照；否则从最新快照重放到最新记录
+        """
+        journal.open()
+        self.journal = journal
+        
+        if journal.last_seq == 0 and not journal.list_snapshots():
+            self.write_journal_snapshot()
+            return {"recovered": False, "seq": 0, "agent_count": len(self.agents)}
+        
+        state = journal.replay()
+        self._restore_state(state)
+        self.logger.info(f"已从事件日志恢复: 序号 {state['seq']}, {len(self.agents)}名居民")
+        return {"recovered": True, "seq": state["seq"], "agent_count": len(self.agents)}
+    
+    def replay_journal(self, until_seq: Optional[int] = None) -> Dict[str, Any]:
+        """重放日志到指定序号（只读，不修改当前状态），用于审计"""
+        if self.journal is None:
+            raise RuntimeError("事件日志未启用")
+        return self.journal.replay(until_seq)
+    
+    def rollback_to(self, seq: int) -> Dict[str, Any]:
+        """回滚到指定序号的状态，回滚本身也记入日志"""
+        if self.journal is None:
+            raise RuntimeError("事件日志未启用")
+        state = self.journal.replay(seq)
+        self._restore_state(state)
+        rollback_seq = self.journal.append_rollback(seq)
+        self.write_journal_snapshot()
+        self.logger.info(f"已回滚到序号 {seq}")
+        return {"target_seq": seq, "rollback_seq": rollback_seq, "agent_count": len(self.agents)}
+    
     def get_all_agents(self) -> List[Agent]:
         """获取所有居民"""
         return list(self.agents.values())
@@ -205,6 +389,42 @@ class CommunitySimulation:
         """根据ID获取居民"""
         return self.agents.get(agent_id)
     
+    async def get_sharded_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        """分片模式下查询分片中的居民（只查询所在的分片）"""
+        if self.shards is None:
+            return None
+        return await self.shards.get_agent_by_id(agent_id)
+    
+    def get_potential_friends(self, agent_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """获取某个居民最兼容的潜在朋友（批量评分）"""
+        index = CompatibilityIndex.from_agents(self.agents.values())
+        return [
+            {"agent_id": other_id, "agent_name": self.agents[other_id].name, "compatibility": round(score, 2)}
+            for other_id, score in index.top_k(agent_id, limit)
+        ]
+    
+    async def compute_friendship_recommendations(
+        self,
+        top_k: int = 5,
+        max_workers: Optional[int] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """全量计算"谁该和谁交朋友"，在后台线程中驱动进程池，不阻塞事件循环；结果保存供查询"""
+        agents = dict(self.agents)
+        index = CompatibilityIndex.from_agents(agents.values())
+        loop = asyncio.get_running_loop()
+        recommendations = await loop.run_in_executor(
+            None, lambda: compute_all_pairs_top_k(index, k=top_k, max_workers=max_workers)
+        )
+        self.friend_recommendations = {
+            agent_id: [
+                {"agent_id": other_id, "agent_name": agents[other_id].name, "compatibility": round(score, 2)}
+                for other_id, score in friends
+            ]
+            for agent_id, friends in recommendations.items()
+        }
+        self.friend_recommendations_updated = datetime.now()
+        return self.friend_recommendations
+    
     def get_simulation_status(self) -> Dict[str, Any]:
         """获取模拟状态"""
         return {
@@ -212,7 +432,11 @@ class CommunitySimulation:
             "agent_count": len(self.agents),
             "last_update": self.last_update.isoformat(),
             "auto_event_interval_hours": self.auto_event_interval_hours,
-            "recent_event_count": len(self.event_generator.recent_events)
+            "recent_event_count": len(self.event_generator.recent_events),
+            "friend_recommendations_updated": self.friend_recommendations_updated.isoformat() if self.friend_recommendations_updated else None,
+            "interaction": self.interaction_scheduler.get_status(),
+            "journal": self.journal.get_status() if self.journal else None,
+            "sharding": {"num_shards": self.shards.num_shards, "is_running": self.shards.is_running} if self.shards else None
         }
     
     async def get_recent_events(self, limit: int = 10) -> List[Dict[str, Any]]:
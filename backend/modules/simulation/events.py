@@ -87,6 +87,24 @@ class GameEvent:
             "metadata": self.metadata
         }
     
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GameEvent":
+        """从字典恢复事件（to_dict的逆操作）"""
+        return cls(
+            id=data["id"],
+            title=data.get("title", ""),
+            description=data.get("description", ""),
+            event_type=EventType(data["event_type"]),
+            severity=EventSeverity(data["severity"]),
+            impact=EventImpact(**data.get("impact", {})),
+            timestamp=datetime.fromisoformat(data["timestamp"]),
+            duration_hours=data.get("duration_hours", 1),
+            triggered_by=data.get("triggered_by", "system"),
+            affects_agents=list(data.get("affects_agents", [])),
+            is_active=data.get("is_active", True),
+            metadata=dict(data.get("metadata", {}))
+        )
+    
     def is_expired(self) -> bool:
         """检查事件是否已过期"""
         if not self.is_active:
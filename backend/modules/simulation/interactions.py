@@ -0,0 +1,322 @@
+"""
+居民互动调度模块
+在每个模拟周期中从关系图采样互动居民对，批量应用关系/属性变化和每日自然衰减，
+整个阶段受硬性时间预算约束，超出预算的工作顺延到下一个周期：
+未来得及处理的互动次数（最多max_pairs_per_tick）计入下个周期，衰减扫描从中断处续做
+"""
+
+from typing import Dict, List, Optional, Any, Tuple
+import random
+import time
+import logging
+
+from .agent import Agent, AgentStats
+
+# 互动结果对属性的影响
+POSITIVE_STAT_DELTAS = {"happiness": 1, "social_connections": 1}
+NEGATIVE_STAT_DELTAS = {"happiness": -1}
+
+# 参与自然衰减的属性，衰减方向为回归到基准值
+DECAY_STATS = ("happiness", "health", "education", "wealth", "social_connections")
+DECAY_BASELINE = 50
+
+class _PartnerWeights:
+    """一个居民选择熟人的抽样权重（树状数组）：修改一项权重和按权重抽样都是O(log n)，不必每次按全部关系重建"""
+    __slots__ = ("relationships", "ids", "position", "tree", "total")
+    
+    def __init__(self, relationships: Dict[str, int], agents: Dict[str, Agent]):
+        self.relationships = relationships  # 建表时的关系字典，居民对象被替换后需要重建
+        self.ids = [other_id for other_id in relationships if other_id in agents]
+        self.position = {other_id: i for i, other_id in enumerate(self.ids)}
+        weights = [relationships[other_id] + 101 for other_id in self.ids]
+        self.total = sum(weights)
+        tree = [0] + weights
+        n = len(weights)
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+    
+    def add(self, other_id: str, weight: int):
+        """追加一个熟人：新节点的值为其覆盖区间内已有权重之和加上新权重"""
+        self.position[other_id] = len(self.ids)
+        self.ids.append(other_id)
+        i = len(self.ids)
+        value = weight
+        j = i - 1
+        stop = i - (i & -i)
+        while j > stop:
+            value += self.tree[j]
+            j -= j & -j
+        self.tree.append(value)
+        self.total += weight
+    
+    def update(self, other_id: str, delta: int):
+        i = self.position[other_id] + 1
+        tree = self.tree
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+        self.total += delta
+    
+    def find(self, target: float) -> str:
+        """前缀和第一次超过target的熟人（与对累计权重做bisect的结果相同）"""
+        tree = self.tree
+        n = len(self.ids)
+        pos = 0
+        step = 1 << (n.bit_length() - 1)
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+        return self.ids[min(pos, n - 1)]
+
+class InteractionScheduler:
+    """居民互动调度器"""
+    
+    def __init__(
+        self,
+        time_budget_ms: float = 50.0,
+        max_pairs_per_tick: int = 5000,
+        known_partner_probability: float = 0.7,
+        seed: Optional[int] = None
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.rng = random.Random(seed)
+        self.time_budget_ms = time_budget_ms
+        self.max_pairs_per_tick = max_pairs_per_tick
+        self.known_partner_probability = known_partner_probability  # 优先和熟人互动的概率
+        
+        # 因超出时间预算顺延到下个周期的互动次数
+        self._pairs_carry = 0
+        
+        # 每个居民选择熟人的抽样权重：跨周期复用，关系变化在批量落地时同步更新
+        self._partner_weights: Dict[str, _PartnerWeights] = {}
+        
+        # 衰减状态：未落地的小数点数，以及跨周期续做的衰减扫描
+        self._decay_carry = 0.0
+        self._sweep_points = 0
+        self._sweep_ids: List[str] = []
+        self._sweep_cursor = 0
+        
+        self.last_tick: Dict[str, Any] = {}
+        
+        # 最近一个周期实际落地的变化（已扣除上下限截断），供事件日志记录
+        self.last_stat_changes: Dict[str, Dict[str, int]] = {}
+        self.last_relationship_changes: List[Tuple[str, str, int]] = []
+    
+    def run_tick(
+        self,
+        agents: Dict[str, Agent],
+        interaction_probability: float,
+        stat_decay_rate: float,
+        hours_passed: float
+    ) -> Dict[str, Any]:
+        """
+        执行一次互动阶段
+        
+        Args:
+            agents: 居民字典 agent_id -> Agent
+            interaction_probability: 每个居民本周期发起互动的概率
+            stat_decay_rate: 每天的属性衰减点数
+            hours_passed: 距上个周期经过的小时数
+        
+        Returns:
+            Dict: 本周期的执行摘要
+        """
+        start = time.perf_counter()
+        deadline = start + self.time_budget_ms / 1000.0
+        self.last_stat_changes = {}
+        self.last_relationship_changes = []
+        
+        interaction_summary = self._run_interactions(agents, interaction_probability, deadline)
+        
+        # 衰减按经过的天数累计，凑满整数点后才开始一次扫描
+        self._decay_carry += stat_decay_rate * hours_passed / 24.0
+        decayed_agents = self._run_decay(agents, deadline)
+        
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self.last_tick = {
+            **interaction_summary,
+            "decayed_agents": decayed_agents,
+            "decay_pending": len(self._sweep_ids) - self._sweep_cursor,
+            "elapsed_ms": round(elapsed_ms, 2),
+            "budget_exhausted": time.perf_counter() >= deadline
+        }
+        return self.last_tick
+    
+    def _run_interactions(
+        self,
+        agents: Dict[str, Agent],
+        interaction_probability: float,
+        deadline: float
+    ) -> Dict[str, Any]:
+        """采样互动居民对，累计变化后一次性批量应用"""
+        agent_ids = list(agents.keys())
+        population = len(agent_ids)
+        if population < 2 or interaction_probability <= 0:
+            self._pairs_carry = 0
+            return {"pairs_planned": 0, "pairs_applied": 0, "pairs_deferred": 0, "positive": 0, "negative": 0}
+        
+        # 上个周期顺延的互动次数并入本周期
+        sampled = self._sample_pair_count(population, interaction_probability)
+        pairs_planned = min(self.max_pairs_per_tick, sampled + self._pairs_carry)
+        initiators = [agent_ids[i] for i in self.rng.sample(range(population), min(pairs_planned, population))]
+        while len(initiators) < pairs_planned:
+            initiators.append(agent_ids[self.rng.randrange(population)])
+        
+        stat_deltas: Dict[str, Dict[str, int]] = {}
+        relationship_deltas: Dict[Tuple[str, str], int] = {}
+        positive = negative = applied = 0
+        processed = len(initiators)
+        
+        for n, initiator_id in enumerate(initiators):
+            # 每64对检查一次时间预算，避免频繁调用计时器
+            if n & 63 == 0 and time.perf_counter() >= deadline:
+                processed = n
+                break
+            
+            initiator = agents[initiator_id]
+            if not initiator.is_active:
+                continue
+            partner = self._pick_partner(initiator, agents, agent_ids)
+            if partner is None or not partner.is_active:
+                continue
+            
+            # 兼容性越高，互动越可能愉快
+            compatibility = initiator._calculate_compatibility(partner)
+            if self.rng.random() * 100 < compatibility:
+                change = self.rng.randint(2, 6)
+                deltas = POSITIVE_STAT_DELTAS
+                positive += 1
+            else:
+                change = -self.rng.randint(1, 4)
+                deltas = NEGATIVE_STAT_DELTAS
+                negative += 1
+            
+            for a, b in ((initiator.id, partner.id), (partner.id, initiator.id)):
+                relationship_deltas[(a, b)] = relationship_deltas.get((a, b), 0) + change
+                agent_deltas = stat_deltas.setdefault(a, {})
+                for stat, delta in deltas.items():
+                    agent_deltas[stat] = agent_deltas.get(stat, 0) + delta
+            applied += 1
+        
+        self._pairs_carry = len(initiators) - processed
+        
+        # 批量落地：每个居民每项属性只更新一次
+        for (a, b), change in relationship_deltas.items():
+            relationships = agents[a].relationships
+            before = relationships.get(b, 0)
+            is_new = b not in relationships
+            agents[a].update_relationship(b, change)
+            weights = self._partner_weights.get(a)
+            if weights is not None and weights.relationships is relationships:
+                if is_new:
+                    weights.add(b, relationships[b] + 101)
+                elif relationships[b] != before:
+                    weights.update(b, relationships[b] - before)
+            if relationships[b] != before:
+                self.last_relationship_changes.append((a, b, relationships[b] - before))
+        for agent_id, deltas in stat_deltas.items():
+            stats = agents[agent_id].stats
+            before = stats.to_dict()
+            stats.update_stats(deltas)
+            self._record_stat_changes(agent_id, before, stats)
+        
+        return {
+            "pairs_planned": pairs_planned,
+            "pairs_applied": applied,
+            "pairs_deferred": self._pairs_carry,
+            "positive": positive,
+            "negative": negative
+        }
+    
+    def _sample_pair_count(self, population: int, probability: float) -> int:
+        """按概率估计本周期的互动次数（正态近似的二项分布抽样）"""
+        probability = min(1.0, probability)
+        mean = population * probability
+        std = (mean * (1 - probability)) ** 0.5
+        return max(0, int(round(self.rng.gauss(mean, std))))
+    
+    def _pick_partner(self, initiator: Agent, agents: Dict[str, Agent], agent_ids: List[str]) -> Optional[Agent]:
+        """从关系图中选择互动对象，关系越好越可能被选中，也有机会结识陌生人"""
+        relationships = initiator.relationships
+        if relationships and self.rng.random() < self.known_partner_probability:
+            weights = self._partner_weights.get(initiator.id)
+            # 居民对象被替换（如从事件日志恢复）时关系字典也随之更换，需要重建
+            if weights is None or weights.relationships is not relationships:
+                weights = self._partner_weights[initiator.id] = _PartnerWeights(relationships, agents)
+            if weights.ids:
+                # 与 rng.choices(候选, 权重) 消耗相同的随机数、得到相同的结果
+                partner = agents.get(weights.find(self.rng.random() * weights.total))
+                if partner is None:
+                    # 对方已不在社群中，下次重建
+                    del self._partner_weights[initiator.id]
+                return partner
+        
+        partner_id = agent_ids[self.rng.randrange(len(agent_ids))]
+        if partner_id == initiator.id:
+            return None
+        return agents[partner_id]
+    
+    def _run_decay(self, agents: Dict[str, Agent], deadline: float) -> int:
+        """属性向基准值自然衰减，可跨周期分段完成"""
+        if self._sweep_cursor >= len(self._sweep_ids):
+            points = int(self._decay_carry)
+            if points <= 0:
+                return 0
+            # 开始新一轮扫描
+            self._decay_carry -= points
+            self._sweep_points = points
+            self._sweep_ids = list(agents.keys())
+            self._sweep_cursor = 0
+        
+        points = self._sweep_points
+        sweep_ids = self._sweep_ids
+        cursor = self._sweep_cursor
+        end = len(sweep_ids)
+        processed = 0
+        
+        while cursor < end:
+            if processed & 255 == 0 and time.perf_counter() >= deadline:
+                break
+            agent = agents.get(sweep_ids[cursor])
+            cursor += 1
+            if agent is None:
+                continue
+            stats = agent.stats
+            before = stats.to_dict()
+            for stat in DECAY_STATS:
+                value = getattr(stats, stat)
+                if value > DECAY_BASELINE:
+                    setattr(stats, stat, max(DECAY_BASELINE, value - points))
+                elif value < DECAY_BASELINE:
+                    setattr(stats, stat, min(DECAY_BASELINE, value + points))
+            self._record_stat_changes(agent.id, before, stats)
+            processed += 1
+        
+        self._sweep_cursor = cursor
+        return processed
+    
+    def _record_stat_changes(self, agent_id: str, before: Dict[str, int], stats: AgentStats) -> None:
+        """累计记录居民属性的实际变化量"""
+        changes = None
+        for stat, old_value in before.items():
+            delta = getattr(stats, stat) - old_value
+            if delta:
+                if changes is None:
+                    changes = self.last_stat_changes.setdefault(agent_id, {})
+                changes[stat] = changes.get(stat, 0) + delta
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取调度器状态"""
+        return {
+            "time_budget_ms": self.time_budget_ms,
+            "max_pairs_per_tick": self.max_pairs_per_tick,
+            "pairs_carry": self._pairs_carry,
+            "decay_carry": round(self._decay_carry, 4),
+            "last_tick": self.last_tick
+        }
@@ -0,0 +1,355 @@
+"""
+模拟事件日志模块
+以追加写的分段文件记录每个已应用事件及其对每个居民的实际属性变化，
+支持从快照确定性重放到任意序号、压缩旧分段和回滚，崩溃后通过重放快速恢复
+"""
+
+from typing import Dict, List, Optional, Any, Tuple, Iterator
+from datetime import datetime
+import json
+import logging
+import os
+import struct
+import zlib
+
+# 记录格式：4字节长度 + 4字节CRC32（大端）+ UTF-8 JSON
+RECORD_HEADER = struct.Struct(">II")
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+SNAPSHOT_PREFIX = "snapshot-"
+SNAPSHOT_SUFFIX = ".json"
+
+# 重放时保留的事件历史条数（与EventGenerator一致）
+MAX_REPLAY_EVENTS = 100
+
+class EventJournal:
+    """追加写事件日志"""
+    
+    def __init__(
+        self,
+        directory: str = "./data/journal",
+        segment_max_bytes: int = 4 * 1024 * 1024,
+        snapshot_interval: int = 500,
+        keep_snapshots: int = 2,
+        fsync: bool = False
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.snapshot_interval = snapshot_interval  # 每追加多少条记录做一次快照
+        self.keep_snapshots = max(1, keep_snapshots)
+        self.fsync = fsync  # 每条记录都落盘，更安全但更慢
+        
+        self.last_seq = 0
+        self.records_since_snapshot = 0
+        self._segment_file = None
+        self._segment_path: Optional[str] = None
+        self._segment_size = 0
+        self._opened = False
+    
+    # ---------- 文件布局 ----------
+    
+    def _segment_name(self, first_seq: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}")
+    
+    def _snapshot_name(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{SNAPSHOT_PREFIX}{seq:012d}{SNAPSHOT_SUFFIX}")
+    
+    def _list_files(self, prefix: str, suffix: str) -> List[Tuple[int, str]]:
+        """列出 (序号, 路径)，按序号升序"""
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(suffix):
+                try:
+                    seq = int(name[len(prefix):-len(suffix)])
+                except ValueError:
+                    continue
+                files.append((seq, os.path.join(self.directory, name)))
+        return sorted(files)
+    
+    def list_segments(self) -> List[Tuple[int, str]]:
+        """列出日志分段 (首条序号, 路径)"""
+        return self._list_files(SEGMENT_PREFIX, SEGMENT_SUFFIX)
+    
+    def list_snapshots(self) -> List[Tuple[int, str]]:
+        """列出快照 (序号, 路径)"""
+        return self._list_files(SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX)
+    
+    # ---------- 打开/关闭 ----------
+    
+    def open(self):
+        """打开日志：扫描已有分段恢复序号，截掉崩溃时写了一半的尾部记录"""
+        if self._opened:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        
+        segments = self.list_segments()
+        snapshots = self.list_snapshots()
+        self.last_seq = snapshots[-1][0] if snapshots else 0
+        
+        if segments:
+            first_seq, path = segments[-1]
+            # 分段以首条记录序号命名，即使为空也能推出之前的最新序号
+            self.last_seq = max(self.last_seq, first_seq - 1)
+            valid_size = 0
+            for record, end_offset in self._read_segment(path):
+                self.last_seq = max(self.last_seq, record["seq"])
+                valid_size = end_offset
+            if valid_size < os.path.getsize(path):
+                self.logger.warning(f"事件日志尾部记录损坏，已截断: {path} ({os.path.getsize(path)} -> {valid_size}字节)")
+                with open(path, "r+b") as f:
+                    f.truncate(valid_size)
+            if valid_size == 0 and first_seq <= self.last_seq:
+                # 空分段的文件名必须对应下一条记录的序号
+                os.remove(path)
+                self._start_segment()
+            else:
+                self._segment_path = path
+                self._segment_size = valid_size
+                self._segment_file = open(path, "ab")
+        else:
+            self._start_segment()
+        
+        self.records_since_snapshot = self.last_seq - (snapshots[-1][0] if snapshots else 0)
+        self._opened = True
+        self.logger.info(f"事件日志已打开: {self.directory}, 最新序号 {self.last_seq}")
+    
+    def close(self):
+        """关闭日志"""
+        if self._segment_file:
+            self._segment_file.flush()
+            if self.fsync:
+                os.fsync(self._segment_file.fileno())
+            self._segment_file.close()
+        self._segment_file = None
+        self._opened = False
+    
+    def _start_segment(self):
+        """以下一条记录的序号开启新分段"""
+        if self._segment_file:
+            self._segment_file.close()
+        self._segment_path = self._segment_name(self.last_seq + 1)
+        self._segment_file = open(self._segment_path, "ab")
+        self._segment_size = 0
+    
+    # ---------- 写入 ----------
+    
+    def append(self, record_type: str, payload: Dict[str, Any]) -> int:
+        """追加一条记录，返回其序号"""
+        if not self._opened:
+            raise RuntimeError("事件日志未打开")
+        
+        seq = self.last_seq + 1
+        record = {"seq": seq, "ts": datetime.now().isoformat(), "type": record_type, **payload}
+        body = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        data = RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+        
+        self._segment_file.write(data)
+        self._segment_file.flush()
+        if self.fsync:
+            os.fsync(self._segment_file.fileno())
+        
+        self.last_seq = seq
+        self.records_since_snapshot += 1
+        self._segment_size += len(data)
+        if self._segment_size >= self.segment_max_bytes:
+            self._start_segment()
+        return seq
+    
+    def append_event(self, event: Dict[str, Any], stat_deltas: Dict[str, Dict[str, int]]) -> int:
+        """记录一个已应用的事件及各居民的实际属性变化"""
+        return self.append("event", {"event": event, "stat_deltas": stat_deltas})
+    
+    def append_tick(
+        self,
+        stat_deltas: Dict[str, Dict[str, int]],
+        relationship_deltas: List[Tuple[str, str, int]]
+    ) -> int:
+        """记录一次互动阶段的属性和关系变化"""
+        return self.append("tick", {
+            "stat_deltas": stat_deltas,
+            "relationship_deltas": [list(change) for change in relationship_deltas]
+        })
+    
+    def append_rollback(self, target_seq: int) -> int:
+        """记录一次回滚：之后的状态从target_seq的状态继续"""
+        return self.append("rollback", {"target_seq": target_seq})
+    
+    def should_snapshot(self) -> bool:
+        """是否到了做快照的时候"""
+        return self.records_since_snapshot >= self.snapshot_interval
+    
+    def write_snapshot(self, agents: List[Dict[str, Any]], events: List[Dict[str, Any]]) -> int:
+        """
+        在当前序号写入完整状态快照，然后切换分段并压缩
+        
+        Args:
+            agents: 居民完整档案列表（Agent.to_snapshot）
+            events: 最近事件列表（GameEvent.to_dict）
+        
+        Returns:
+            int: 快照对应的序号
+        """
+        seq = self.last_seq
+        path = self._snapshot_name(seq)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "seq": seq,
+                "ts": datetime.now().isoformat(),
+                "agents": agents,
+                "events": events[-MAX_REPLAY_EVENTS:]
+            }, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)  # 原子替换，避免半个快照
+        
+        self.records_since_snapshot = 0
+        if self._segment_size > 0:
+            self._start_segment()
+        self.compact()
+        self.logger.info(f"事件日志快照已写入: 序号 {seq}, {len(agents)}名居民")
+        return seq
+    
+    def compact(self) -> Dict[str, int]:
+        """只保留最近几个快照，删除完全被最旧保留快照覆盖的分段"""
+        snapshots = self.list_snapshots()
+        removed_snapshots = 0
+        for _, path in snapshots[:-self.keep_snapshots]:
+            os.remove(path)
+            removed_snapshots += 1
+        snapshots = snapshots[-self.keep_snapshots:]
+        if not snapshots:
+            return {"removed_snapshots": removed_snapshots, "removed_segments": 0}
+        
+        oldest_kept = snapshots[0][0]
+        segments = self.list_segments()
+        removed_segments = 0
+        for (first_seq, path), (next_first_seq, _) in zip(segments, segments[1:]):
+            # 分段覆盖 [first_seq, next_first_seq - 1]
+            if next_first_seq - 1 <= oldest_kept and path != self._segment_path:
+                os.remove(path)
+                removed_segments += 1
+        
+        return {"removed_snapshots": removed_snapshots, "removed_segments": removed_segments}
+    
+    # ---------- 读取 ----------
+    
+    def _read_segment(self, path: str) -> Iterator[Tuple[Dict[str, Any], int]]:
+        """逐条读取分段，返回 (记录, 结束偏移)；遇到不完整或校验失败的记录即停止"""
+        with open(path, "rb") as f:
+            offset = 0
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                length, crc = RECORD_HEADER.unpack(header)
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    return
+                offset += RECORD_HEADER.size + length
+                yield json.loads(body.decode("utf-8")), offset
+    
+    def iter_records(self, after_seq: int = 0, until_seq: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """按序号顺序遍历 (after_seq, until_seq] 范围内的记录"""
+        if self._segment_file:
+            self._segment_file.flush()
+        segments = self.list_segments()
+        for n, (first_seq, path) in enumerate(segments):
+            if until_seq is not None and first_seq > until_seq:
+                return
+            if n + 1 < len(segments) and segments[n + 1][0] - 1 <= after_seq:
+                continue  # 整个分段都在起点之前
+            for record, _ in self._read_segment(path):
+                seq = record["seq"]
+                if seq <= after_seq:
+                    continue
+                if until_seq is not None and seq > until_seq:
+                    return
+                yield record
+    
+    def load_snapshot(self, until_seq: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """读取序号不超过until_seq的最新快照"""
+        candidates = [
+            (seq, path) for seq, path in self.list_snapshots()
+            if until_seq is None or seq <= until_seq
+        ]
+        if not candidates:
+            return None
+        with open(candidates[-1][1], "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    def replay(self, until_seq: Optional[int] = None) -> Dict[str, Any]:
+        """
+        从快照开始按顺序应用记录，重建until_seq时刻的状态
+        
+        Returns:
+            Dict: {"seq": 序号, "agents": {居民ID: 档案}, "events": [事件字典]}
+        """
+        if until_seq is None:
+            until_seq = self.last_seq
+        if until_seq < 0 or until_seq > self.last_seq:
+            raise ValueError(f"序号超出范围: {until_seq} (最新 {self.last_seq})")
+        
+        snapshot = self.load_snapshot(until_seq)
+        if snapshot is None:
+            segments = self.list_segments()
+            if segments and segments[0][0] > 1:
+                raise ValueError(f"序号 {until_seq} 之前的日志已被压缩，无法重放")
+            snapshot = {"seq": 0, "agents": [], "events": []}
+        
+        agents = {profile["id"]: profile for profile in snapshot["agents"]}
+        events = list(snapshot["events"])
+        seq = snapshot["seq"]
+        
+        for record in self.iter_records(after_seq=seq, until_seq=until_seq):
+            record_type = record["type"]
+            if record_type == "rollback":
+                state = self.replay(record["target_seq"])
+                agents, events = state["agents"], state["events"]
+            else:
+                self._apply_stat_deltas(agents, record.get("stat_deltas", {}))
+                for a, b, change in record.get("relationship_deltas", []):
+                    if a in agents:
+                        relationships = agents[a].setdefault("relationships", {})
+                        relationships[b] = relationships.get(b, 0) + change
+                if record_type == "event":
+                    events.append(record["event"])
+                    if len(events) > MAX_REPLAY_EVENTS:
+                        events = events[-MAX_REPLAY_EVENTS:]
+            seq = record["seq"]
+        
+        return {"seq": seq, "agents": agents, "events": events}
+    
+    def _apply_stat_deltas(self, agents: Dict[str, Dict[str, Any]], stat_deltas: Dict[str, Dict[str, int]]):
+        """把记录中的属性变化应用到档案"""
+        for agent_id, deltas in stat_deltas.items():
+            profile = agents.get(agent_id)
+            if profile is None:
+                continue
+            stats = profile["stats"]
+            for stat, delta in deltas.items():
+                stats[stat] = max(0, min(100, stats.get(stat, 50) + delta))
+    
+    def get_recent_records(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """获取最近的若干条记录"""
+        return list(self.iter_records(after_seq=max(0, self.last_seq - limit)))
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取日志状态"""
+        segments = self.list_segments()
+        snapshots = self.list_snapshots()
+        return {
+            "directory": self.directory,
+            "is_open": self._opened,
+            "last_seq": self.last_seq,
+            "records_since_snapshot": self.records_since_snapshot,
+            "snapshot_interval": self.snapshot_interval,
+            "segments": len(segments),
+            "segment_bytes": sum(os.path.getsize(path) for _, path in segments),
+            "snapshots": [seq for seq, _ in snapshots],
+            "oldest_replayable_seq": snapshots[0][0] if snapshots else (0 if not segments or segments[0][0] <= 1 else None)
+        }
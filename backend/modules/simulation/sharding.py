@@ -0,0 +1,431 @@
+"""
+社群模拟分片模块
+按居民ID哈希把人口拆分到多个工作进程，每个分片用列式数组保存属性，
+事件以广播方式下发、各分片本地结算后只回传汇总结果，用于百万级人口的模拟
+"""
+
+from typing import Dict, List, Optional, Any, Tuple
+from array import array
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import uuid
+import zlib
+
+from .agent import (
+    AgentPersonality,
+    AgentOccupation,
+    OCCUPATION_STAT_MODIFIERS,
+    PERSONALITY_STAT_MODIFIERS,
+    calculate_reaction_intensity,
+    classify_emotion,
+    calculate_personal_impact
+)
+from .events import GameEvent, event_generator
+
+# 分片中按列存储的属性
+SHARD_STATS = ("happiness", "health", "education", "wealth", "social_connections")
+
+PERSONALITIES: List[AgentPersonality] = list(AgentPersonality)
+OCCUPATIONS: List[AgentOccupation] = list(AgentOccupation)
+
+# 本地生成居民时使用的姓名素材
+SURNAMES = ["王", "李", "张", "刘", "陈", "杨", "赵", "黄", "周", "吴", "徐", "孙", "胡", "朱", "高", "林", "何", "郭", "马", "罗"]
+GIVEN_NAMES = ["明", "华", "芳", "伟", "娜", "静", "磊", "洋", "艳", "勇", "军", "杰", "娟", "涛", "超", "秀英", "建国", "晓东", "思雨", "子涵"]
+
+def shard_for(agent_id: str, num_shards: int) -> int:
+    """计算居民所属分片（与进程、运行次数无关的稳定哈希）"""
+    return zlib.crc32(agent_id.encode("utf-8")) % num_shards
+
+def _clamp_stat(value: int) -> int:
+    """属性值限制在0-100"""
+    return 0 if value < 0 else 100 if value > 100 else value
+
+class ShardState:
+    """单个分片的居民数据（列式存储）"""
+    
+    def __init__(self, shard_id: int, num_shards: int):
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.ages = array("h")
+        self.personalities = array("b")
+        self.occupations = array("b")
+        self.combos = array("h")  # 性格编码 * 职业数 + 职业编码，用于查事件影响表
+        self.stats: Dict[str, array] = {stat: array("h") for stat in SHARD_STATS}
+        self.position: Dict[str, int] = {}
+        
+        self.personality_counts = [0] * len(PERSONALITIES)
+        self.events_applied = 0
+    
+    def _append(self, agent_id: str, name: str, age: int, personality: int, occupation: int, stats: Dict[str, int]):
+        """追加一名居民"""
+        self.position[agent_id] = len(self.ids)
+        self.ids.append(agent_id)
+        self.names.append(name)
+        self.ages.append(age)
+        self.personalities.append(personality)
+        self.occupations.append(occupation)
+        self.combos.append(personality * len(OCCUPATIONS) + occupation)
+        for stat in SHARD_STATS:
+            self.stats[stat].append(_clamp_stat(int(stats.get(stat, 50))))
+        self.personality_counts[personality] += 1
+    
+    def cmd_add_agents(self, agents: List[Dict[str, Any]]) -> int:
+        """添加居民（字典格式，性格/职业为枚举值）"""
+        personality_codes = {p.value: i for i, p in enumerate(PERSONALITIES)}
+        occupation_codes = {o.value: i for i, o in enumerate(OCCUPATIONS)}
+        added = 0
+        for agent in agents:
+            if agent["id"] in self.position:
+                continue
+            self._append(
+                agent["id"],
+                agent["name"],
+                agent["age"],
+                personality_codes[agent["personality"]],
+                occupation_codes[agent["occupation"]],
+                agent.get("stats", {})
+            )
+            added += 1
+        return added
+    
+    def cmd_populate(self, count: int, seed: Optional[int] = None) -> int:
+        """在分片内直接生成居民，避免经由主进程传输"""
+        rng = random.Random(None if seed is None else seed * 1000003 + self.shard_id)
+        
+        # 每种性格/职业组合的初始属性只算一次
+        initial_stats: Dict[Tuple[int, int], Dict[str, int]] = {}
+        for p, personality in enumerate(PERSONALITIES):
+            for o, occupation in enumerate(OCCUPATIONS):
+                stats = {stat: 50 for stat in SHARD_STATS}
+                for modifiers in (OCCUPATION_STAT_MODIFIERS.get(occupation, {}), PERSONALITY_STAT_MODIFIERS.get(personality, {})):
+                    for stat, change in modifiers.items():
+                        stats[stat] = _clamp_stat(stats[stat] + change)
+                initial_stats[(p, o)] = stats
+        
+        for _ in range(count):
+            # 拒绝采样：只保留哈希落在本分片的ID，保证之后按ID路由能找到
+            while True:
+                agent_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+                if shard_for(agent_id, self.num_shards) == self.shard_id and agent_id not in self.position:
+                    break
+            p = rng.randrange(len(PERSONALITIES))
+            o = rng.randrange(len(OCCUPATIONS))
+            name = rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES)
+            self._append(agent_id, name, rng.randint(18, 80), p, o, initial_stats[(p, o)])
+        
+        return count
+    
+    def cmd_apply_event(self, impact: Dict[str, int], affects_agents: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        在分片内结算事件
+        
+        同性格/职业组合的居民反应完全相同，先按组合预计算属性变化表，再逐列批量更新
+        """
+        if affects_agents:
+            indices = [self.position[agent_id] for agent_id in affects_agents if agent_id in self.position]
+            personality_counts = [0] * len(PERSONALITIES)
+            for i in indices:
+                personality_counts[self.personalities[i]] += 1
+        else:
+            indices = range(len(self.ids))
+            personality_counts = self.personality_counts
+        
+        # 按性格预计算强度和情绪，按组合预计算属性变化
+        intensities = [calculate_reaction_intensity(personality, impact) for personality in PERSONALITIES]
+        delta_tables: Dict[str, List[int]] = {stat: [0] * (len(PERSONALITIES) * len(OCCUPATIONS)) for stat in SHARD_STATS}
+        for p, personality in enumerate(PERSONALITIES):
+            for o, occupation in enumerate(OCCUPATIONS):
+                for stat, change in calculate_personal_impact(occupation, impact, intensities[p]).items():
+                    delta_tables[stat][p * len(OCCUPATIONS) + o] = change
+        
+        combos = self.combos
+        delta_sums: Dict[str, int] = {}
+        for stat, table in delta_tables.items():
+            if not any(table):
+                continue
+            column = self.stats[stat]
+            before = 0
+            after = 0
+            for i in indices:
+                value = column[i]
+                new_value = value + table[combos[i]]
+                new_value = 0 if new_value < 0 else 100 if new_value > 100 else new_value
+                column[i] = new_value
+                before += value
+                after += new_value
+            delta_sums[stat] = after - before
+        
+        emotions: Dict[str, int] = {}
+        for p, count in enumerate(personality_counts):
+            if count:
+                emotion = classify_emotion(impact, intensities[p])
+                emotions[emotion] = emotions.get(emotion, 0) + count
+        
+        self.events_applied += 1
+        return {
+            "reacted": len(indices),
+            "emotions": emotions,
+            "stat_delta_sums": delta_sums
+        }
+    
+    def cmd_aggregates(self) -> Dict[str, Any]:
+        """分片内属性总和"""
+        return {
+            "count": len(self.ids),
+            "sums": {stat: sum(column) for stat, column in self.stats.items()}
+        }
+    
+    def cmd_get_agent(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        """获取单个居民"""
+        i = self.position.get(agent_id)
+        if i is None:
+            return None
+        return {
+            "id": agent_id,
+            "name": self.names[i],
+            "age": self.ages[i],
+            "personality": PERSONALITIES[self.personalities[i]].value,
+            "occupation": OCCUPATIONS[self.occupations[i]].value,
+            "stats": {stat: self.stats[stat][i] for stat in SHARD_STATS},
+            "shard": self.shard_id
+        }
+    
+    def cmd_sample_agents(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """取分片内前若干名居民"""
+        return [self.cmd_get_agent(agent_id) for agent_id in self.ids[:limit]]
+    
+    def cmd_status(self) -> Dict[str, Any]:
+        """分片状态"""
+        return {
+            "shard_id": self.shard_id,
+            "population": len(self.ids),
+            "events_applied": self.events_applied,
+            "pid": os.getpid()
+        }
+
+def _shard_worker_main(shard_id: int, num_shards: int, conn):
+    """分片工作进程主循环：接收 (命令, 参数)，回复 (状态, 结果)"""
+    state = ShardState(shard_id, num_shards)
+    while True:
+        try:
+            command, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+        if command == "stop":
+            conn.send(("ok", None))
+            break
+        try:
+            handler = getattr(state, f"cmd_{command}")
+            conn.send(("ok", handler(**payload)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    conn.close()
+
+class ShardedCommunitySimulation:
+    """分片社群模拟协调器"""
+    
+    def __init__(self, num_shards: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.num_shards = max(1, num_shards or os.cpu_count() or 1)
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List[Any] = []
+        self._connections: List[Any] = []
+        self._locks: List[asyncio.Lock] = []
+        self.is_running = False
+        
+        # 事件历史沿用单进程模拟的事件生成器
+        self.event_generator = event_generator
+    
+    async def start(self):
+        """启动所有分片进程"""
+        if self.is_running:
+            return
+        for shard_id in range(self.num_shards):
+            parent_conn, child_conn = self._context.Pipe()
+            process = self._context.Process(
+                target=_shard_worker_main,
+                args=(shard_id, self.num_shards, child_conn),
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._connections.append(parent_conn)
+            self._locks.append(asyncio.Lock())
+        self.is_running = True
+        self.logger.info(f"分片模拟已启动: {self.num_shards}个分片")
+    
+    async def stop(self):
+        """停止所有分片进程"""
+        if not self.is_running:
+            return
+        await asyncio.gather(*(self._call(shard_id, "stop") for shard_id in range(self.num_shards)), return_exceptions=True)
+        for process in self._processes:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._connections:
+            conn.close()
+        self._processes = []
+        self._connections = []
+        self._locks = []
+        self.is_running = False
+        self.logger.info("分片模拟已停止")
+    
+    def shard_for(self, agent_id: str) -> int:
+        """计算居民所属分片"""
+        return shard_for(agent_id, self.num_shards)
+    
+    def _roundtrip(self, shard_id: int, command: str, payload: Dict[str, Any]) -> Any:
+        """在后台线程中完成一次请求/响应"""
+        conn = self._connections[shard_id]
+        conn.send((command, payload))
+        status, result = conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"分片{shard_id}执行{command}失败: {result}")
+        return result
+    
+    async def _call(self, shard_id: int, command: str, **payload) -> Any:
+        """向单个分片发送命令，同一分片上的请求串行执行"""
+        if not self.is_running:
+            raise RuntimeError("分片模拟未启动")
+        async with self._locks[shard_id]:
+            roundtrip = asyncio.ensure_future(asyncio.to_thread(self._roundtrip, shard_id, command, payload))
+            try:
+                return await asyncio.shield(roundtrip)
+            except asyncio.CancelledError:
+                # 调用方被取消时线程仍阻塞在recv上：等它读完本次回复再释放锁，否则下一个请求会读到这次的回复
+                while not roundtrip.done():
+                    try:
+                        await asyncio.wait({roundtrip})
+                    except asyncio.CancelledError:
+                        continue
+                if not roundtrip.cancelled():
+                    roundtrip.exception()  # 结果已无人接收，避免未读取异常的警告
+                raise
+    
+    async def _broadcast(self, command: str, payloads: Optional[List[Dict[str, Any]]] = None) -> List[Any]:
+        """向所有分片并行发送命令"""
+        payloads = payloads or [{} for _ in range(self.num_shards)]
+        return await asyncio.gather(*(
+            self._call(shard_id, command, **payloads[shard_id]) for shard_id in range(self.num_shards)
+        ))
+    
+    async def add_agents(self, agents: List[Dict[str, Any]]) -> int:
+        """按ID路由添加居民"""
+        payloads: List[Dict[str, Any]] = [{"agents": []} for _ in range(self.num_shards)]
+        for agent in agents:
+            payloads[self.shard_for(agent["id"])]["agents"].append(agent)
+        return sum(await self._broadcast("add_agents", payloads))
+    
+    async def populate(self, count: int, seed: Optional[int] = None) -> int:
+        """在各分片本地生成居民，人口平均分配"""
+        base, extra = divmod(count, self.num_shards)
+        payloads = [
+            {"count": base + (1 if shard_id < extra else 0), "seed": seed}
+            for shard_id in range(self.num_shards)
+        ]
+        total = sum(await self._broadcast("populate", payloads))
+        self.logger.info(f"分片模拟已生成居民: {total}")
+        return total
+    
+    async def broadcast_event(self, event: GameEvent) -> Dict[str, Any]:
+        """广播事件到所有分片结算，返回合并后的反应汇总（不写入事件历史）"""
+        impact = event.impact.to_dict()
+        if event.affects_agents:
+            routed: List[List[str]] = [[] for _ in range(self.num_shards)]
+            for agent_id in event.affects_agents:
+                routed[self.shard_for(agent_id)].append(agent_id)
+            payloads = [{"impact": impact, "affects_agents": ids} for ids in routed]
+        else:
+            payloads = [{"impact": impact, "affects_agents": None} for _ in range(self.num_shards)]
+        
+        results = await self._broadcast("apply_event", payloads)
+        
+        reacted = 0
+        emotions: Dict[str, int] = {}
+        stat_delta_sums: Dict[str, int] = {}
+        for result in results:
+            reacted += result["reacted"]
+            for emotion, count in result["emotions"].items():
+                emotions[emotion] = emotions.get(emotion, 0) + count
+            for stat, delta in result["stat_delta_sums"].items():
+                stat_delta_sums[stat] = stat_delta_sums.get(stat, 0) + delta
+        return {
+            "reacted_agents": reacted,
+            "emotions": emotions,
+            "stat_delta_sums": stat_delta_sums
+        }
+    
+    async def apply_event(self, event: GameEvent) -> Dict[str, Any]:
+        """广播事件到所有分片，合并各分片的反应汇总"""
+        try:
+            reaction_summary = await self.broadcast_event(event)
+            self.event_generator.add_event_to_history(event)
+            self.logger.info(f"事件已应用到{self.num_shards}个分片: {event.title}")
+            
+            return {
+                "success": True,
+                "event": event.to_dict(),
+                "reaction_summary": reaction_summary,
+                "community_impact": event.impact.to_dict()
+            }
+        
+        except Exception as e:
+            self.logger.error(f"分片应用事件失败: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    async def get_stat_totals(self) -> Tuple[int, Dict[str, int]]:
+        """各分片的人口和属性总和"""
+        results = await self._broadcast("aggregates")
+        population = sum(result["count"] for result in results)
+        return population, {stat: sum(result["sums"][stat] for result in results) for stat in SHARD_STATS}
+    
+    async def get_community_stats(self) -> Dict[str, int]:
+        """汇总各分片的属性总和，得到社群统计"""
+        population, totals = await self.get_stat_totals()
+        if population == 0:
+            return {
+                "population": 0,
+                "happiness": 50,
+                "health": 50,
+                "education": 50,
+                "economy": 50
+            }
+        
+        return {
+            "population": population,
+            "happiness": int(totals["happiness"] / population),
+            "health": int(totals["health"] / population),
+            "education": int(totals["education"] / population),
+            "economy": int(totals["wealth"] / population)
+        }
+    
+    async def get_agent_by_id(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        """只查询居民所在的分片"""
+        return await self._call(self.shard_for(agent_id), "get_agent", agent_id=agent_id)
+    
+    async def sample_agents(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """从各分片取样部分居民"""
+        per_shard = max(1, -(-limit // self.num_shards))
+        results = await self._broadcast("sample_agents", [{"limit": per_shard} for _ in range(self.num_shards)])
+        return [agent for shard_agents in results for agent in shard_agents][:limit]
+    
+    async def get_simulation_status(self) -> Dict[str, Any]:
+        """获取分片模拟状态"""
+        shards = await self._broadcast("status") if self.is_running else []
+        return {
+            "is_running": self.is_running,
+            "num_shards": self.num_shards,
+            "population": sum(shard["population"] for shard in shards),
+            "shards": shards
+        }
@@ -0,0 +1,327 @@
+"""
+社群统计时间序列模块
+固定间隔采样人口和四项指数，写入数组环形缓冲区，并自动汇总到分钟/小时/天三个精度，
+以列式二进制文件持久化，按时间范围查询时自动选择合适的精度供图表使用
+"""
+
+from typing import Dict, List, Optional, Any, Tuple
+from array import array
+import bisect
+import json
+import logging
+import os
+import struct
+import time
+
+STAT_FIELDS = ("population", "happiness", "health", "education", "economy")
+
+# 汇总精度：名称 -> (桶宽秒数, 容量)
+ROLLUP_LEVELS: Dict[str, Tuple[int, int]] = {
+    "minute": (60, 2 * 24 * 60),    # 2天
+    "hour": (3600, 120 * 24),       # 120天
+    "day": (86400, 3 * 366)         # 3年
+}
+RAW_CAPACITY = 4096
+
+FILE_MAGIC = b"AISTATS1"
+META_HEADER = struct.Struct(">I")
+
+class _RingView:
+    """按时间顺序访问环形缓冲区的只读视图（供bisect使用）"""
+    
+    def __init__(self, data: array, head: int, size: int):
+        self.data = data
+        self.start = (head - size) % len(data)
+        self.size = size
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def __getitem__(self, i: int):
+        return self.data[(self.start + i) % len(self.data)]
+
+class RawSeries:
+    """原始采样环形缓冲区"""
+    
+    def __init__(self, capacity: int = RAW_CAPACITY):
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+        self.times = array("d", bytes(8 * capacity))
+        self.values: Dict[str, array] = {name: array("d", bytes(8 * capacity)) for name in STAT_FIELDS}
+    
+    def append(self, timestamp: float, sample: Dict[str, float]):
+        """追加一条采样，满了覆盖最旧的"""
+        if self.size and timestamp < self.times[(self.head - 1) % self.capacity]:
+            return  # 保证按时间有序
+        i = self.head
+        self.times[i] = timestamp
+        for name in STAT_FIELDS:
+            self.values[name][i] = sample.get(name, 0)
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+    
+    def oldest_time(self) -> Optional[float]:
+        return _RingView(self.times, self.head, self.size)[0] if self.size else None
+    
+    def query(self, start: float, end: float) -> Dict[str, Any]:
+        """取 [start, end] 范围内的采样（列式）"""
+        view = _RingView(self.times, self.head, self.size)
+        lo = bisect.bisect_left(view, start)
+        hi = bisect.bisect_right(view, end)
+        result: Dict[str, Any] = {"timestamps": [view[i] for i in range(lo, hi)]}
+        for name in STAT_FIELDS:
+            values = _RingView(self.values[name], self.head, self.size)
+            points = [values[i] for i in range(lo, hi)]
+            result[name] = {"avg": points, "min": points, "max": points}
+        return result
+    
+    def columns(self) -> List[array]:
+        return [self.times] + [self.values[name] for name in STAT_FIELDS]
+
+class RollupSeries:
+    """固定桶宽的汇总环形缓冲区，每桶保存count/sum/min/max"""
+    
+    def __init__(self, bucket_seconds: int, capacity: int):
+        self.bucket_seconds = bucket_seconds
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+        self.buckets = array("q", bytes(8 * capacity))  # 桶起始时间（秒）
+        self.counts = array("q", bytes(8 * capacity))
+        self.sums: Dict[str, array] = {name: array("d", bytes(8 * capacity)) for name in STAT_FIELDS}
+        self.mins: Dict[str, array] = {name: array("d", bytes(8 * capacity)) for name in STAT_FIELDS}
+        self.maxs: Dict[str, array] = {name: array("d", bytes(8 * capacity)) for name in STAT_FIELDS}
+    
+    def add(self, timestamp: float, sample: Dict[str, float]):
+        """把一条采样累加到对应的桶"""
+        bucket = int(timestamp // self.bucket_seconds) * self.bucket_seconds
+        last = (self.head - 1) % self.capacity
+        
+        if self.size and self.buckets[last] == bucket:
+            i = last
+            self.counts[i] += 1
+            for name in STAT_FIELDS:
+                value = sample.get(name, 0)
+                self.sums[name][i] += value
+                if value < self.mins[name][i]:
+                    self.mins[name][i] = value
+                if value > self.maxs[name][i]:
+                    self.maxs[name][i] = value
+            return
+        
+        if self.size and bucket < self.buckets[last]:
+            return  # 时钟回拨的迟到采样直接丢弃，保证桶按时间有序
+        
+        i = self.head
+        self.buckets[i] = bucket
+        self.counts[i] = 1
+        for name in STAT_FIELDS:
+            value = sample.get(name, 0)
+            self.sums[name][i] = value
+            self.mins[name][i] = value
+            self.maxs[name][i] = value
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+    
+    def oldest_time(self) -> Optional[float]:
+        return _RingView(self.buckets, self.head, self.size)[0] if self.size else None
+    
+    def query(self, start: float, end: float) -> Dict[str, Any]:
+        """取与 [start, end] 相交的桶（列式）"""
+        view = _RingView(self.buckets, self.head, self.size)
+        lo = bisect.bisect_left(view, start - self.bucket_seconds + 1)
+        hi = bisect.bisect_right(view, end)
+        counts = _RingView(self.counts, self.head, self.size)
+        result: Dict[str, Any] = {"timestamps": [view[i] for i in range(lo, hi)]}
+        for name in STAT_FIELDS:
+            sums = _RingView(self.sums[name], self.head, self.size)
+            mins = _RingView(self.mins[name], self.head, self.size)
+            maxs = _RingView(self.maxs[name], self.head, self.size)
+            result[name] = {
+                "avg": [round(sums[i] / counts[i], 2) for i in range(lo, hi)],
+                "min": [mins[i] for i in range(lo, hi)],
+                "max": [maxs[i] for i in range(lo, hi)]
+            }
+        return result
+    
+    def columns(self) -> List[array]:
+        columns = [self.buckets, self.counts]
+        for name in STAT_FIELDS:
+            columns.extend((self.sums[name], self.mins[name], self.maxs[name]))
+        return columns
+
+class StatsTimeSeries:
+    """社群统计时间序列记录器"""
+    
+    def __init__(self, raw_capacity: int = RAW_CAPACITY, save_every: int = 10):
+        self.logger = logging.getLogger(__name__)
+        self.raw = RawSeries(raw_capacity)
+        self.rollups: Dict[str, RollupSeries] = {
+            name: RollupSeries(bucket_seconds, capacity)
+            for name, (bucket_seconds, capacity) in ROLLUP_LEVELS.items()
+        }
+        self.path: Optional[str] = None
+        self.save_every = save_every  # 每多少条采样写一次文件
+        self._unsaved = 0
+        self.total_samples = 0
+    
+    def record(self, sample: Dict[str, float], timestamp: Optional[float] = None):
+        """记录一条采样，同时累加到所有汇总精度"""
+        timestamp = time.time() if timestamp is None else timestamp
+        self.raw.append(timestamp, sample)
+        for series in self.rollups.values():
+            series.add(timestamp, sample)
+        self.total_samples += 1
+        
+        self._unsaved += 1
+        if self.path and self._unsaved >= self.save_every:
+            try:
+                self.save()
+            except Exception as e:
+                self.logger.error(f"保存统计时间序列失败: {str(e)}")
+    
+    def choose_resolution(self, start: float, end: float, max_points: int) -> str:
+        """选择点数不超过max_points且保留范围覆盖起点的最细精度"""
+        span = max(0.0, end - start)
+        oldest_raw = self.raw.oldest_time()
+        if oldest_raw is not None and oldest_raw <= start:
+            raw_view = _RingView(self.raw.times, self.raw.head, self.raw.size)
+            if len(raw_view) - bisect.bisect_left(raw_view, start) <= max_points:
+                return "raw"
+        for name, series in self.rollups.items():
+            if span / series.bucket_seconds > max_points:
+                continue
+            if series.size < series.capacity or series.oldest_time() <= start:
+                return name
+        return "day"
+    
+    def query(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        resolution: Optional[str] = None,
+        max_points: int = 500
+    ) -> Dict[str, Any]:
+        """
+        按时间范围查询
+        
+        Args:
+            start: 起始时间戳（秒），默认结束前24小时
+            end: 结束时间戳（秒），默认现在
+            resolution: raw/minute/hour/day，None时自动选择
+            max_points: 自动选择精度时的最大点数
+        
+        Returns:
+            Dict: 列式结果 {"resolution", "timestamps", 各指标: {"avg", "min", "max"}}
+        """
+        end = time.time() if end is None else end
+        start = end - 86400 if start is None else start
+        if resolution is None:
+            resolution = self.choose_resolution(start, end, max_points)
+        if resolution == "raw":
+            series, bucket_seconds = self.raw, 0
+        elif resolution in self.rollups:
+            series = self.rollups[resolution]
+            bucket_seconds = series.bucket_seconds
+        else:
+            raise ValueError(f"无效的精度: {resolution}")
+        
+        return {
+            "resolution": resolution,
+            "bucket_seconds": bucket_seconds,
+            "start": start,
+            "end": end,
+            **series.query(start, end)
+        }
+    
+    # ---------- 持久化 ----------
+    
+    def _all_series(self) -> List[Tuple[str, Any]]:
+        return [("raw", self.raw)] + list(self.rollups.items())
+    
+    def attach_file(self, path: str):
+        """绑定持久化文件，存在时先加载"""
+        self.path = path
+        if os.path.exists(path):
+            self.load(path)
+    
+    def save(self, path: Optional[str] = None):
+        """把所有缓冲区按列写入二进制文件"""
+        path = path or self.path
+        if not path:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        meta = {
+            "fields": list(STAT_FIELDS),
+            "total_samples": self.total_samples,
+            "series": {
+                name: {
+                    "capacity": series.capacity,
+                    "head": series.head,
+                    "size": series.size,
+                    "bucket_seconds": getattr(series, "bucket_seconds", 0)
+                }
+                for name, series in self._all_series()
+            }
+        }
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(FILE_MAGIC)
+            f.write(META_HEADER.pack(len(meta_bytes)))
+            f.write(meta_bytes)
+            for _, series in self._all_series():
+                for column in series.columns():
+                    column.tofile(f)
+        os.replace(tmp_path, path)
+        self._unsaved = 0
+    
+    def load(self, path: str):
+        """从二进制文件加载；格式或容量不一致时放弃加载"""
+        with open(path, "rb") as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                self.logger.warning(f"统计时间序列文件格式不符，已忽略: {path}")
+                return
+            (meta_length,) = META_HEADER.unpack(f.read(META_HEADER.size))
+            meta = json.loads(f.read(meta_length).decode("utf-8"))
+            
+            if meta.get("fields") != list(STAT_FIELDS):
+                self.logger.warning(f"统计时间序列字段不一致，已忽略: {path}")
+                return
+            for name, series in self._all_series():
+                info = meta["series"].get(name)
+                if not info or info["capacity"] != series.capacity or info["bucket_seconds"] != getattr(series, "bucket_seconds", 0):
+                    self.logger.warning(f"统计时间序列容量配置已变化，已忽略: {path}")
+                    return
+            
+            for name, series in self._all_series():
+                info = meta["series"][name]
+                for column in series.columns():
+                    loaded = array(column.typecode)
+                    loaded.fromfile(f, series.capacity)
+                    column[:] = loaded
+                series.head = info["head"]
+                series.size = info["size"]
+        
+        self.total_samples = meta.get("total_samples", 0)
+        self.logger.info(f"已加载统计时间序列: {path}, {self.total_samples}条采样")
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取记录器状态"""
+        return {
+            "path": self.path,
+            "total_samples": self.total_samples,
+            "series": {
+                name: {
+                    "size": series.size,
+                    "capacity": series.capacity,
+                    "oldest": series.oldest_time()
+                }
+                for name, series in self._all_series()
+            }
+        }